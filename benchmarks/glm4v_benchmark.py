@@ -0,0 +1,151 @@
+"""
+GLM-4V 批量反推基准
+
+不依赖ComfyUI：comfy用空模块代替，直接调用GLM4VImageDescription_V2.describe_image，
+对同一组随机图像按不同批大小反推，统计每个批大小的吞吐量（张/s）和单张平均耗时，
+并检查温度为0时各批大小的描述是否与批大小1一致，结果输出为JSON。
+第一次调用（加载模型）单独计时，不计入吞吐量，计时期间模型常驻；
+--preload先在后台预加载并预热模型、等待完成后再计第一次调用，与不加--preload的结果对比即为冷启动与预热后的首次调用延迟。
+--load-mode选择节点的加载模式，结果中记录加载耗时、加载后的常驻内存和各批大小的解码速度（tok/s），
+每种加载模式分别运行一次（新进程）即可对比。
+
+用法：
+    python benchmarks/glm4v_benchmark.py --model GLM-4.1V-9B-Thinking
+    python benchmarks/glm4v_benchmark.py --model /path/to/model --images 16 --batch-sizes 1 2 4 8 -o glm4v.json
+    python benchmarks/glm4v_benchmark.py --model GLM-4.1V-9B-Thinking --images 1 --batch-sizes 1 --preload
+    python benchmarks/glm4v_benchmark.py --model GLM-4.1V-9B-Thinking --load-mode int8动态量化 -o glm4v_int8.json
+    python benchmarks/glm4v_benchmark.py --model GLM-4.1V-9B-Thinking --size 3840 --images 2 --max-side 1024
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import importlib
+import contextlib
+
+# 基准测试不能命中响应缓存，必须在导入节点之前设置
+os.environ["ALWAYSONLINE_GLM_CACHE_MB"] = "0"
+
+import torch
+
+from watermark_benchmark import PACKAGE_NAME, load_node_module
+
+
+def load_glm_module():
+    """导入glm4v/nodes.py"""
+    load_node_module()
+    return importlib.import_module(f"{PACKAGE_NAME}.glm4v.nodes")
+
+
+def random_images(count, size, seed=0):
+    """[count, size, size, 3] float32 随机图像"""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(count, size, size, 3, generator=generator)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GLM-4V 批量反推基准")
+    parser.add_argument("--model", required=True, help="models/LLM下的模型目录名或模型的绝对路径")
+    parser.add_argument("--images", type=int, default=8, help="每轮反推的图像数")
+    parser.add_argument("--size", type=int, default=448, help="图像边长（像素）")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--prompt", default="简单描述这张图片内容")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--preload", action="store_true", help="第一次调用前先后台预加载并预热模型")
+    parser.add_argument("--load-mode", default="默认", help="加载模式：默认、int8动态量化、低内存、限额卸载")
+    parser.add_argument("--max-side", type=int, default=0, help="图像最长边（像素），超过时等比缩小，0为不限制")
+    parser.add_argument("--max-megapixels", type=float, default=0.0, help="图像最大像素数（百万），0为不限制")
+    parser.add_argument("-o", "--output", help="结果JSON的保存路径（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    glm = load_glm_module()
+    loading = importlib.import_module(f"{PACKAGE_NAME}.glm4v.loading")
+    node = glm.GLM4VImageDescription_V2()
+    images = random_images(args.images, args.size)
+
+    def describe(batch_size, count=args.images):
+        """返回(描述列表, 性能报告中的meta)"""
+        # 温度为0时为贪心解码，不同批大小的结果可以直接比较
+        outputs = node.describe_image(images[:count], args.model, args.prompt, 0.0, 1.0, 1,
+                                      args.max_new_tokens, 1.0, False, 批大小=batch_size,
+                                      加载模式=args.load_mode, 最长边=args.max_side,
+                                      最大百万像素=args.max_megapixels, profile=True)
+        return outputs[0], json.loads(outputs[-1])["meta"]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        preload_seconds = 0.0
+        if args.preload:
+            start = time.perf_counter()
+            glm.preload.preload(args.model, 加载模式=args.load_mode)
+            glm.preload.wait_for_preload(glm.model_key(args.model, 加载模式=args.load_mode))
+            preload_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        _, first_meta = describe(1, 1)
+        first_call_seconds = time.perf_counter() - start
+    # 预加载时模型在后台线程中加载，加载耗时不在首次调用的报告中；常驻内存统一取首次调用之后的值
+    load_meta = {name: first_meta[name] for name in ("load_seconds", "load_rss_delta_mb") if name in first_meta}
+    load_meta["rss_mb"] = round(loading.resident_bytes() / 1048576, 1)
+    print(f"{'预热后' if args.preload else '冷启动'}首次调用: {first_call_seconds:.2f}s"
+          + (f" (预加载+预热{preload_seconds:.2f}s)" if args.preload else "")
+          + f", 加载模式{args.load_mode}, 常驻内存{load_meta['rss_mb']:.0f}MB", file=sys.stderr)
+
+    rows, reference = [], None
+    for batch_size in args.batch_sizes:
+        seconds, decode_speeds = [], []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                answers, meta = describe(batch_size)
+                seconds.append(time.perf_counter() - start)
+                decode_speeds.append(meta.get("decode_tokens_per_second", 0.0))
+        reference = answers if reference is None else reference
+        best = min(seconds)
+        rows.append({
+            "batch_size": batch_size,
+            "images_per_second": round(args.images / best, 3),
+            "ms_per_image": round(best / args.images * 1000, 1),
+            "decode_tokens_per_second": max(decode_speeds),
+            "matches_first": round(sum(a == b for a, b in zip(answers, reference)) / len(answers), 4),
+        })
+        print(f"批大小{batch_size}: {rows[-1]['images_per_second']:.2f} 张/s, "
+              f"{rows[-1]['ms_per_image']:.0f}ms/张, 解码{rows[-1]['decode_tokens_per_second']:.1f} tok/s, 与批大小{args.batch_sizes[0]}一致 {rows[-1]['matches_first']:.0%}",
+              file=sys.stderr)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+            "model": args.model,
+            "images": args.images,
+            "size": args.size,
+            "max_new_tokens": args.max_new_tokens,
+            "preload": args.preload,
+            "load_mode": args.load_mode,
+            "max_side": args.max_side,
+            "max_megapixels": args.max_megapixels,
+            "visual_tokens_per_image": first_meta.get("visual_tokens_per_image"),
+            **load_meta,
+            "preload_seconds": round(preload_seconds, 2),
+            "first_call_seconds": round(first_call_seconds, 3),
+        },
+        "results": rows,
+    }
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
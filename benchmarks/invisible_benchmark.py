@@ -0,0 +1,173 @@
+"""
+隐形水印性能与鲁棒性基准
+
+不依赖ComfyUI：调用InvisibleWatermark/InvisibleWatermarkDetector节点，统计嵌入和检测的吞吐量、PSNR，
+以及JPEG按不同质量重新编码后的逐帧比特正确率、单帧检出率和整段检出结果，结果输出为JSON。
+默认用1/f频谱的随机图像模拟自然画面的频谱分布，也可以用--images指定真实图片目录。
+
+用法：
+    python benchmarks/invisible_benchmark.py
+    python benchmarks/invisible_benchmark.py --resolution 1080p --frames 240 --qualities 90 75 50
+    python benchmarks/invisible_benchmark.py --images ./frames --strength 0.1 -o invisible.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+
+import numpy as np
+import torch
+from PIL import Image
+
+from watermark_benchmark import RESOLUTIONS, PACKAGE_NAME, load_node_module
+
+MESSAGE = "AO-2024"
+KEY = 20240601
+
+
+def natural_frames(count, height, width, seed=0):
+    """1/f幅度谱、随机相位的彩色图像，[count, H, W, 3] float32"""
+    generator = np.random.default_rng(seed)
+    fy = np.fft.fftfreq(height)[:, None]
+    fx = np.fft.rfftfreq(width)[None, :]
+    falloff = np.sqrt(fy ** 2 + fx ** 2)
+    falloff[0, 0] = 1.0
+    frames = np.empty((count, height, width, 3), dtype=np.float32)
+    for i in range(count):
+        shape = (3, height, width // 2 + 1)
+        spectrum = (generator.normal(size=shape) + 1j * generator.normal(size=shape)) / falloff
+        image = np.fft.irfft2(spectrum, s=(height, width)).transpose(1, 2, 0)
+        frames[i] = (image - image.min()) / (image.max() - image.min())
+    return torch.from_numpy(frames)
+
+
+def load_frames(directory, count, height, width):
+    """读取目录中的图片并缩放到指定分辨率，不足count张时循环使用"""
+    files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp", ".bmp")))
+    if not files:
+        raise SystemExit(f"目录中没有图片: {directory}")
+    frames = np.empty((count, height, width, 3), dtype=np.float32)
+    for i in range(count):
+        with Image.open(files[i % len(files)]) as img:
+            frames[i] = np.asarray(img.convert("RGB").resize((width, height), Image.BICUBIC)) / 255.0
+    return torch.from_numpy(frames)
+
+
+def jpeg_roundtrip(frames, quality):
+    """逐帧按指定质量编码成JPEG再解码"""
+    output = np.empty(tuple(frames.shape), dtype=np.float32)
+    for i, frame in enumerate(frames):
+        buffer = io.BytesIO()
+        pixels = frame.mul(255.0).round_().clamp_(0, 255).to(torch.uint8).numpy()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=quality)
+        buffer.seek(0)
+        output[i] = np.asarray(Image.open(buffer)) / 255.0
+    return torch.from_numpy(output)
+
+
+def psnr(reference, marked):
+    mse = float(torch.mean((reference - marked) ** 2))
+    return round(10 * np.log10(1.0 / max(mse, 1e-12)), 2)
+
+
+def evaluate(invisible, frames, expected_bits):
+    """逐帧z分数 → 比特正确率、单帧检出率和整段检测结果"""
+    scores = invisible.bit_scores(frames, KEY)
+    frame_bits = (scores > 0).numpy()
+    single = [invisible.detect(scores[i:i + 1]) for i in range(len(scores))]
+    clip = invisible.detect(scores)
+    return {
+        "bit_accuracy": round(float((frame_bits == expected_bits[None]).mean()), 4),
+        "frame_detection_rate": round(sum(r["detected"] and r["message"] == MESSAGE for r in single) / len(single), 4),
+        "clip_detected": clip["detected"],
+        "clip_message": clip["message"],
+        "clip_score": round(clip["score"], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="隐形水印性能与鲁棒性基准")
+    parser.add_argument("--resolution", choices=list(RESOLUTIONS), default="720p")
+    parser.add_argument("--frames", type=int, default=24, help="用于计时的帧数")
+    parser.add_argument("--eval-frames", type=int, default=8, help="用于鲁棒性测试的帧数")
+    parser.add_argument("--strength", type=float, default=0.15)
+    parser.add_argument("--qualities", nargs="+", type=int, default=[95, 85, 75, 50])
+    parser.add_argument("--images", help="真实图片目录（默认使用1/f随机图像）")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("-o", "--output", help="结果JSON的保存路径（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    node_module = load_node_module()
+    invisible = sys.modules[f"{PACKAGE_NAME}.watermark.invisible"]
+    width, height = RESOLUTIONS[args.resolution]
+    count = max(args.frames, args.eval_frames)
+    if args.images:
+        frames = load_frames(args.images, count, height, width)
+    else:
+        frames = natural_frames(count, height, width)
+
+    embedder = node_module.InvisibleWatermark()
+    detector = node_module.InvisibleWatermarkDetector()
+    embed_seconds, detect_seconds = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 第一次调用生成嵌入位置，不计时
+        embedder.embed_watermark(frames[:1], MESSAGE, KEY, args.strength)
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            marked = embedder.embed_watermark(frames[:args.frames], MESSAGE, KEY, args.strength)[0]
+            embed_seconds.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            detector.detect_watermark(marked, KEY)
+            detect_seconds.append(time.perf_counter() - start)
+
+    reference = frames[:args.eval_frames]
+    marked = marked[:args.eval_frames]
+    expected_bits = invisible.encode_payload(MESSAGE).astype(bool)
+    robustness = [dict(quality=None, **evaluate(invisible, marked, expected_bits))]
+    for quality in args.qualities:
+        robustness.append(dict(quality=quality, **evaluate(invisible, jpeg_roundtrip(marked, quality), expected_bits)))
+    clean = invisible.detect(invisible.bit_scores(reference, KEY))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "resolution": args.resolution,
+            "frames": args.frames,
+            "eval_frames": args.eval_frames,
+            "strength": args.strength,
+            "source": args.images or "1/f随机图像",
+        },
+        "embed_fps": round(args.frames / min(embed_seconds), 2),
+        "detect_fps": round(args.frames / min(detect_seconds), 2),
+        "psnr_db": psnr(reference, marked),
+        "robustness": robustness,
+        "unmarked": {"detected": clean["detected"], "score": round(clean["score"], 3)},
+    }
+    print(f"{args.resolution} x{args.frames}: 嵌入{results['embed_fps']:.1f} fps, 检测{results['detect_fps']:.1f} fps, "
+          f"PSNR {results['psnr_db']:.1f}dB", file=sys.stderr)
+    for row in robustness:
+        print(f"JPEG {row['quality'] or '原图'}: 比特正确率{row['bit_accuracy']:.2%}, "
+              f"单帧检出率{row['frame_detection_rate']:.0%}, 整段{'检出' if row['clip_detected'] else '未检出'}",
+              file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
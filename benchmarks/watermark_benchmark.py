@@ -0,0 +1,276 @@
+"""
+MovingWatermark 性能基准
+
+不依赖ComfyUI：comfy模块用空模块代替，直接调用MovingWatermark.apply_watermark，
+用随机张量测试不同分辨率、批量大小、轨迹和效果组合下的吞吐量、单帧延迟和峰值内存，
+fps和延迟只统计绘制，uint8模式下的类型转换耗时单独记录在convert_ms，
+结果输出为JSON，可与之前保存的基线对比。
+
+用法：
+    python benchmarks/watermark_benchmark.py                       # 快速预设
+    python benchmarks/watermark_benchmark.py --preset full -o new.json
+    python benchmarks/watermark_benchmark.py --baseline old.json  # 与基线对比，变慢超过容差时返回1
+    python benchmarks/watermark_benchmark.py --resolutions 1080p --batch-sizes 1 60 --effects 描边 旋转
+"""
+import os
+import io
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import itertools
+import importlib
+import contextlib
+
+# 结果缓存默认关闭；环境中开启了也要关掉，基准测试不能命中缓存，必须在导入节点之前设置
+os.environ["ALWAYSONLINE_WATERMARK_CACHE_MB"] = "0"
+os.environ.pop("ALWAYSONLINE_WATERMARK_CACHE_DIR", None)
+
+import numpy as np
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "alwaysonline_benchmark"
+
+RESOLUTIONS = {
+    "512": (512, 512),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+# 每种效果对应传给apply_watermark的参数
+EFFECTS = {
+    "无": {},
+    "描边": {"stroke_width": 3, "stroke_color": "#000000"},
+    "阴影": {"shadow": True, "shadow_color": "#000000", "shadow_offset": 3},
+    "模糊": {"blur_radius": 2.0},
+    "旋转": {"rotation": 30},
+    "动态字号": {"dynamic_size": True, "min_size": 24, "max_size": 96},
+    "全部": {"stroke_width": 3, "stroke_color": "#000000", "shadow": True, "shadow_color": "#000000",
+             "shadow_offset": 3, "blur_radius": 2.0, "rotation": 30,
+             "dynamic_size": True, "min_size": 24, "max_size": 96},
+}
+
+CUSTOM_TRAJECTORY = json.dumps([[0.1, 0.1], [0.9, 0.1], [0.9, 0.9], [0.1, 0.9], [0.1, 0.1]])
+
+PRESETS = {
+    "quick": {
+        "resolutions": ["512", "1080p"],
+        "batch_sizes": [1, 24],
+        "trajectories": ["水平", "圆形", "随机"],
+        "effects": ["无", "描边", "全部"],
+    },
+    "full": {
+        "resolutions": list(RESOLUTIONS),
+        "batch_sizes": [1, 16, 60, 120, 240],
+        "trajectories": None,  # 全部轨迹
+        "effects": list(EFFECTS),
+    },
+}
+
+
+def load_node_module():
+    """在不执行插件__init__（会导入GLM-4V/transformers）的情况下导入nodes.py"""
+    if "comfy" not in sys.modules:
+        sys.modules["comfy"] = types.ModuleType("comfy")
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.nodes")
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q)) if values else 0.0
+
+
+def case_id(case):
+    suffix = "" if case.get("dtype", "float32") == "float32" else f"|{case['dtype']}"
+    return f"{case['resolution']}|b{case['batch']}|{case['trajectory']}|{case['effect']}{suffix}"
+
+
+def to_uint8(image):
+    return image.mul(255.0).round_().clamp_(0, 255).to(torch.uint8)
+
+
+def to_float(image):
+    return image.to(torch.float32).div_(255.0)
+
+
+def run_case(node_module, case, repeats, warmup, node_options, max_input_mb):
+    """运行一个组合，返回结果字典"""
+    width, height = RESOLUTIONS[case["resolution"]]
+    batch = case["batch"]
+    input_mb = batch * width * height * 3 * 4 / (1024 * 1024)
+    result = dict(case, id=case_id(case), width=width, height=height, input_mb=round(input_mb, 1))
+    if max_input_mb and input_mb > max_input_mb:
+        result["skipped"] = f"输入{input_mb:.0f}MB超过--max-input-mb"
+        return result
+
+    generator = torch.Generator().manual_seed(0)
+    image = torch.rand(batch, height, width, 3, generator=generator)
+    params = dict(text="AlwaysOnline 水印", font_size=48, font_color="#FFFFFF", opacity=0.7, speed=1.0,
+                  trajectory=case["trajectory"], frame_index=0, total_frames=max(batch, 2),
+                  custom_trajectory=CUSTOM_TRAJECTORY)
+    params.update(EFFECTS[case["effect"]])
+    params.update(node_options)
+
+    node = node_module.MovingWatermark()
+    memory = importlib.import_module(f"{PACKAGE_NAME}.watermark.memory")
+    # uint8模式：ComfyUI的float32图像先转换成uint8，在uint8上合成再转换回来，
+    # 转换和绘制分别计时；float32模式没有转换
+    uint8 = case.get("dtype") == "uint8"
+    frame_ms, convert_ms = [], []
+    peak_delta = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup + repeats):
+            start_rss = memory.current_rss_bytes()
+            memory.reset_peak_rss()
+            convert = 0.0
+            source = image
+            if uint8:
+                start = time.perf_counter()
+                source = to_uint8(image)
+                convert += time.perf_counter() - start
+            start = time.perf_counter()
+            output = node.apply_watermark(source, **params)[0]
+            elapsed = time.perf_counter() - start
+            if uint8:
+                start = time.perf_counter()
+                output = to_float(output)
+                convert += time.perf_counter() - start
+            peak_delta = max(peak_delta, memory.peak_rss_bytes() - start_rss)
+            del output, source
+            if i >= warmup:
+                frame_ms.append(elapsed * 1000 / batch)
+                convert_ms.append(convert * 1000 / batch)
+
+    total_seconds = sum(frame_ms) * batch / 1000
+    result.update(
+        fps=round(repeats * batch / max(total_seconds, 1e-9), 2),
+        latency_ms={
+            "mean": round(float(np.mean(frame_ms)), 3),
+            "p50": round(percentile(frame_ms, 50), 3),
+            "p90": round(percentile(frame_ms, 90), 3),
+            "p99": round(percentile(frame_ms, 99), 3),
+        },
+        convert_ms=round(float(np.mean(convert_ms)), 3),
+        peak_mb=round(memory.peak_rss_bytes() / (1024 * 1024), 1),
+        peak_delta_mb=round(max(peak_delta, 0) / (1024 * 1024), 1),
+    )
+    return result
+
+
+def build_cases(resolutions, batch_sizes, trajectories, effects, dtypes=("float32",)):
+    return [
+        {"resolution": r, "batch": b, "trajectory": t, "effect": e, "dtype": d}
+        for r, b, t, e, d in itertools.product(resolutions, batch_sizes, trajectories, effects, dtypes)
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """按组合id与基线对比fps，返回(对比行列表, 是否有退化)"""
+    previous = {case["id"]: case for case in baseline.get("cases", []) if "fps" in case}
+    rows, regressed = [], False
+    for case in results["cases"]:
+        old = previous.get(case["id"])
+        if old is None or "fps" not in case:
+            continue
+        ratio = case["fps"] / max(old["fps"], 1e-9)
+        status = "持平"
+        if ratio < 1 - tolerance:
+            status = "变慢"
+            regressed = True
+        elif ratio > 1 + tolerance:
+            status = "变快"
+        rows.append({"id": case["id"], "baseline_fps": old["fps"], "fps": case["fps"],
+                     "ratio": round(ratio, 3), "status": status})
+    return rows, regressed
+
+
+def parse_options(values):
+    """把 key=value 解析成节点参数，数值自动转换"""
+    options = {}
+    for item in values or []:
+        key, _, value = item.partition("=")
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MovingWatermark 性能基准")
+    parser.add_argument("--preset", choices=list(PRESETS), default="quick")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int)
+    parser.add_argument("--trajectories", nargs="+")
+    parser.add_argument("--effects", nargs="+", choices=list(EFFECTS))
+    parser.add_argument("--dtypes", nargs="+", choices=["float32", "uint8"], default=["float32"],
+                        help="合成时的图像类型，uint8会单独统计与float32之间的转换耗时")
+    parser.add_argument("--repeats", type=int, default=3, help="每个组合计时的次数")
+    parser.add_argument("--warmup", type=int, default=1, help="每个组合不计时的预热次数")
+    parser.add_argument("--max-input-mb", type=float, default=4096, help="跳过输入张量超过该大小的组合，0为不限制")
+    parser.add_argument("--option", action="append", metavar="KEY=VALUE",
+                        help="额外传给节点的参数，如 --option parallel_mode=线程池")
+    parser.add_argument("-o", "--output", help="结果JSON的保存路径（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="对比用的基线JSON")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fps变化超过该比例才算变快/变慢")
+    args = parser.parse_args(argv)
+
+    node_module = load_node_module()
+    preset = PRESETS[args.preset]
+    trajectories = args.trajectories or preset["trajectories"] or node_module.TRAJECTORIES
+    cases = build_cases(args.resolutions or preset["resolutions"], args.batch_sizes or preset["batch_sizes"],
+                        trajectories, args.effects or preset["effects"], args.dtypes)
+    node_options = parse_options(args.option)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "repeats": args.repeats,
+            "warmup": args.warmup,
+            "options": node_options,
+        },
+        "cases": [],
+    }
+    for index, case in enumerate(cases, 1):
+        result = run_case(node_module, case, args.repeats, args.warmup, node_options, args.max_input_mb)
+        results["cases"].append(result)
+        if "skipped" in result:
+            print(f"[{index}/{len(cases)}] {result['id']}: 跳过({result['skipped']})", file=sys.stderr)
+        else:
+            print(f"[{index}/{len(cases)}] {result['id']}: {result['fps']:.1f} fps, "
+                  f"p50 {result['latency_ms']['p50']:.2f}ms/帧, 转换{result['convert_ms']:.2f}ms/帧, "
+                  f"峰值增加{result['peak_delta_mb']:.0f}MB", file=sys.stderr)
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressed = compare(results, baseline, args.tolerance)
+        results["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "cases": rows}
+        for row in rows:
+            print(f"{row['status']} {row['id']}: {row['baseline_fps']:.1f} → {row['fps']:.1f} fps "
+                  f"(x{row['ratio']:.2f})", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+GLM-4V 模型加载模式
+
+两个GLM-4V节点共用的加载逻辑，按加载模式决定精度、设备映射和加载后的处理：
+- 默认：bfloat16，device_map="auto"（原有行为）
+- int8动态量化：在CPU上加载后逐层把Linear换成int8动态量化版本（权重int8，激活按float32实时量化），
+  其余参数转为float32；适合没有显卡的主机，加载峰值约为bf16权重本身，加载后Linear权重减半，CPU上通常比bf16矩阵乘法快
+- 低内存：bfloat16，直接加载到CPU，low_cpu_mem_usage逐个张量从内存映射的safetensors读取，
+  不在内存中先构建一份随机初始化的模型
+- 限额卸载：device_map="auto"，按ALWAYSONLINE_GLM_MAX_MEMORY（如"0=20GiB,cpu=32GiB"）限制各设备的占用，
+  放不下的层卸载到磁盘（ALWAYSONLINE_GLM_OFFLOAD_DIR，默认ComfyUI临时目录下的glm4v_offload）；需要accelerate
+"""
+import os
+import json
+import time
+import struct
+import torch
+from ..profiling import profile_stage, profile_meta
+from .model_registry import weights_size
+
+LOAD_MODES = ["默认", "int8动态量化", "低内存", "限额卸载"]
+
+MAX_MEMORY = os.environ.get("ALWAYSONLINE_GLM_MAX_MEMORY", "")
+OFFLOAD_DIR = os.environ.get("ALWAYSONLINE_GLM_OFFLOAD_DIR", "")
+
+
+def resident_bytes():
+    """当前进程的常驻内存（RSS），取不到时返回0"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def parse_max_memory(text):
+    """"0=20GiB,cpu=32GiB" → {0: "20GiB", "cpu": "32GiB"}，GPU序号转为整数"""
+    limits = {}
+    for item in text.split(","):
+        if "=" not in item:
+            continue
+        device, limit = (part.strip() for part in item.split("=", 1))
+        limits[int(device) if device.isdigit() else device] = limit
+    return limits
+
+
+SIZE_UNITS = {"KIB": 1 << 10, "MIB": 1 << 20, "GIB": 1 << 30, "TIB": 1 << 40,
+              "KB": 10 ** 3, "MB": 10 ** 6, "GB": 10 ** 9, "TB": 10 ** 12}
+
+
+def parse_size(text):
+    """"20GiB"/"512MB"/整数字节数 → 字节数"""
+    text = str(text).strip().upper()
+    for unit, scale in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * scale)
+    return int(text)
+
+
+def device_limit(kind):
+    """ALWAYSONLINE_GLM_MAX_MEMORY中kind设备（cpu或全部GPU之和）的上限，未设置时为0"""
+    limits = parse_max_memory(MAX_MEMORY)
+    if kind == "cpu":
+        return parse_size(limits["cpu"]) if "cpu" in limits else 0
+    return sum(parse_size(limit) for device, limit in limits.items() if isinstance(device, int))
+
+
+def checkpoint_tensors(model_path):
+    """读取目录中safetensors的文件头，返回{名称: (维数, 元素个数)}（不读取张量数据）；没有safetensors文件时返回None"""
+    tensors = {}
+    for root, _, filenames in os.walk(model_path):
+        for filename in filenames:
+            if not filename.endswith(".safetensors"):
+                continue
+            try:
+                with open(os.path.join(root, filename), "rb") as f:
+                    header = json.loads(f.read(struct.unpack("<Q", f.read(8))[0]))
+            except (OSError, ValueError, struct.error):
+                return None
+            for name, info in header.items():
+                if name != "__metadata__":
+                    tensors[name] = (len(info["shape"]), _numel(info["shape"]))
+    return tensors or None
+
+
+def _numel(shape):
+    count = 1
+    for size in shape:
+        count *= size
+    return count
+
+
+def is_linear_weight(name, ndim):
+    """按名字和维数判断是否为Linear层的权重：二维、以.weight结尾且不是嵌入层"""
+    return ndim == 2 and name.endswith(".weight") and "embed" not in name
+
+
+def load_device(加载模式):
+    """加载后模型主要占用的设备类型，用于注册表按预算腾出空间"""
+    if 加载模式 in ("int8动态量化", "低内存") or not torch.cuda.is_available():
+        return "cpu"
+    return "cuda"
+
+
+def expected_bytes(加载模式, model_path):
+    """估算加载模型在load_device(加载模式)上的峰值占用，注册表据此提前腾出空间
+
+    各模式都按bfloat16加载：有safetensors时按文件头中的元素个数计算，否则按权重文件大小。
+    - int8动态量化：先完整加载bf16模型再逐层量化，取“bf16权重 + 最大一个Linear的float32副本”
+      与量化后（Linear权重int8，其余参数float32）两者中的较大者
+    - 限额卸载：设备上最多占用ALWAYSONLINE_GLM_MAX_MEMORY中该设备的上限，其余卸载到磁盘
+    """
+    tensors = checkpoint_tensors(model_path)
+    weights = 2 * sum(numel for _, numel in tensors.values()) if tensors else weights_size(model_path)
+    if 加载模式 == "int8动态量化" and tensors:
+        linear = [numel for name, (ndim, numel) in tensors.items() if is_linear_weight(name, ndim)]
+        quantized = sum(linear) + 4 * (weights // 2 - sum(linear))
+        return max(weights + 4 * max(linear, default=0), quantized)
+    if 加载模式 == "限额卸载":
+        limit = device_limit(load_device(加载模式))
+        if limit > 0:
+            return min(weights, limit)
+    return weights
+
+
+def default_offload_dir():
+    import folder_paths
+    return os.path.join(folder_paths.get_temp_directory(), "glm4v_offload")
+
+
+def from_pretrained_kwargs(加载模式, 推理模式):
+    kwargs = {"torch_dtype": torch.bfloat16, "attn_implementation": 推理模式}
+    if 加载模式 == "默认":
+        kwargs["device_map"] = "auto"
+    elif 加载模式 in ("int8动态量化", "低内存"):
+        kwargs["low_cpu_mem_usage"] = True
+    elif 加载模式 == "限额卸载":
+        kwargs["device_map"] = "auto"
+        kwargs["offload_folder"] = OFFLOAD_DIR or default_offload_dir()
+        if MAX_MEMORY:
+            kwargs["max_memory"] = parse_max_memory(MAX_MEMORY)
+    else:
+        raise ValueError(f"未知的加载模式: {加载模式}")
+    return kwargs
+
+
+def quantize_int8(model):
+    """逐个把Linear层替换为int8动态量化版本，再把其余参数转为float32（量化后的Linear只接受float32输入）
+
+    每次只把一个Linear转为float32后量化并释放，不会出现整个模型的float32副本；
+    偏置在量化时随权重一起打包，所以必须先转float32再量化。
+    与quantize_dynamic(..., {nn.Linear}, qint8)的结果相同；torch.ao.quantization已被标记弃用（迁移到torchao），
+    torchao不是本插件的依赖，这里仍使用torch自带的实现
+    """
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    # 只记录名字：持有原Linear模块的引用会让它们的float32权重一直留到量化结束
+    names = [name for name, module in model.named_modules() if type(module) is torch.nn.Linear]
+    for name in names:
+        parent_name, _, attr = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        linear = getattr(parent, attr).float()
+        linear.qconfig = qconfig
+        setattr(parent, attr, DynamicQuantizedLinear.from_float(linear))
+        del linear
+    model.float()
+    model.config.dtype = torch.float32
+    return model
+
+
+def load_model(full_model_path, 推理模式="sdpa", 加载模式="默认"):
+    """按加载模式加载Glm4vForConditionalGeneration，记录加载耗时和常驻内存"""
+    from transformers import Glm4vForConditionalGeneration
+    rss_before = resident_bytes()
+    start = time.perf_counter()
+    with profile_stage("model_load"):
+        model = Glm4vForConditionalGeneration.from_pretrained(full_model_path, **from_pretrained_kwargs(加载模式, 推理模式))
+    if 加载模式 == "int8动态量化":
+        with profile_stage("quantize"):
+            model = quantize_int8(model)
+    model.eval()
+    seconds = time.perf_counter() - start
+    rss = resident_bytes()
+    print(f"[GLM4V] 加载模式 {加载模式}: 用时{seconds:.1f}s, 常驻内存{rss / 1048576:.0f}MB"
+          f"(加载增加{(rss - rss_before) / 1048576:.0f}MB)")
+    profile_meta(load_mode=加载模式, load_seconds=round(seconds, 2), rss_mb=round(rss / 1048576, 1),
+                 load_rss_delta_mb=round((rss - rss_before) / 1048576, 1))
+    return model
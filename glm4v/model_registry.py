@@ -0,0 +1,206 @@
+"""
+进程级GLM-4V模型注册表
+
+两个GLM-4V节点（以及同一节点的多个实例）按(模型路径, 精度, 注意力实现)共用一份已加载的模型和处理器，
+借用期间引用计数不为0，不会被卸载。归还后：
+- 默认（ALWAYSONLINE_GLM_IDLE_SECONDS=0）归还后立即卸载，keep_loaded的借用除外：ComfyUI的显存管理看不到这里的模型，
+  留在显存中会让同一工作流后面的扩散/VAE节点显存不足；设为正数后改为空闲超过该秒数才卸载（由后台线程检查）；
+- 加载新模型前，内存/显存占用超过ALWAYSONLINE_GLM_RAM_BUDGET_MB / ALWAYSONLINE_GLM_VRAM_BUDGET_MB
+  （0为不限制）时按最久未使用的顺序卸载空闲模型。
+"""
+import os
+import gc
+import time
+import threading
+from contextlib import contextmanager
+import torch
+
+DEFAULT_IDLE_SECONDS = float(os.environ.get("ALWAYSONLINE_GLM_IDLE_SECONDS", "0"))
+DEFAULT_RAM_BUDGET_MB = int(os.environ.get("ALWAYSONLINE_GLM_RAM_BUDGET_MB", "0"))
+DEFAULT_VRAM_BUDGET_MB = int(os.environ.get("ALWAYSONLINE_GLM_VRAM_BUDGET_MB", "0"))
+WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".pt", ".pth")
+
+
+def weights_size(model_path):
+    """模型目录中权重文件的总大小，用于加载前估算占用"""
+    total = 0
+    for root, _, filenames in os.walk(model_path):
+        for filename in filenames:
+            if filename.endswith(WEIGHT_EXTENSIONS):
+                try:
+                    total += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    pass
+    return total
+
+
+def model_bytes(model):
+    """按设备类型统计模型参数和缓冲区占用的字节数：{"cpu": n, "cuda": n}
+
+    动态量化层打包后的权重不在parameters()/buffers()中，单独统计
+    """
+    usage = {}
+    tensors = list(model.parameters()) + list(model.buffers())
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None and hasattr(packed, "_weight_bias"):
+            tensors += [tensor for tensor in packed._weight_bias() if tensor is not None]
+    for tensor in tensors:
+        kind = tensor.device.type
+        usage[kind] = usage.get(kind, 0) + tensor.numel() * tensor.element_size()
+    return usage
+
+
+class ModelEntry:
+    def __init__(self, key):
+        self.key = key
+        self.model = None
+        self.processor = None
+        self.refs = 0
+        self.keep_loaded = False
+        self.last_used = time.monotonic()
+        self.usage = {}
+        self.load_seconds = 0.0
+        # 同一模型只加载一次：第二个借用者等待第一个加载完成
+        self.load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+
+class ModelRegistry:
+    """按键共享模型对象的注册表（线程安全）"""
+
+    def __init__(self, ram_budget_mb=0, vram_budget_mb=0, idle_seconds=0.0):
+        self.budgets = {"cpu": ram_budget_mb * 1048576, "cuda": vram_budget_mb * 1048576}
+        self.idle_seconds = idle_seconds
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._reaper = None
+
+    @contextmanager
+    def borrow(self, key, loader, expected_bytes=0, device="cpu", keep_loaded=False):
+        """借用key对应的(模型, 处理器)，未加载时调用loader()加载
+
+        expected_bytes/device为加载前估算的占用和所在设备类型，用于提前按预算腾出空间；
+        keep_loaded为True时归还后不按空闲时间卸载（预算不足时仍可能被淘汰）
+        """
+        with self._lock:
+            entry = self._entries.setdefault(key, ModelEntry(key))
+            entry.refs += 1
+        try:
+            with entry.load_lock:
+                if entry.loaded:
+                    with self._lock:
+                        self.hits += 1
+                else:
+                    self._make_room(device, expected_bytes, exclude=entry)
+                    start = time.perf_counter()
+                    entry.model, entry.processor = loader()
+                    entry.load_seconds = time.perf_counter() - start
+                    entry.usage = model_bytes(entry.model)
+                    with self._lock:
+                        self.loads += 1
+                    print(f"[GLM4V] 加载模型 {key[0]}: 用时{entry.load_seconds:.1f}s, "
+                          + ", ".join(f"{kind} {size / 1048576:.0f}MB" for kind, size in entry.usage.items()))
+                    # 估算不准时加载后再检查一次
+                    for kind in entry.usage:
+                        self._make_room(kind, 0, exclude=entry)
+            yield entry.model, entry.processor
+        finally:
+            self._release(entry, keep_loaded)
+
+    def _release(self, entry, keep_loaded):
+        with self._lock:
+            entry.refs -= 1
+            entry.keep_loaded = keep_loaded
+            entry.last_used = time.monotonic()
+            unload_now = entry.refs == 0 and not keep_loaded and self.idle_seconds <= 0
+        if unload_now:
+            self.unload(entry.key)
+        elif not keep_loaded and self.idle_seconds > 0:
+            self._start_reaper()
+
+    def _usage(self, kind):
+        return sum(entry.usage.get(kind, 0) for entry in self._entries.values() if entry.loaded)
+
+    def _make_room(self, kind, needed, exclude=None):
+        """按LRU卸载空闲模型，直到kind设备上的占用加needed不超过预算"""
+        budget = self.budgets.get(kind, 0)
+        if budget <= 0:
+            return
+        while True:
+            with self._lock:
+                if self._usage(kind) + needed <= budget:
+                    return
+                idle = [entry for entry in self._entries.values()
+                        if entry.loaded and entry.refs == 0 and entry is not exclude and entry.usage.get(kind)]
+                if not idle:
+                    print(f"[GLM4V] {kind}占用将超过预算{budget / 1048576:.0f}MB，但没有可卸载的空闲模型")
+                    return
+                victim = min(idle, key=lambda entry: entry.last_used)
+            self.unload(victim.key, reason="超出预算")
+
+    def unload(self, key, reason="空闲"):
+        """卸载一个模型（正在借用时跳过），返回是否卸载"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refs > 0 or not entry.loaded:
+                return False
+            model, entry.model, entry.processor = entry.model, None, None
+            entry.usage = {}
+            self.evictions += 1
+        del model
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f"[GLM4V] 卸载模型({reason}) {key[0]}")
+        return True
+
+    def unload_idle(self, now=None):
+        """卸载空闲超过idle_seconds且未要求常驻的模型"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [entry.key for entry in self._entries.values()
+                       if entry.loaded and entry.refs == 0 and not entry.keep_loaded
+                       and now - entry.last_used >= self.idle_seconds]
+        for key in expired:
+            self.unload(key)
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, name="glm4v-model-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        interval = max(1.0, min(self.idle_seconds / 4, 60.0))
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.unload_idle()
+
+    def is_loaded(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.loaded
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": [entry.key[0] for entry in self._entries.values() if entry.loaded],
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "ram_mb": round(self._usage("cpu") / 1048576, 1),
+                "vram_mb": round(self._usage("cuda") / 1048576, 1),
+            }
+
+
+model_registry = ModelRegistry(DEFAULT_RAM_BUDGET_MB, DEFAULT_VRAM_BUDGET_MB, DEFAULT_IDLE_SECONDS)
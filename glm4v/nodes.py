@@ -1,18 +1,243 @@
 import os
 import re
 import torch
-from transformers import AutoProcessor, Glm4vForConditionalGeneration
 import comfy
-import folder_paths
-from PIL import Image
-import numpy as np
 import json
+import time
 from enum import Enum
+from ..profiling import profiled, profile_stage, profile_meta
+from .model_registry import model_registry
+from . import preload
+from .loading import LOAD_MODES, load_model, load_device, expected_bytes
+from .preprocess import prepare_images, resize_settings
+from .prefix_cache import prefix_cache, common_prefix_length, MIN_PREFIX_TOKENS
+from .response_cache import response_cache, response_key, model_signature, cache_enabled, CACHE_MODES
 
 # 获取当前ComfyUI根目录
 current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 models_path = os.path.join(current_dir, 'models/LLM')
 
+# transformers（约数秒）在第一次执行GLM-4V节点时才导入，不拖慢ComfyUI启动和只用水印节点的工作流
+_models_listing = {"mtime": None, "models": []}
+
+def list_models():
+    """扫描/models/LLM目录下可用的模型，目录修改时间不变时复用上次的结果"""
+    try:
+        mtime = os.stat(models_path).st_mtime_ns
+    except OSError:
+        return []
+    if _models_listing["mtime"] != mtime:
+        _models_listing["models"] = [d for d in os.listdir(models_path) if os.path.isdir(os.path.join(models_path, d))]
+        _models_listing["mtime"] = mtime
+    return list(_models_listing["models"])
+
+def generation_meta(inputs, output, seconds, timer, early_stopped):
+    """把输入/视觉/生成的token数、首token延迟、生成速度和显存峰值写入性能报告并打印（批量生成时报告中为最后一批）"""
+    input_tokens = inputs["input_ids"].shape[1]
+    new_tokens = output.shape[1] - input_tokens
+    # 每个视觉token由merge_size²(2×2)个patch合并而来
+    grid = inputs.get("image_grid_thw")
+    visual_tokens = int(grid.prod(dim=-1).sum()) // 4 if grid is not None else 0
+    decode_tokens_per_second = output.shape[0] * timer.decode_steps_per_second()
+    print(f"[GLM4V] 批大小{output.shape[0]}: 视觉token {visual_tokens}, 首token {timer.ttft * 1000:.0f}ms, "
+          f"解码{decode_tokens_per_second:.1f} tok/s, 生成{new_tokens}步, 提前停止{early_stopped}/{output.shape[0]}行")
+    meta = {
+        "batch_size": output.shape[0],
+        "input_tokens": input_tokens,
+        "visual_tokens": visual_tokens,
+        "new_tokens": new_tokens,
+        "tokens_per_second": round(output.shape[0] * new_tokens / max(seconds, 1e-9), 2),
+        "ttft_ms": round(timer.ttft * 1000, 1),
+        "decode_tokens_per_second": round(decode_tokens_per_second, 2),
+        "early_stopped": early_stopped,
+    }
+    if torch.cuda.is_available():
+        meta["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 1048576, 1)
+    profile_meta(**meta)
+
+def model_key(模型路径, 推理模式="sdpa", 加载模式="默认"):
+    """模型在注册表中的键：同一模型的不同加载模式各占一份"""
+    return (os.path.join(models_path, 模型路径), 加载模式, 推理模式)
+
+def borrow_model(模型路径, 推理模式="sdpa", 卸载模型=True, 加载模式="默认", wait_preload=True):
+    """从进程级注册表借用模型和处理器：两个节点共用同一份，已加载时直接复用
+
+    卸载模型为True时归还后立即卸载（设置了ALWAYSONLINE_GLM_IDLE_SECONDS时空闲该秒数后卸载），
+    为False时常驻（超出内存预算时仍可能被淘汰）；
+    同一模型正在后台预加载时先等预加载（含预热）完成
+    """
+    key = model_key(模型路径, 推理模式, 加载模式)
+    full_model_path = key[0]
+    if wait_preload:
+        waited = preload.wait_for_preload(key)
+        if waited:
+            profile_meta(preload_wait_seconds=round(waited, 2))
+
+    def loader():
+        from transformers import AutoProcessor
+        with profile_stage("processor_load"):
+            processor = AutoProcessor.from_pretrained(full_model_path, use_fast=True)
+        model = load_model(full_model_path, 推理模式, 加载模式)
+        profile_meta(model_loaded=True)
+        return model, processor
+
+    return model_registry.borrow(key, loader,
+                                 expected_bytes=expected_bytes(加载模式, full_model_path),
+                                 device=load_device(加载模式), keep_loaded=not 卸载模型)
+
+def extract_answer(raw):
+    """从模型输出中提取<answer>之后的内容"""
+    # 尝试解析JSON格式的输出
+    json_data = None
+    json_match = None
+    if raw.startswith('{') or raw.startswith('['):
+        json_data = json.loads(raw)
+        json_match = re.search(r'<answer>(.*)', json.dumps(json_data), re.DOTALL)
+    
+    # 匹配答案
+    original_match = re.search(r"<answer>(.*)", raw, re.DOTALL)
+    match = json_match if json_match else original_match
+    return match.group(1).strip() if match else raw.strip()
+
+def generated_tokens(row, input_length, end_ids, stopped=False):
+    """取一行输出中新生成的token：截到第一个结束符/pad之前
+
+    没有结束符时，因停止字符串结束的行保留全部token，达到最大新token数的行与单张生成一样去掉最后一个token
+    """
+    tokens = row[input_length:]
+    stops = torch.isin(tokens, end_ids).nonzero()
+    end = int(stops[0]) if len(stops) else len(tokens) - (0 if stopped else 1)
+    return tokens[:end]
+
+def end_token_ids(model):
+    """结束符和pad的token id：批量生成时已结束的行之后填充pad"""
+    config = model.generation_config
+    ids = config.eos_token_id if isinstance(config.eos_token_id, (list, tuple)) else [config.eos_token_id]
+    if config.pad_token_id is not None:
+        ids = list(ids) + [config.pad_token_id]
+    return torch.tensor([i for i in ids if i is not None], device=model.device)
+
+def prefix_past_key_values(model, processor, inputs, 前缀对话):
+    """前缀对话（通常只有系统角色）的KV缓存副本和前缀长度；批内有填充或前缀过短时返回(None, 0)
+
+    左填充会让各行的前缀落在不同位置，只有整批没有填充（同一分辨率的图像、相同的提示词）时才能共用前缀
+    """
+    if not 前缀对话 or not bool(inputs["attention_mask"].all()):
+        return None, 0
+    prefix_ids = processor.apply_chat_template([前缀对话], tokenize=True, add_generation_prompt=False,
+                                               return_dict=True, return_tensors="pt")["input_ids"][0]
+    length = common_prefix_length(inputs["input_ids"], prefix_ids)
+    if length < MIN_PREFIX_TOKENS:
+        return None, 0
+    cache = prefix_cache.get(model, inputs["input_ids"][0, :length], inputs["input_ids"].shape[0])
+    return cache, (length if cache is not None else 0)
+
+def generate_answers(model, processor, conversations, 温度, top_p, top_k, 最大新token数, 重复惩罚, 批大小=1, 停止字符串="",
+                     前缀对话=None):
+    """按批大小把多段对话左填充后批量生成，返回每段对话的答案和分摊到每段对话的耗时（秒）
+
+    每一行在答案闭合(</answer>)或出现停止字符串时立即结束；停止字符串及其之后的内容不计入答案。
+    给出前缀对话时复用其KV缓存，只预填充之后的部分
+    """
+    from transformers import StoppingCriteriaList
+    from .streaming import GenerationTimer, StopOnStrings, ANSWER_END
+    end_ids = end_token_ids(model)
+    answers, seconds = [], []
+    for start in range(0, len(conversations), 批大小):
+        batch = conversations[start:start + 批大小]
+        batch_start = time.perf_counter()
+        # 处理输入：批量生成要求左填充，新token才能紧接在每段提示词之后
+        with profile_stage("apply_chat_template"):
+            inputs = processor.apply_chat_template(
+                batch,
+                tokenize=True,
+                add_generation_prompt=True,
+                return_dict=True,
+                return_tensors="pt",
+                padding=True,
+                padding_side="left"
+            ).to(model.device)
+                
+        # 流式生成输出：逐步计时，答案闭合或出现停止字符串的行提前结束
+        input_length = inputs["input_ids"].shape[1]
+        stop = StopOnStrings(processor.tokenizer, [ANSWER_END, 停止字符串], input_length)
+        past_key_values, prefix_length = prefix_past_key_values(model, processor, inputs, 前缀对话)
+        # 多模态位置偏移是模型上的状态，从缓存继续生成时不能沿用上一次生成留下的值
+        model.model.rope_deltas = None
+        with profile_stage("generate"):
+            timer = GenerationTimer()
+            output = model.generate(
+                **inputs,
+                max_new_tokens=最大新token数,
+                repetition_penalty=重复惩罚,
+                do_sample=温度 > 0,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=温度 if 温度 > 0 else None,
+                streamer=timer,
+                stopping_criteria=StoppingCriteriaList([stop]),
+                past_key_values=past_key_values,
+            )
+            generate_seconds = time.perf_counter() - timer.start
+        stopped = stop.stopped.tolist() if stop.stopped is not None else [False] * output.shape[0]
+        generation_meta(inputs, output, generate_seconds, timer, sum(stopped))
+        if prefix_length:
+            profile_meta(prefix_cached_tokens=prefix_length, prefix_cache=prefix_cache.stats())
+        
+        # 解码输出
+        with profile_stage("decode"):
+            for row, row_stopped in zip(output, stopped):
+                raw = processor.decode(generated_tokens(row, input_length, end_ids, row_stopped), skip_special_tokens=True)
+                if 停止字符串 and 停止字符串 in raw:
+                    raw = raw[:raw.index(停止字符串)]
+                answers.append(extract_answer(raw))
+        seconds += [(time.perf_counter() - batch_start) / len(batch)] * len(batch)
+    return answers, seconds
+
+def describe_conversations(conversations, images, 模型路径, 推理模式, 卸载模型, 温度, top_p, top_k, 最大新token数, 重复惩罚,
+                           批大小, 响应缓存, 停止字符串, 加载模式, 用户输入, 系统角色=None, 前缀对话=None, 预处理=None):
+    """两个节点共用的生成流程：先查响应缓存，只对未命中的对话借用模型批量生成，结果写回缓存
+
+    images为每段对话对应的单张图像张量（纯文本对话为None），与预处理参数一起用于计算缓存键；全部命中时不加载模型
+    """
+    keys = None
+    answers = [None] * len(conversations)
+    if cache_enabled(响应缓存, 温度) and response_cache.enabled:
+        params = {
+            "model": 模型路径, "model_files": model_signature(model_key(模型路径)[0]), "attention": 推理模式, "load_mode": 加载模式, "system": 系统角色, "prompt": 用户输入,
+            "temperature": 温度, "top_p": top_p, "top_k": top_k, "max_new_tokens": 最大新token数,
+            "repetition_penalty": 重复惩罚, "stop": 停止字符串, **(预处理 or {}),
+        }
+        with profile_stage("response_cache"):
+            keys = [response_key(image, params) for image in images]
+            answers = response_cache.get_many(keys)
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+
+    if missing:
+        # 从注册表借用模型（已加载时直接复用），按批大小批量生成描述
+        with borrow_model(模型路径, 推理模式, 卸载模型, 加载模式) as (model, processor):
+            generated, seconds = generate_answers(model, processor, [conversations[i] for i in missing],
+                                                  温度, top_p, top_k, 最大新token数, 重复惩罚, 批大小, 停止字符串, 前缀对话)
+        for i, answer in zip(missing, generated):
+            answers[i] = answer
+        if keys is not None:
+            response_cache.put_many([(keys[i], answer, second) for i, answer, second in zip(missing, generated, seconds)])
+        profile_meta(model_registry=model_registry.stats())
+
+    if keys is not None:
+        stats = response_cache.stats()
+        profile_meta(response_cache=dict(stats, hits_this_run=len(conversations) - len(missing)))
+        print(f"[GLM4V] 响应缓存: 本次命中{len(conversations) - len(missing)}/{len(conversations)}, "
+              f"累计命中率{stats['hit_rate']:.0%}, 累计节省{stats['saved_seconds']:.1f}s")
+    return answers
+
+def answers_outputs(answers, label, elapsed):
+    """节点输出：描述列表和JSON数组，并记录吞吐量"""
+    images_per_second = len(answers) / max(elapsed, 1e-9)
+    profile_meta(images=len(answers), images_per_second=round(images_per_second, 3))
+    print(f"[GLM4V] {label}: {len(answers)}条, 用时{elapsed:.2f}s, {images_per_second:.2f} 张/s")
+    return (answers, json.dumps(answers, ensure_ascii=False))
+
 class GLM4VImageDescription_V2:
     DESCRIPTION = """
     GLM-4V 图像描述生成器
@@ -27,10 +252,7 @@ class GLM4VImageDescription_V2:
     
     @classmethod
     def INPUT_TYPES(cls):
-        # 扫描/models/LLM目录下可用的模型
-        models = []
-        if os.path.exists(models_path):
-            models = [d for d in os.listdir(models_path) if os.path.isdir(os.path.join(models_path, d))]
+        models = list_models()
         
         return {
             "required": {
@@ -44,113 +266,52 @@ class GLM4VImageDescription_V2:
                 "最大新token数": ("INT", {"default": 8192, "min": 512, "max": 16384, "step": 1}),
                 "重复惩罚": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 2.0, "step": 0.01}),
                 "卸载模型": ("BOOLEAN", {"default": True}),
+            },
+            "optional": {
+                "批大小": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1}),
+                "响应缓存": (CACHE_MODES, {"default": "自动"}),
+                "停止字符串": ("STRING", {"default": "", "multiline": False}),
+                "加载模式": (LOAD_MODES, {"default": "默认"}),
+                "最长边": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1}),
+                "最大百万像素": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+                "profile": ("BOOLEAN", {"default": False}),
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("描述",)
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("描述", "描述JSON", "性能报告")
+    # 描述按批次中的图像逐条输出，下游节点对每条描述各执行一次
+    OUTPUT_IS_LIST = (True, False, False)
     FUNCTION = "describe_image"
     CATEGORY = "🚬香烟的工具箱✅/3️⃣提示词反推📝"
     
-    def __init__(self):
-        self.model = None
-        self.processor = None
-    
-    def describe_image(self, 图像, 模型路径, 用户输入, 温度, top_p, top_k, 最大新token数, 重复惩罚, 卸载模型):
-        # 如果模型已加载且需要卸载，则先卸载
-        if 卸载模型 and self.model is not None:
-            del self.model
-            del self.processor
-            self.model = None
-            self.processor = None
-            torch.cuda.empty_cache()
-        
-        # 将ComfyUI图像张量转换为PIL图像
-        # 图像张量格式为[N, H, W, C]，其中N=1, C=3 (RGB)
-        image_np = 图像[0].numpy() * 255.0
-        image_np = np.clip(image_np, 0, 255).astype(np.uint8)
-        pil_image = Image.fromarray(image_np)
-        
-        # 保存图像到临时文件
-        temp_image_path = os.path.join(folder_paths.get_temp_directory(), "glm4v_temp_image.png")
-        pil_image.save(temp_image_path)
+    @profiled
+    def describe_image(self, 图像, 模型路径, 用户输入, 温度, top_p, top_k, 最大新token数, 重复惩罚, 卸载模型, 批大小=4, 响应缓存="自动", 停止字符串="", 加载模式="默认", 最长边=0, 最大百万像素=0.0):
+        start_time = time.perf_counter()
+        # 图像张量格式为[N, H, W, C]，批次中的每张图像各生成一条描述；超过最长边/最大像素数的整批等比缩小
+        images = prepare_images(图像, 最长边, 最大百万像素)
                 
         # 构建消息
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "url": temp_image_path},
-                    {"type": "text", "text": 用户输入}
-                ]
-            }
+        conversations = [
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image", "image": image},
+                        {"type": "text", "text": 用户输入}
+                    ]
+                }
+            ]
+            for image in images
         ]
         
-        # 如果模型未加载，则加载模型
-        if self.model is None:
-            full_model_path = os.path.join(models_path, 模型路径)
-            self.processor = AutoProcessor.from_pretrained(full_model_path, use_fast=True)
-            self.model = Glm4vForConditionalGeneration.from_pretrained(
-                full_model_path,
-                torch_dtype=torch.bfloat16,
-                device_map="auto",
-                attn_implementation="sdpa"
-            )
-        
-        # 处理输入
-        inputs = self.processor.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-            return_tensors="pt",
-            padding=True
-        ).to(self.model.device)
-                
-        # 生成输出
-        output = self.model.generate(
-            **inputs,
-            max_new_tokens=最大新token数,
-            repetition_penalty=重复惩罚,
-            do_sample=温度 > 0,
-            top_k=top_k,
-            top_p=top_p,
-            temperature=温度 if 温度 > 0 else None,
-        )
-        
-        # 解码输出
-        raw = self.processor.decode(
-            output[0][inputs["input_ids"].shape[1]:-1],
-            skip_special_tokens=True
-        )
-        
-        # 尝试解析JSON格式的输出
-        json_data = None
-        json_match = None
-        if raw.startswith('{') or raw.startswith('['):
-            json_data = json.loads(raw)
-            json_match = re.search(r'<answer>(.*)', json.dumps(json_data), re.DOTALL)
-        
-        # 匹配答案
-        original_match = re.search(r"<answer>(.*)", raw, re.DOTALL)
-        match = json_match if json_match else original_match
-        answer = match.group(1).strip() if match else raw.strip()
-        
-        print(f"[GLM4V] Prompt: {answer}")
-        
-        # 清理临时文件
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
+        answers = describe_conversations(conversations, 图像.split(1), 模型路径, "sdpa", 卸载模型,
+                                         温度, top_p, top_k, 最大新token数, 重复惩罚, 批大小, 响应缓存, 停止字符串, 加载模式, 用户输入,
+                                         预处理=resize_settings(最长边, 最大百万像素))
         
-        # 如果需要卸载模型，则立即卸载
-        if 卸载模型:
-            del self.model
-            del self.processor
-            self.model = None
-            self.processor = None
-            torch.cuda.empty_cache()
-        
-        return (answer,)
+        for answer in answers:
+            print(f"[GLM4V] Prompt: {answer}")
+        return answers_outputs(answers, f"图像反推(批大小{批大小})", time.perf_counter() - start_time)
 
 class MyOptions(Enum):
     flash_attention_2 = "flash_attention_2"
@@ -170,14 +331,7 @@ class GLM4VTextToDescription:
     
     @classmethod
     def INPUT_TYPES(cls):
-        # 获取当前ComfyUI根目录
-        current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-        models_path = os.path.join(current_dir, 'models/LLM')
-        
-        # 扫描/models/LLM目录下可用的模型
-        models = []
-        if os.path.exists(models_path):
-            models = [d for d in os.listdir(models_path) if os.path.isdir(os.path.join(models_path, d))]
+        models = list_models()
         
         # option = True
 
@@ -196,76 +350,56 @@ class GLM4VTextToDescription:
             },
             "optional": {
                 "图像": ("IMAGE",),
+                "批大小": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1}),
+                "响应缓存": (CACHE_MODES, {"default": "自动"}),
+                "停止字符串": ("STRING", {"default": "", "multiline": False}),
+                "加载模式": (LOAD_MODES, {"default": "默认"}),
+                "最长边": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1}),
+                "最大百万像素": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+                "profile": ("BOOLEAN", {"default": False}),
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("描述",)
+    RETURN_TYPES = ("STRING", "STRING", "STRING")
+    RETURN_NAMES = ("描述", "描述JSON", "性能报告")
+    # 描述按批次中的图像逐条输出，下游节点对每条描述各执行一次
+    OUTPUT_IS_LIST = (True, False, False)
     FUNCTION = "describe_image"
     CATEGORY = "🚬香烟的工具箱✅/3️⃣提示词反推📝"
     
-    def __init__(self):
-        self.model = None
-        self.processor = None
-    
-    def describe_image(self, 模型路径, 系统角色, 用户输入, 温度, top_p, top_k, 最大新token数, 重复惩罚, 卸载模型, 推理模式, 图像=None):
-        # 如果模型已加载且需要卸载，则先卸载
-        if 卸载模型 and self.model is not None:
-            del self.model
-            del self.processor
-            self.model = None
-            self.processor = None
-            torch.cuda.empty_cache()
-        
-        # 构建消息
-        messages = []
+    @profiled
+    def describe_image(self, 模型路径, 系统角色, 用户输入, 温度, top_p, top_k, 最大新token数, 重复惩罚, 卸载模型, 推理模式, 图像=None, 批大小=4, 响应缓存="自动", 停止字符串="", 加载模式="默认", 最长边=0, 最大百万像素=0.0):
+        start_time = time.perf_counter()
+        system_message = {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "content": 系统角色
+                }
+            ]
+        }
         
-        # 如果有图像输入，则处理图像
-        if 图像 is not None:
-            # 将ComfyUI图像张量转换为PIL图像
-            # 图像张量格式为[N, H, W, C]，其中N=1, C=3 (RGB)
-            image_np = 图像[0].numpy() * 255.0
-            image_np = np.clip(image_np, 0, 255).astype(np.uint8)
-            pil_image = Image.fromarray(image_np)
-            
-            # 保存图像到临时文件
-            temp_image_path = os.path.join(folder_paths.get_temp_directory(), "glm4v_temp_image.png")
-            pil_image.save(temp_image_path)
-
-            # print(f"临时图片路径: {temp_image_path}")
-            
-            messages.append(
+        # 构建消息：有图像输入时批次中的每张图像各一段对话，否则只有一段纯文本对话
+        images = prepare_images(图像, 最长边, 最大百万像素) if 图像 is not None else []
+        if images:
+            conversations = [
                 [
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "content": 系统角色
-                            }
-                        ]
-                    },
+                    system_message,
                     {
                         "role": "user",
                         "content": [
-                            {"type": "image", "url": temp_image_path},
+                            {"type": "image", "image": image},
                             {"type": "text", "text": 用户输入}
                         ]
                     }
                 ]
-            )
+                for image in images
+            ]
         else:
-            messages.append(
+            conversations = [
                 [
-                    {
-                        "role": "system",
-                        "content": [
-                            {
-                                "type": "text",
-                                "content": 系统角色
-                            }
-                        ]
-                    },
+                    system_message,
                     {
                         "role": "user",
                         "content": [
@@ -273,76 +407,19 @@ class GLM4VTextToDescription:
                         ]
                     }
                 ]
-            )
+            ]
         
         print(f"推理模式>>>>>>: {推理模式}")
 
-        # 如果模型未加载，则加载模型
-        if self.model is None:
-            full_model_path = os.path.join(models, 模型路径)
-            self.processor = AutoProcessor.from_pretrained(full_model_path, use_fast=True)
-            self.model = Glm4vForConditionalGeneration.from_pretrained(
-                full_model_path,
-                torch_dtype=torch.bfloat16,
-                device_map="auto",
-                attn_implementation= 推理模式
-            )
+        # 纯文本对话与图像尺寸无关，缩放设置不计入缓存键
+        preprocess = resize_settings(最长边, 最大百万像素) if 图像 is not None else None
+        answers = describe_conversations(conversations, 图像.split(1) if 图像 is not None else [None], 模型路径, 推理模式, 卸载模型,
+                                         温度, top_p, top_k, 最大新token数, 重复惩罚, 批大小, 响应缓存, 停止字符串, 加载模式, 用户输入, 系统角色,
+                                         前缀对话=[system_message], 预处理=preprocess)
         
-        # 处理输入
-        inputs = self.processor.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-            return_tensors="pt",
-            padding=True
-        ).to(self.model.device)
-                
-        # 生成输出
-        output = self.model.generate(
-            **inputs,
-            max_new_tokens=最大新token数,
-            repetition_penalty=重复惩罚,
-            do_sample=温度 > 0,
-            top_k=top_k,
-            top_p=top_p,
-            temperature=温度 if 温度 > 0 else None,
-        )
-        
-        # 解码输出
-        raw = self.processor.decode(
-            output[0][inputs["input_ids"].shape[1]:-1],
-            skip_special_tokens=True
-        )
-        
-        # 尝试解析JSON格式的输出
-        json_data = None
-        json_match = None
-        if raw.startswith('{') or raw.startswith('['):
-            json_data = json.loads(raw)
-            json_match = re.search(r'<answer>(.*)', json.dumps(json_data), re.DOTALL)
-        
-        # 匹配答案
-        original_match = re.search(r"<answer>(.*)", raw, re.DOTALL)
-        match = json_match if json_match else original_match
-        answer = match.group(1).strip() if match else raw.strip()
-        
-        print(f"[GLM4V] Prompt: {answer}")
-        
-        # 清理临时文件
-        if 图像 is not None and os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        
-        # 如果需要卸载模型，则立即卸载
-        if 卸载模型:
-            del self.model
-            del self.processor
-            self.model = None
-            self.processor = None
-            torch.cuda.empty_cache()
-        
-        return (answer,)
-
+        for answer in answers:
+            print(f"[GLM4V] Prompt: {answer}")
+        return answers_outputs(answers, f"文本反推(批大小{批大小})", time.perf_counter() - start_time)
 
 NODE_CLASS_MAPPINGS = {
     "GLM4VImageDescription_V2": GLM4VImageDescription_V2,
@@ -352,4 +429,7 @@ NODE_CLASS_MAPPINGS = {
 NODE_DISPLAY_NAME_MAPPINGS = {
     "GLM4VImageDescription_V2": "🚬GLM-4V图像反推提示词V2.0✅",
     "GLM4VTextToDescription": "🚬GLM-4V文本反推提示词✅"
-}
\ No newline at end of file
+}
+
+# 按环境变量后台预加载模型（默认关闭）
+preload.start()
@@ -0,0 +1,107 @@
+"""
+GLM-4V 系统提示词前缀KV缓存
+
+批量任务中系统角色往往在成千上万次调用中保持不变，每次都要重新预填充这段前缀。
+这里按(模型, 前缀token)缓存前缀的past_key_values，之后的生成直接从前缀末尾继续预填充，
+前缀越长首token延迟(TTFT)降得越多。前缀只包含文本，位置编码与后面的内容无关，因此可以复用。
+最多缓存ALWAYSONLINE_GLM_PREFIX_CACHE个前缀（默认8，0为关闭），按LRU淘汰；模型被卸载时其全部前缀随之释放。
+"""
+import os
+import copy
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import torch
+from ..profiling import profile_stage
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("ALWAYSONLINE_GLM_PREFIX_CACHE", "8"))
+# 前缀太短时复制缓存的开销与节省的预填充相当，不缓存
+MIN_PREFIX_TOKENS = 32
+
+
+def common_prefix_length(input_ids, prefix_ids):
+    """input_ids[n, L]的每一行都以prefix_ids的前k个token开头时返回k（最多L-1，至少留一个token给生成前的预填充）"""
+    length = min(prefix_ids.shape[0], input_ids.shape[1] - 1)
+    if length <= 0:
+        return 0
+    same = (input_ids[:, :length] == prefix_ids[:length].to(input_ids.device)).all(dim=0)
+    return int(same.long().cumprod(dim=0).sum())
+
+
+class PrefixCache:
+    """(模型, 前缀token) → 前缀的KV缓存（线程安全）"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._models = set()
+        # 模型被回收时的回调可能在持锁期间由垃圾回收触发，用可重入锁
+        self._lock = threading.RLock()
+
+    def _key(self, model, prefix_ids):
+        digest = hashlib.blake2b(prefix_ids.cpu().numpy().tobytes(), digest_size=16).hexdigest()
+        return (id(model), digest)
+
+    def _watch(self, model):
+        """模型对象被回收时丢弃它的全部前缀（id可能被新模型复用）"""
+        model_id = id(model)
+        if model_id not in self._models:
+            self._models.add(model_id)
+            weakref.finalize(model, self._drop_model, model_id)
+
+    def _drop_model(self, model_id):
+        with self._lock:
+            self._models.discard(model_id)
+            for key in [key for key in self._entries if key[0] == model_id]:
+                del self._entries[key]
+
+    def get(self, model, prefix_ids, batch_size=1):
+        """返回前缀KV缓存的副本（已按批大小复制），不在缓存中时先预填充前缀；关闭时返回None"""
+        if self.max_entries <= 0:
+            return None
+        key = self._key(model, prefix_ids)
+        with self._lock:
+            cache = self._entries.get(key)
+            if cache is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if cache is None:
+            with profile_stage("prefix_prefill"), torch.no_grad():
+                # 前缀只有文本，位置编码按顺序推断；清掉上一次生成留下的多模态位置偏移
+                model.model.rope_deltas = None
+                cache = model(input_ids=prefix_ids[None].to(model.device), use_cache=True, logits_to_keep=1).past_key_values
+            with self._lock:
+                self._watch(model)
+                self._entries[key] = cache
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        # generate会在缓存后面继续追加，每次使用一份副本
+        with profile_stage("prefix_copy"):
+            cache = copy.deepcopy(cache)
+            if batch_size > 1:
+                cache.batch_repeat_interleave(batch_size)
+        return cache
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+prefix_cache = PrefixCache(DEFAULT_MAX_ENTRIES)
@@ -0,0 +1,109 @@
+"""
+GLM-4V 模型后台预加载与预热（可选）
+
+在后台线程中把模型加载进进程级注册表，并用一张小图做一次很短的生成，
+让CUDA内核、注意力实现和视觉编码器的首次调用开销在节点执行前付清。两种触发方式：
+- ALWAYSONLINE_GLM_PRELOAD=模型目录名[,模型目录名...]：插件导入时立即预加载（推理模式sdpa，首次使用前常驻）
+- ALWAYSONLINE_GLM_PRELOAD_ON_PROMPT=1：提交的工作流中出现GLM-4V节点时，按节点的模型路径和推理模式预加载
+节点执行时如果同一模型正在预加载，会等预加载完成后直接使用，不会重复加载。
+"""
+import os
+import time
+import threading
+from PIL import Image
+from ..profiling import background_task
+
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("ALWAYSONLINE_GLM_PRELOAD", "").split(",") if name.strip()]
+PRELOAD_ON_PROMPT = os.environ.get("ALWAYSONLINE_GLM_PRELOAD_ON_PROMPT", "0") == "1"
+
+GLM_NODE_TYPES = ("GLM4VImageDescription_V2", "GLM4VTextToDescription")
+
+# 注册表键 → 预加载完成时置位的Event
+_pending = {}
+_lock = threading.Lock()
+
+
+def warmup(model, processor):
+    """用一张小图生成几个token"""
+    from .nodes import generate_answers
+    conversation = [{
+        "role": "user",
+        "content": [
+            {"type": "image", "image": Image.new("RGB", (112, 112))},
+            {"type": "text", "text": "描述"},
+        ],
+    }]
+    generate_answers(model, processor, [conversation], 0.0, 1.0, 1, 4, 1.0)
+
+
+def _run(模型路径, 推理模式, 加载模式, key, done):
+    from .nodes import borrow_model
+    start = time.perf_counter()
+    try:
+        # 预加载的模型常驻，直到第一次被节点借用后改按节点的卸载模型设置管理；耗时不计入同时执行的节点的性能报告
+        with background_task(), borrow_model(模型路径, 推理模式, 卸载模型=False, 加载模式=加载模式, wait_preload=False) as (model, processor):
+            loaded = time.perf_counter()
+            warmup(model, processor)
+        print(f"[GLM4V] 预加载完成 {模型路径}: 加载{loaded - start:.1f}s, 预热{time.perf_counter() - loaded:.1f}s")
+    except Exception as e:
+        print(f"[GLM4V] 预加载失败 {模型路径}: {e}")
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+        done.set()
+
+
+def preload(模型路径, 推理模式="sdpa", 加载模式="默认"):
+    """在后台线程中预加载并预热模型，已加载或正在预加载时不重复，返回是否启动了新的预加载"""
+    from .nodes import model_key
+    from .model_registry import model_registry
+    key = model_key(模型路径, 推理模式, 加载模式)
+    with _lock:
+        if key in _pending or model_registry.is_loaded(key):
+            return False
+        done = _pending[key] = threading.Event()
+    print(f"[GLM4V] 后台预加载 {模型路径} ({推理模式}, {加载模式})")
+    threading.Thread(target=_run, args=(模型路径, 推理模式, 加载模式, key, done),
+                     name="glm4v-preload", daemon=True).start()
+    return True
+
+
+def wait_for_preload(key):
+    """该模型正在预加载时等待完成，返回等待的秒数"""
+    with _lock:
+        done = _pending.get(key)
+    if done is None:
+        return 0.0
+    start = time.perf_counter()
+    done.wait()
+    return time.perf_counter() - start
+
+
+def on_prompt(json_data):
+    """ComfyUI提交工作流时的回调：为其中的GLM-4V节点预加载模型，原样返回工作流"""
+    try:
+        for node in json_data.get("prompt", {}).values():
+            if node.get("class_type") not in GLM_NODE_TYPES:
+                continue
+            inputs = node.get("inputs", {})
+            模型路径 = inputs.get("模型路径")
+            推理模式 = inputs.get("推理模式", "sdpa")
+            加载模式 = inputs.get("加载模式", "默认")
+            # 连线输入（[节点id, 输出序号]）在执行前无法确定，跳过
+            if all(isinstance(value, str) for value in (模型路径, 推理模式, 加载模式)):
+                preload(模型路径, 推理模式, 加载模式)
+    except Exception as e:
+        print(f"[GLM4V] 预加载回调失败: {e}")
+    return json_data
+
+
+def start():
+    """插件导入时调用：按环境变量预加载模型并注册工作流提交回调"""
+    for name in PRELOAD_MODELS:
+        preload(name)
+    if PRELOAD_ON_PROMPT:
+        try:
+            from server import PromptServer
+            PromptServer.instance.add_on_prompt_handler(on_prompt)
+        except Exception as e:
+            print(f"[GLM4V] 无法注册工作流提交回调，提交时预加载不可用: {e}")
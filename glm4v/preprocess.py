@@ -0,0 +1,62 @@
+"""
+GLM-4V 图像预处理：按分辨率缩放
+
+GLM-4V的视觉编码器把图像切成14×14的patch，再把2×2个patch合并为一个视觉token，
+视觉token数约为 宽×高/28²，4K图像有一万多个token，预填充耗时和显存都由它决定。
+这里在交给处理器之前按最长边/最大像素数等比缩小，宽高对齐到28的倍数（处理器不会再次缩放），
+整批直接在IMAGE张量上插值并转换为uint8，不经过PIL；不超过限制的图像保持原尺寸，由处理器按原有方式处理。
+默认不限制（与原先一样按原分辨率交给处理器），需要时在节点上设置最长边/最大百万像素。
+"""
+import math
+import torch
+import torch.nn.functional as F
+from ..profiling import profile_stage, profile_meta
+
+# patch_size(14) × merge_size(2)：一个视觉token对应的边长（像素）
+PATCH_FACTOR = 28
+
+
+def target_size(height, width, 最长边=0, 最大百万像素=0.0):
+    """按最长边和最大像素数（0为不限制）等比缩小后的(高, 宽)，对齐到PATCH_FACTOR的倍数；不超过限制时返回原尺寸"""
+    scale = 1.0
+    if 最长边 > 0:
+        scale = min(scale, 最长边 / max(height, width))
+    if 最大百万像素 > 0:
+        scale = min(scale, math.sqrt(最大百万像素 * 1e6 / (height * width)))
+    if scale >= 1.0:
+        return height, width
+    # 向下取整，保证缩放后仍在限制以内
+    return (max(PATCH_FACTOR, int(height * scale) // PATCH_FACTOR * PATCH_FACTOR),
+            max(PATCH_FACTOR, int(width * scale) // PATCH_FACTOR * PATCH_FACTOR))
+
+
+def resize_settings(最长边=0, 最大百万像素=0.0):
+    """计入响应缓存键的缩放设置；不限制时返回None，缓存键与加入缩放之前相同，原有的缓存仍可命中"""
+    if 最长边 <= 0 and 最大百万像素 <= 0:
+        return None
+    return {"max_side": 最长边, "max_megapixels": 最大百万像素}
+
+
+def visual_tokens(height, width):
+    """处理器对齐到28的倍数后一张图像的视觉token数（估计值：超出处理器自身的像素上限时它会再缩小，实际数量见生成时的visual_tokens）"""
+    return max(1, round(height / PATCH_FACTOR)) * max(1, round(width / PATCH_FACTOR))
+
+
+def prepare_images(图像, 最长边=0, 最大百万像素=0.0):
+    """把IMAGE批次[N, H, W, C]按需整批缩小后转换为uint8，返回逐张的[C, H, W]张量列表，直接交给处理器"""
+    height, width = 图像.shape[1], 图像.shape[2]
+    new_height, new_width = target_size(height, width, 最长边, 最大百万像素)
+    pixels = 图像.movedim(-1, 1)
+    if (new_height, new_width) != (height, width):
+        with profile_stage("image_resize", 图像.numel() * 图像.element_size()):
+            # 抗锯齿双三次插值，与处理器缩放时使用的PIL BICUBIC接近
+            pixels = F.interpolate(pixels.float(), size=(new_height, new_width), mode="bicubic",
+                                   antialias=True, align_corners=False)
+    with profile_stage("image_convert", pixels.numel() * pixels.element_size()):
+        # 与逐张 np.clip(x * 255, 0, 255).astype(np.uint8) 的截断结果相同
+        pixels = pixels.mul(255.0).clamp_(0, 255).to(torch.uint8).cpu()
+
+    tokens = visual_tokens(new_height, new_width)
+    print(f"[GLM4V] 图像预处理: {len(pixels)}张 {width}×{height} → {new_width}×{new_height}, 每张约{tokens}个视觉token")
+    profile_meta(image_size=[width, height], resized_size=[new_width, new_height], visual_tokens_per_image=tokens)
+    return list(pixels.unbind(0))
@@ -0,0 +1,164 @@
+"""
+GLM-4V 响应缓存
+
+按(图像内容指纹, 模型路径, 模型文件, 系统角色, 用户输入, 生成参数)缓存每张图像的描述，保存在SQLite数据库中，
+重启后仍然有效；模型文件的大小和修改时间计入缓存键，在同一目录下替换或更新模型后不会返回旧模型的描述。总大小超过ALWAYSONLINE_GLM_CACHE_MB（默认64，0为关闭）时按最久未使用的顺序淘汰。
+数据库路径默认为ComfyUI/user/glm4v_response_cache.sqlite，可用ALWAYSONLINE_GLM_CACHE_PATH指定。
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from ..watermark.output_cache import fingerprint_tensor
+
+COMFYUI_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DEFAULT_PATH = os.environ.get("ALWAYSONLINE_GLM_CACHE_PATH",
+                              os.path.join(COMFYUI_ROOT, "user", "glm4v_response_cache.sqlite"))
+DEFAULT_MAX_MB = int(os.environ.get("ALWAYSONLINE_GLM_CACHE_MB", "64"))
+
+# 节点的缓存选项：自动 = 只在温度为0（结果确定）时使用；总是 = 采样生成时也复用上次的结果
+CACHE_MODES = ["自动", "总是", "关闭"]
+
+
+def cache_enabled(mode, 温度):
+    return mode == "总是" or (mode == "自动" and 温度 == 0)
+
+
+def model_signature(model_path):
+    """模型目录中各文件的(相对路径, 大小, 修改时间)，只读取元数据；隐藏文件和目录（如下载工具的.cache）不计入"""
+    files = []
+    for root, dirs, filenames in os.walk(model_path):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((os.path.relpath(path, model_path), stat.st_size, stat.st_mtime_ns))
+    return sorted(files)
+
+
+def response_key(image, params):
+    """单张图像（没有图像时为None）+ 其余全部影响输出的参数 → 缓存键"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode())
+    if image is not None:
+        digest.update(fingerprint_tensor(image).encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """SQLite中的键 → 描述文本缓存（线程安全，多个进程可共用同一个数据库文件）"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+        self._ready = False
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_bytes > 0
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+            self._ready = True
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_many(self, keys):
+        """按顺序返回每个键的描述，未命中为None"""
+        if not self.enabled or not keys:
+            return [None] * len(keys)
+        found = {}
+        try:
+            with self._lock, self._transaction() as connection:
+                placeholders = ",".join("?" * len(keys))
+                rows = connection.execute(
+                    f"SELECT key, answer, seconds FROM responses WHERE key IN ({placeholders})", keys).fetchall()
+                found = {key: (answer, seconds) for key, answer, seconds in rows}
+                connection.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                       [(time.time(), key) for key in found])
+        except sqlite3.Error as e:
+            print(f"[GLM4V] 读取响应缓存失败: {e}")
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                    self.saved_seconds += found[key][1]
+                else:
+                    self.misses += 1
+        return [found[key][0] if key in found else None for key in keys]
+
+    def put_many(self, items):
+        """items: [(键, 描述, 生成耗时秒数)]，写入后按预算淘汰"""
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        rows = [(key, answer, seconds, len(answer.encode("utf-8")), now) for key, answer, seconds in items]
+        try:
+            with self._lock, self._transaction() as connection:
+                connection.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", rows)
+                self._evict(connection)
+        except sqlite3.Error as e:
+            print(f"[GLM4V] 写入响应缓存失败: {e}")
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 按最近使用时间从旧到新删除，直到回到预算以内
+        victims, freed = [], 0
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def clear(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return
+        with self._lock, self._transaction() as connection:
+            connection.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2),
+            }
+
+
+response_cache = ResponseCache(DEFAULT_PATH, DEFAULT_MAX_MB * 1024 * 1024)
@@ -0,0 +1,71 @@
+"""
+GLM-4V 流式生成的计时与提前停止
+
+GenerationTimer作为generate的streamer，每生成一步被调用一次，记录首token延迟(TTFT)和解码速度；
+StopOnStrings在每一步检查各行新生成的末尾文本，出现</answer>或用户指定的停止字符串时该行立即结束，
+不必等到结束符或最大新token数。批量生成时逐行判断，已结束的行之后只填充pad。
+"""
+import time
+import torch
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+
+# 思考模型的答案在<answer>...</answer>中，答案闭合后模型只会再生成结束符
+ANSWER_END = "</answer>"
+
+
+class GenerationTimer(BaseStreamer):
+    """记录generate的首token延迟和之后的解码速度（整批共用，一步计一次）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.steps = 0
+        self._prompt_seen = False
+
+    def put(self, value):
+        # 第一次调用传入的是提示词，之后每一步传入新生成的token
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self.steps += 1
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def end(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def ttft(self):
+        return (self.first_token or self.start) - self.start
+
+    def decode_steps_per_second(self):
+        """首token之后每秒的解码步数，乘以批大小即为每秒生成的token数"""
+        if self.first_token is None or self.steps < 2:
+            return 0.0
+        return (self.steps - 1) / max((self.finished or time.perf_counter()) - self.first_token, 1e-9)
+
+
+class StopOnStrings(StoppingCriteria):
+    """新生成的文本中出现任一停止字符串时结束该行，stopped记录每行是否因此结束"""
+
+    def __init__(self, tokenizer, stop_strings, input_length):
+        self.tokenizer = tokenizer
+        self.stop_strings = [s for s in stop_strings if s]
+        self.input_length = input_length
+        # 每个token至少一个字符，末尾这么多token一定能覆盖刚出现的停止字符串
+        self.window = max((len(s) for s in self.stop_strings), default=0) + 1
+        self.stopped = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.stopped is None:
+            self.stopped = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if not self.stop_strings:
+            return self.stopped.clone()
+        start = max(self.input_length, input_ids.shape[1] - self.window)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=False)
+        hits = torch.tensor([any(s in tail for s in self.stop_strings) for tail in tails],
+                            dtype=torch.bool, device=input_ids.device)
+        self.stopped |= hits
+        return hits
@@ -7,7 +7,20 @@ from PIL import Image, ImageDraw, ImageFont, ImageColor, ImageFilter
 import math
 import os
 import random
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Any, Optional, Union, Dict, List
+from .watermark.engine import (measure_text, split_position, glyph_signature, render_text_sprite, rotate_sprite,
+                               rotate_in_frame, composite_sprites, build_tile, composite_tiled)
+from .watermark.sprite_cache import sprite_cache
+from .watermark.fonts import font_cache
+from .watermark.trajectory import TRAJECTORIES, INTERPOLATIONS, build_trajectory_table
+from .watermark.output_cache import fingerprint, output_cache
+from .watermark.frame_store import FrameSource, FrameSink
+from .watermark import invisible
+from .profiling import profiled, profile_stage, profile_meta, profiling_enabled, active_profiler, worker_profile
+from .watermark.memory import RssMeter, chunk_frames
 
 class RemoveSceneText:
     
@@ -247,7 +260,7 @@ class MovingWatermark:
     🚬 动态水印生成器 - 为图像/视频帧添加可自定义的移动水印
     完整功能说明
     1. **核心功能**：，在图像/视频帧上添加可移动的文字水印，支持文生视频/图生视频工作流，水印位置根据帧索引自动更新
-    2. **自定义参数**：，`text`: 水印文字内容，`font_size`: 字体大小 (8-256px)，`font_color`: 文字颜色 (支持HEX/RGB格式)，`opacity`: 透明度 (0.0-1.0)，`speed`: 移动速度 (0.1-10倍速)，`trajectory`: 移动轨迹模式，`font_path`: 自定义字体文件路径，`custom_trajectory`: JSON格式的自定义路径，`rotation`: 文字旋转角度 (-360°-360°)，`dynamic_size`: 启用动态字体大小，`min_size`/`max_size`: 动态字体大小范围，`stroke_width`: 文字描边宽度，`stroke_color`: 描边颜色，`shadow`: 启用阴影效果，`shadow_color`: 阴影颜色，`shadow_offset`: 阴影偏移量，`blur_radius`: 模糊半径
+    2. **自定义参数**：，`text`: 水印文字内容，`font_size`: 字体大小 (8-256px)，`font_color`: 文字颜色 (支持HEX/RGB格式)，`opacity`: 透明度 (0.0-1.0)，`speed`: 移动速度 (0.1-10倍速)，`trajectory`: 移动轨迹模式，`font_path`: 自定义字体文件路径，`custom_trajectory`: JSON格式的自定义路径，`rotation`: 文字旋转角度 (-360°-360°)，`dynamic_size`: 启用动态字体大小，`min_size`/`max_size`: 动态字体大小范围，`stroke_width`: 文字描边宽度，`stroke_color`: 描边颜色，`shadow`: 启用阴影效果，`shadow_color`: 阴影颜色，`shadow_offset`: 阴影偏移量，`blur_radius`: 模糊半径，`engine`: 合成引擎（批量合成/逐帧PIL），`size_step`: 动态字号量化档位，`seed`: 随机轨迹种子，`path_interpolation`: 自定义路径插值方式（最近点/线性/样条），`memory_mode`: 内存模式（标准/分块/原地），`memory_limit_mb`: 分块模式每块的内存上限，`parallel_mode`: 并行方式（串行/线程池/进程池），`workers`: 并行工作者数量（0为CPU核数），`watermark_mode`: 水印模式（移动/平铺），`tile_spacing_x`/`tile_spacing_y`: 平铺间距，`tile_stagger`: 平铺隔行错开，`tile_scroll_x`/`tile_scroll_y`: 平铺每帧滚动像素
     3. **轨迹模式**：，`horizontal`: 水平移动，`vertical`: 垂直移动，`circular`: 圆形运动，`diagonal`: 对角线移动，`random`: 随机位置跳动，`spiral`: 螺旋运动，`wave`: 波浪运动，`bounce`: 弹跳运动，自定义路径: 通过JSON坐标点定义
     4. **高级效果**：，自动旋转：圆形/螺旋轨迹自动跟随路径旋转，动态大小：文字大小随时间波动变化，描边效果：增强文字可读性，阴影效果：增加立体感，模糊效果：创建柔和的水印
     """
@@ -262,7 +275,7 @@ class MovingWatermark:
                 "font_color": ("STRING", {"default": "#FFFFFF"}),
                 "opacity": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 1.0, "step": 0.01}),
                 "speed": ("FLOAT", {"default": 1.0, "min": 0.1, "max": 10.0, "step": 0.1}),
-                "trajectory": (["水平", "垂直", "圆形", "对角线", "随机", "螺旋", "波浪", "弹跳", "心形", "自定义路径"], {"default": "水平"}),
+                "trajectory": (TRAJECTORIES, {"default": "水平"}),
                 "frame_index": ("INT", {"default": 0, "min": 0}),
                 "total_frames": ("INT", {"default": 1, "min": 1}),
             },
@@ -279,243 +292,369 @@ class MovingWatermark:
                 "shadow_color": ("STRING", {"default": "#000000"}),
                 "shadow_offset": ("INT", {"default": 2, "min": 0, "max": 10}),
                 "blur_radius": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 5.0, "step": 0.1}),
+                "engine": (["批量合成", "逐帧PIL"], {"default": "批量合成"}),
+                "size_step": ("INT", {"default": 1, "min": 1, "max": 32}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
+                "path_interpolation": (INTERPOLATIONS, {"default": "最近点"}),
+                "memory_mode": (["标准", "分块", "原地"], {"default": "标准"}),
+                "memory_limit_mb": ("INT", {"default": 512, "min": 16, "max": 65536}),
+                "parallel_mode": (["串行", "线程池", "进程池"], {"default": "串行"}),
+                "workers": ("INT", {"default": 0, "min": 0, "max": 256}),
+                "watermark_mode": (["移动", "平铺"], {"default": "移动"}),
+                "tile_spacing_x": ("INT", {"default": 120, "min": 0, "max": 4096}),
+                "tile_spacing_y": ("INT", {"default": 80, "min": 0, "max": 4096}),
+                "tile_stagger": ("BOOLEAN", {"default": True}),
+                "tile_scroll_x": ("FLOAT", {"default": 0.0, "min": -512.0, "max": 512.0, "step": 0.1}),
+                "tile_scroll_y": ("FLOAT", {"default": 0.0, "min": -512.0, "max": 512.0, "step": 0.1}),
+                "profile": ("BOOLEAN", {"default": False}),
             }
         }
     
-    RETURN_TYPES = ("IMAGE",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("IMAGE", "性能报告")
     FUNCTION = "apply_watermark"
     CATEGORY = "🚬香烟的工具箱✅/2️⃣水印处理🎬"
     
-     # 添加属性描述（ComfyUI会使用这些作为悬浮提示）
+    # 只影响执行方式、不影响输出结果的参数，不参与指纹计算
+    EXECUTION_ONLY_INPUTS = ("memory_mode", "memory_limit_mb", "parallel_mode", "workers", "profile")
+
     @classmethod
-    def IS_CHANGED(cls, **kwargs):
-        return float("nan")
+    def _fingerprint(cls, image, params):
+        params = {k: v for k, v in params.items() if k not in cls.EXECUTION_ONLY_INPUTS}
+        return fingerprint(image, params)
+
+    @classmethod
+    def _cached_output_key(cls, image, params):
+        """结果缓存开启时返回本次执行的缓存键（每次执行只计算一次指纹），未开启时返回None"""
+        if not output_cache.enabled:
+            return None
+        with profile_stage("fingerprint"):
+            return cls._fingerprint(image, params)
+
+    # 输出只由输入图像和参数决定（随机轨迹也由seed决定），不定义IS_CHANGED，由ComfyUI按输入签名判断是否重新执行
     
     # 添加属性描述（ComfyUI会使用这些作为悬浮提示）
     @classmethod
     def VALIDATE_INPUTS(cls, **kwargs):
         return True
     
-    def __init__(self):
-        self.last_random_pos = (0, 0)
-        self.last_size = 36
-        self.last_rotation = 0
-        self.font_cache = {}
-        # 预计算心形轨迹点
-        self.heart_points = self.generate_heart_points(100)
-    
-    def generate_heart_points(self, num_points):
-        """生成心形轨迹的归一化坐标点"""
-        import math
-        points = []
-        for i in range(num_points):
-            t = 2 * math.pi * i / num_points
-            # 心形参数方程
-            x = 16 * (math.sin(t) ** 3)
-            y = 13 * math.cos(t) - 5 * math.cos(2*t) - 2 * math.cos(3*t) - math.cos(4*t)
-            # 归一化到0-1范围
-            x_norm = (x + 16) / 32 * 0.5 + 0.25  # 水平居中
-            y_norm = (y + 18) / 31 * 0.5 + 0.25  # 垂直居中
-            points.append((x_norm, y_norm))
-        return points
-    
     def get_font(self, font_path, font_size):
-        """获取字体对象并缓存以提高性能"""
-        import os
-        from PIL import ImageFont
-        
-        cache_key = f"{font_path}_{font_size}"
-        if cache_key in self.font_cache:
-            return self.font_cache[cache_key]
-        
+        """获取字体对象，所有实例共享进程级的字体索引和缓存"""
+        return font_cache.get(font_path, font_size)
+
+    def _parse_rgba(self, color, opacity, default):
+        """解析颜色字符串并附加透明度"""
         try:
-            if font_path and os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, font_size)
-            else:
-                # 尝试加载系统字体
-                try:
-                    # 尝试常见系统字体
-                    for font_name in ["Arial", "Helvetica", "DejaVuSans", "FreeSans"]:
-                        try:
-                            font = ImageFont.truetype(font_name, font_size)
-                            break
-                        except:
-                            continue
-                    else:
-                        # 所有尝试失败后使用默认字体
-                        font = ImageFont.load_default()
-                        # 调整默认字体大小
-                        font.size = font_size
-                except:
-                    # 回退到默认字体
-                    font = ImageFont.load_default()
-                    font.size = font_size
-        except Exception as e:
-            print(f"字体加载错误: {e}")
-            font = ImageFont.load_default()
-            font.size = font_size
-        
-        self.font_cache[cache_key] = font
-        return font
-		
-    def calculate_position(self, width, height, text_width, text_height, frame_idx, total_frames, trajectory, speed, custom_path):
-        """计算水印位置，支持多种轨迹模式"""
-        import math
-        import random
-        
-        # 确保进度计算正确，避免除以零
-        if total_frames <= 0:
-            total_frames = 1
-            
-        # 计算基于速度和帧索引的进度
-        progress = (frame_idx * speed) % total_frames / total_frames
-        normalized_progress = progress * 2 * math.pi  # 用于周期性运动
-        
-        # 优先处理自定义路径
-        if trajectory == "自定义路径" and custom_path and isinstance(custom_path, list) and len(custom_path) > 0:
-            # 自定义轨迹路径
-            idx = min(int(progress * len(custom_path)), len(custom_path) - 1)
-            point = custom_path[idx]
-            if isinstance(point, (list, tuple)) and len(point) >= 2:
-                x = point[0] * width
-                y = point[1] * height
-            else:
-                x = width * 0.5
-                y = height * 0.5
-            return x, y
-        
-        # 处理水平和垂直轨迹 - 确保第一帧可见
-        if trajectory == "水平":
-            # 从左侧开始，移动到右侧
-            x = progress * (width + text_width) - text_width * 0.5
-            y = height * 0.5
-            return x, y
-            
-        elif trajectory == "垂直":
-            # 从顶部开始，移动到底部
-            x = width * 0.5
-            y = progress * (height + text_height) - text_height * 0.5
-            return x, y
-            
-        # 其他轨迹模式
-        elif trajectory == "圆形":
-            radius = min(width, height) * 0.3
-            x = width * 0.5 + radius * math.cos(normalized_progress)
-            y = height * 0.5 + radius * math.sin(normalized_progress)
-            
-        elif trajectory == "对角线":
-            # 从左上角移动到右下角
-            x = progress * (width + text_width) - text_width * 0.5
-            y = progress * (height + text_height) - text_height * 0.5
-            
-        elif trajectory == "随机":
-            if frame_idx == 0 or frame_idx % max(1, int(10/speed)) == 0:
-                self.last_random_pos = (
-                    random.uniform(text_width * 0.5, width - text_width * 0.5),
-                    random.uniform(text_height * 0.5, height - text_height * 0.5)
-                )
-            x, y = self.last_random_pos
-            
-        elif trajectory == "螺旋":
-            # 螺旋轨迹：半径随时间增加
-            spiral_factor = 0.1 + 0.4 * progress
-            radius = min(width, height) * spiral_factor
-            x = width * 0.5 + radius * math.cos(normalized_progress * 4)
-            y = height * 0.5 + radius * math.sin(normalized_progress * 4)
-            
-        elif trajectory == "波浪":
-            # 波浪轨迹：水平移动+垂直波动
-            x = progress * (width + text_width) - text_width * 0.5
-            wave_height = height * 0.1
-            y = height * 0.5 + wave_height * math.sin(normalized_progress * 4)
-            
-        elif trajectory == "弹跳":
-            # 弹跳轨迹：模拟弹跳球
-            bounce_progress = progress * 2
-            if bounce_progress > 1:
-                bounce_progress = 2 - bounce_progress  # 反弹
-            height_factor = 1 - (bounce_progress - 1)**2  # 抛物线运动
-            x = progress * (width + text_width) - text_width * 0.5
-            y = height * (0.1 + 0.8 * height_factor)
-            
-        elif trajectory == "心形":
-            # 使用预计算的心形轨迹点
-            idx = min(int(progress * len(self.heart_points)), len(self.heart_points) - 1)
-            point = self.heart_points[idx]
-            x = point[0] * width
-            y = point[1] * height
-            
-        else:
-            # 默认居中
-            x = width * 0.5
-            y = height * 0.5
-            
-        return x, y
+            rgb = ImageColor.getrgb(color)
+            return tuple(list(rgb)[:3] + [int(255 * opacity)])
+        except:
+            return tuple(list(default) + [int(255 * opacity)])
 
-    def apply_watermark(self, image, text, font_size, font_color, opacity, speed, trajectory, 
-                    frame_index, total_frames, font_path="", custom_trajectory="[]", 
-                    rotation=0.0, dynamic_size=False, min_size=24, max_size=48,
-                    stroke_width=0, stroke_color="#000000", shadow=False, 
-                    shadow_color="#000000", shadow_offset=2, blur_radius=0.0):
-        import numpy as np
-        import json
-        import math
-        from PIL import Image, ImageDraw, ImageFilter, ImageColor
-        
-        # 转换为PIL图像处理
-        batch_size, height, width, channels = image.shape
-        result = torch.zeros_like(image)
-        
-        # 解析自定义轨迹
+    def _parse_custom_path(self, custom_trajectory):
+        """解析JSON格式的自定义轨迹，无效时返回空列表"""
         try:
             custom_path = json.loads(custom_trajectory)
             if not isinstance(custom_path, list):
                 custom_path = []
         except:
             custom_path = []
-        
-        # 处理颜色和透明度
-        try:
-            rgb = ImageColor.getrgb(font_color)
-            rgba = tuple(list(rgb) + [int(255 * opacity)])
-        except:
-            rgba = (255, 255, 255, int(255 * opacity))
-            
-        # 处理描边颜色
-        try:
-            stroke_rgb = ImageColor.getrgb(stroke_color)
-            stroke_rgba = tuple(list(stroke_rgb) + [int(255 * opacity)])
-        except:
-            stroke_rgba = (0, 0, 0, int(255 * opacity))
-            
-        # 处理阴影颜色
-        try:
-            shadow_rgb = ImageColor.getrgb(shadow_color)
-            shadow_rgba = tuple(list(shadow_rgb) + [int(255 * opacity)])
-        except:
-            shadow_rgba = (0, 0, 0, int(255 * opacity))
-        
+        return custom_path
+
+    def _render_params(self, text, font_color, opacity, rotation, font_path, stroke_width, stroke_color,
+                       shadow, shadow_color, shadow_offset, blur_radius):
+        """处理颜色和透明度，整理成_render_chunk需要的贴图参数"""
+        return dict(
+            text=text, rgba=self._parse_rgba(font_color, opacity, (255, 255, 255)),
+            rotation=rotation, font_path=font_path, stroke_width=stroke_width,
+            stroke_rgba=self._parse_rgba(stroke_color, opacity, (0, 0, 0)), shadow=shadow,
+            shadow_rgba=self._parse_rgba(shadow_color, opacity, (0, 0, 0)),
+            shadow_offset=shadow_offset, blur_radius=blur_radius,
+        )
+
+    def _trajectory_table(self, batch_size, width, height, text, font_path, font_size, speed, trajectory,
+                          frame_index, total_frames, custom_path, rotation, dynamic_size, min_size, max_size,
+                          size_step, seed, path_interpolation):
+        """一次性计算整批帧的字号、角度和文字绘制原点"""
+        def measure(size):
+            return measure_text(text, self.get_font(font_path, size), size)[1:]
+
+        with profile_stage("trajectory"):
+            return build_trajectory_table(
+                frame_index, batch_size, width, height, total_frames, trajectory, speed, custom_path,
+                font_size, dynamic_size, min_size, max_size, size_step, rotation, measure,
+                seed=seed, interpolation=path_interpolation,
+            )
+
+    @profiled
+    def apply_watermark(self, image, text, font_size, font_color, opacity, speed, trajectory, 
+                    frame_index, total_frames, font_path="", custom_trajectory="[]", 
+                    rotation=0.0, dynamic_size=False, min_size=24, max_size=48,
+                    stroke_width=0, stroke_color="#000000", shadow=False, 
+                    shadow_color="#000000", shadow_offset=2, blur_radius=0.0,
+                    engine="批量合成", size_step=1, seed=0, path_interpolation="最近点",
+                    memory_mode="标准", memory_limit_mb=512, parallel_mode="串行", workers=0,
+                    watermark_mode="移动", tile_spacing_x=120, tile_spacing_y=80, tile_stagger=True,
+                    tile_scroll_x=0.0, tile_scroll_y=0.0):
+        # 相同输入和参数的结果直接从缓存返回
+        inputs = {k: v for k, v in locals().items() if k not in ("self", "image")}
+        batch_size, height, width, channels = image.shape
+        profile_meta(frames=batch_size, width=width, height=height, dtype=str(image.dtype), engine=engine,
+                     watermark_mode=watermark_mode, memory_mode=memory_mode, parallel_mode=parallel_mode)
+        cache_key = self._cached_output_key(image, inputs)
+        cached = output_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            print(f"[MovingWatermark] 命中结果缓存: {image.shape[0]}帧, {output_cache.stats()}")
+            profile_meta(cache_hit=True)
+            return (cached,)
+
+        if memory_mode == "原地":
+            image = self._inplace_output(image)
+
+        custom_path = self._parse_custom_path(custom_trajectory)
+        params = self._render_params(text, font_color, opacity, rotation, font_path, stroke_width, stroke_color,
+                                     shadow, shadow_color, shadow_offset, blur_radius)
+
         # 确保总帧数有效
         if total_frames <= 0:
             total_frames = 1
+
+        rss_meter = RssMeter(reset_peak=profiling_enabled())
+        start_time = time.perf_counter()
+
+        if watermark_mode == "平铺":
+            # 平铺模式不使用轨迹，文字按font_size铺满画面
+            engine = "平铺"
+            result = self._apply_watermark_tiled(image, frame_index, memory_mode, memory_limit_mb, font_size,
+                                                 tile_spacing_x, tile_spacing_y, tile_stagger,
+                                                 tile_scroll_x, tile_scroll_y, **params)
+        elif engine == "逐帧PIL":
+            table = self._trajectory_table(
+                batch_size, width, height, text, font_path, font_size, speed, trajectory,
+                frame_index, total_frames, custom_path, rotation, dynamic_size, min_size, max_size,
+                size_step, seed, path_interpolation,
+            )
+            result = self._apply_watermark_legacy(image, table, **params)
+        else:
+            table = self._trajectory_table(
+                batch_size, width, height, text, font_path, font_size, speed, trajectory,
+                frame_index, total_frames, custom_path, rotation, dynamic_size, min_size, max_size,
+                size_step, seed, path_interpolation,
+            )
+            result = self._apply_watermark_batched(image, table, memory_mode, memory_limit_mb,
+                                                   parallel_mode, workers, **params)
+        elapsed = time.perf_counter() - start_time
+        peak_rss, rss_increase, rss_text = rss_meter.summary()
+
+        print(f"[MovingWatermark] {engine}/{memory_mode}/{parallel_mode}: {batch_size}帧, 用时{elapsed:.3f}s, "
+              f"{batch_size / max(elapsed, 1e-9):.1f} fps, {rss_text}")
+
+        profile_meta(peak_rss_mb=round(peak_rss / 1048576, 1), rss_increase_mb=round(rss_increase / 1048576, 1))
+
+        if cache_key is not None:
+            output_cache.put(cache_key, result)
+        return (result,)
+
+    def _inplace_output(self, image):
+        """节点的原地模式：每次执行把输入复制一份作为输出，之后的合成直接写入这份副本
+
+        上游节点的输出由ComfyUI缓存并可能被其他节点共用，不能直接修改；本节点之前返回的结果
+        也可能仍被下游节点、结果缓存或列表映射的其他项持有，因此不跨执行复用输出张量
+        """
+        with profile_stage("tensor_convert", image.numel() * image.element_size()):
+            return image.clone()
+
+    def _allocate_result(self, image, memory_mode):
+        """按内存模式准备输出张量：原地直接返回输入，分块只分配不复制（逐块复制），标准复制一份"""
+        if memory_mode == "原地":
+            return image
+        with profile_stage("tensor_convert", image.numel() * image.element_size()):
+            if memory_mode == "分块":
+                return torch.empty_like(image)
+            return image.clone()
+
+    def _apply_watermark_batched(self, image, table, memory_mode, memory_limit_mb, parallel_mode, workers, **params):
+        """批量合成：贴图经进程级缓存只渲染一次，再按帧偏移混合进整个张量
+
+        memory_mode:
+            标准 - 复制一份输出张量后整体处理
+            分块 - 预分配输出张量，按memory_limit_mb换算的帧数逐块复制并合成
+            原地 - 直接写入传入的张量，不分配输出（节点的原地模式传入的是_inplace_output复制的副本）
+        parallel_mode:
+            串行 / 线程池 / 进程池，各帧之间互不依赖，按帧块分配给workers个工作线程或进程，
+            结果与串行执行逐位一致
+        """
+        batch_size = image.shape[0]
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        if parallel_mode == "串行" or image.device.type != "cpu":
+            workers = 1
+
+        chunk = batch_size
+        if memory_mode == "分块":
+            frame_bytes = image[0].numel() * image.element_size()
+            chunk = chunk_frames(frame_bytes, memory_limit_mb, batch_size)
+        if workers > 1:
+            # 每个工作者分到多个小块，便于负载均衡
+            chunk = min(chunk, max(1, math.ceil(batch_size / (workers * 4))))
+        ranges = [(start, min(start + chunk, batch_size)) for start in range(0, batch_size, chunk)]
+        workers = min(workers, len(ranges))
+
+        if workers > 1 and parallel_mode == "进程池":
+            try:
+                return self._render_in_processes(image, table, memory_mode, ranges, workers, params)
+            except Exception as e:
+                print(f"[MovingWatermark] 进程池不可用，改用线程池: {e}")
+
+        result = self._allocate_result(image, memory_mode)
+
+        def render(frame_range):
+            start, end = frame_range
+            if memory_mode == "分块":
+                with profile_stage("tensor_convert", result[start:end].numel() * result.element_size()):
+                    result[start:end].copy_(image[start:end])
+            self._render_chunk(result, table, start, end, **params)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(render, ranges))
+        else:
+            for frame_range in ranges:
+                render(frame_range)
+        return result
+
+    def _apply_watermark_tiled(self, image, frame_index, memory_mode, memory_limit_mb, font_size,
+                               tile_spacing_x, tile_spacing_y, tile_stagger, tile_scroll_x, tile_scroll_y,
+                               text, rgba, rotation, font_path, stroke_width, stroke_rgba,
+                               shadow, shadow_rgba, shadow_offset, blur_radius):
+        """平铺模式：文字（含描边/阴影/模糊/旋转）只渲染成一个平铺单元，再按帧偏移铺满整个画面
+
+        tile_scroll_x/y为每帧滚动的像素数，偏移按全局帧索引计算，分批处理时图案保持连续。
+        """
+        result = self._allocate_result(image, memory_mode)
+        if not text:
+            if memory_mode == "分块":
+                result.copy_(image)
+            return result
+
+        font = self.get_font(font_path, font_size)
+        key = ("平铺", text, getattr(font, "path", font_path), font_size, rgba,
+               stroke_width, stroke_rgba if stroke_width > 0 else None,
+               shadow, shadow_rgba if shadow else None, shadow_offset if shadow else 0,
+               blur_radius, rotation, tile_spacing_x, tile_spacing_y, tile_stagger)
+
+        def render():
+            sprite = render_text_sprite(
+                text, font, font_size, rgba,
+                stroke_width=stroke_width, stroke_fill=stroke_rgba,
+                shadow=shadow, shadow_fill=shadow_rgba, shadow_offset=shadow_offset,
+                blur_radius=blur_radius,
+            )
+            if rotation != 0:
+                sprite = rotate_sprite(sprite, rotation)
+            return build_tile(sprite, tile_spacing_x, tile_spacing_y, tile_stagger)
+
+        tile = sprite_cache.get_or_render(key, render)
+        frames = frame_index + np.arange(image.shape[0])
+        offsets = list(zip(np.round(frames * tile_scroll_x).astype(np.int64).tolist(),
+                           np.round(frames * tile_scroll_y).astype(np.int64).tolist()))
+
+        chunk = image.shape[0]
+        if memory_mode == "分块":
+            frame_bytes = image[0].numel() * image.element_size()
+            chunk = chunk_frames(frame_bytes, memory_limit_mb, image.shape[0])
+        for start in range(0, image.shape[0], chunk):
+            end = min(start + chunk, image.shape[0])
+            if memory_mode == "分块":
+                with profile_stage("tensor_convert", result[start:end].numel() * result.element_size()):
+                    result[start:end].copy_(image[start:end])
+            composite_tiled(result[start:end], tile, offsets[start:end])
+        return result
+
+    def _render_in_processes(self, image, table, memory_mode, ranges, workers, params):
+        """进程池渲染：输出张量放在共享内存中，子进程直接写入各自的帧块"""
+        with profile_stage("tensor_convert", image.numel() * image.element_size()):
+            if memory_mode == "原地":
+                result = image.share_memory_()
+            else:
+                result = torch.empty_like(image).share_memory_()
+                for start, end in ranges:
+                    result[start:end].copy_(image[start:end])
+
+        context = None
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(_render_chunk_in_process, result, table, start, end, params)
+                       for start, end in ranges]
+            for future in futures:
+                stages = future.result()
+                if stages and active_profiler() is not None:
+                    active_profiler().merge(stages)
+        return result
+
+    def _render_chunk(self, result, table, start, end, text, rgba, rotation, font_path,
+                      stroke_width, stroke_rgba, shadow, shadow_rgba, shadow_offset, blur_radius):
+        """渲染[start, end)范围内的帧，原地混合进result[start:end]"""
+        batch_size, height, width, channels = result.shape
+
+        # 空文字或完全透明时没有需要绘制的内容
+        if not text or (rgba[3] == 0 and (stroke_width == 0 or stroke_rgba[3] == 0) and (not shadow or shadow_rgba[3] == 0)):
+            return
+
+        placements = []
+        for i in range(start, end):
+            current_size = int(table.size[i])
+            current_rotation = float(table.angle[i])
+            x, y = float(table.x[i]), float(table.y[i])
+
+            font = self.get_font(font_path, current_size)
+            base_x, phase_x = split_position(x)
+            base_y, phase_y = split_position(y)
+
+            # 贴图与帧无关，相同参数在所有帧、所有节点实例间共享；画出相同字形的相位共用一张贴图
+            key = (text, getattr(font, "path", font_path), current_size, rgba,
+                   stroke_width, stroke_rgba if stroke_width > 0 else None,
+                   shadow, shadow_rgba if shadow else None, shadow_offset if shadow else 0,
+                   blur_radius, glyph_signature(text, font, (phase_x, phase_y)))
+            sprite = sprite_cache.get_or_render(key, lambda: render_text_sprite(
+                text, font, current_size, rgba,
+                stroke_width=stroke_width, stroke_fill=stroke_rgba,
+                shadow=shadow, shadow_fill=shadow_rgba, shadow_offset=shadow_offset,
+                blur_radius=blur_radius, phase=(phase_x, phase_y),
+            ))
+
+            if current_rotation != 0:
+                # 只对贴图覆盖的区域重采样，采样位置与整帧旋转相同（随位置变化，所以不进缓存）；
+                # 完全落在画面外的帧直接跳过
+                placement = rotate_in_frame(sprite, x, y, current_rotation, width, height)
+                if placement is None:
+                    continue
+                rotated, px, py = placement
+                placements.append((i - start, rotated, px, py, 1.0))
+            else:
+                placements.append((i - start, sprite, base_x + sprite.offset[0], base_y + sprite.offset[1], 1.0))
+
+        composite_sprites(result[start:end], placements)
+
+    def _apply_watermark_legacy(self, image, table, text, rgba, rotation, font_path,
+                                stroke_width, stroke_rgba, shadow, shadow_rgba,
+                                shadow_offset, blur_radius):
+        """逐帧PIL合成（原实现），保留用于对照和性能比较"""
+        # 转换为PIL图像处理
+        batch_size, height, width, channels = image.shape
+        result = torch.zeros_like(image)
+        
+        frame_bytes = height * width * 4
         
         # 处理每张图像
         for i in range(batch_size):
-            img = image[i].numpy() * 255.0
-            pil_img = Image.fromarray(img.astype(np.uint8)).convert("RGBA")
+            with profile_stage("tensor_convert", frame_bytes * 2):
+                img = image[i].numpy() * 255.0
+                pil_img = Image.fromarray(img.astype(np.uint8)).convert("RGBA")
             
-            # 计算动态字体大小
-            current_size = font_size
-            if dynamic_size:
-                size_progress = (frame_index + i) * speed / total_frames
-                size_factor = (math.sin(size_progress * 2 * math.pi) + 1) / 2
-                current_size = int(min_size + size_factor * (max_size - min_size))
-            
-            # 计算动态旋转
-            current_rotation = rotation
-            if rotation == 0 and trajectory in ["圆形", "螺旋", "心形"]:
-                angle_progress = (frame_index + i) * speed / total_frames
-                current_rotation = angle_progress * 360
+            # 轨迹表中的字体大小和旋转
+            current_size = int(table.size[i])
+            current_rotation = float(table.angle[i])
             
             # 获取字体
             font = self.get_font(font_path, current_size)
@@ -524,84 +663,463 @@ class MovingWatermark:
             watermark = Image.new("RGBA", pil_img.size, (0, 0, 0, 0))
             draw = ImageDraw.Draw(watermark)
             
-            # 计算文字边界框
-            try:
-                text_bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = text_bbox[2] - text_bbox[0]
-                text_height = text_bbox[3] - text_bbox[1]
-            except:
-                # 回退估算
-                text_width = len(text) * current_size * 0.6
-                text_height = current_size
-            
-            # 计算水印位置 - 现在传递text_width和text_height
-            x, y = self.calculate_position(
-                pil_img.width, pil_img.height, 
-                text_width, text_height,
-                frame_index + i, total_frames, 
-                trajectory, speed, custom_path
-            )
-            
-            # 调整位置为中心点
-            x -= text_width / 2
-            y -= text_height / 2
-            
-            # 确保位置在图像范围内
-            x = max(0, min(pil_img.width - text_width, x))
-            y = max(0, min(pil_img.height - text_height, y))
-            
-            # 如果是单张图片且使用水平轨迹，调整到右下角
-            if total_frames == 1 and trajectory == "水平" and not custom_path:
-                # 调整到右下角位置
-                x = pil_img.width - text_width - 20  # 右边距20像素
-                y = pil_img.height - text_height - 20  # 下边距20像素
+            # 文字边界框和水印位置
+            text_width, text_height = table.text_width[i], table.text_height[i]
+            x, y = float(table.x[i]), float(table.y[i])
             
             # 绘制阴影
             if shadow:
-                shadow_pos = (x + shadow_offset, y + shadow_offset)
-                draw.text(shadow_pos, text, font=font, fill=shadow_rgba)
+                with profile_stage("text_draw", frame_bytes):
+                    shadow_pos = (x + shadow_offset, y + shadow_offset)
+                    draw.text(shadow_pos, text, font=font, fill=shadow_rgba)
             
             # 绘制描边
             if stroke_width > 0:
-                # 在多个方向上绘制描边
-                for dx in range(-stroke_width, stroke_width + 1):
-                    for dy in range(-stroke_width, stroke_width + 1):
-                        if dx != 0 or dy != 0:
-                            draw.text((x + dx, y + dy), text, font=font, fill=stroke_rgba)
+                with profile_stage("stroke"):
+                    # 在多个方向上绘制描边
+                    for dx in range(-stroke_width, stroke_width + 1):
+                        for dy in range(-stroke_width, stroke_width + 1):
+                            if dx != 0 or dy != 0:
+                                draw.text((x + dx, y + dy), text, font=font, fill=stroke_rgba)
                 
             # 绘制主文字
-            draw.text((x, y), text, font=font, fill=rgba)
+            with profile_stage("text_draw", frame_bytes):
+                draw.text((x, y), text, font=font, fill=rgba)
             
             # 应用模糊效果
             if blur_radius > 0:
-                watermark = watermark.filter(ImageFilter.GaussianBlur(blur_radius))
+                with profile_stage("blur", frame_bytes):
+                    watermark = watermark.filter(ImageFilter.GaussianBlur(blur_radius))
             
             # 应用旋转
             if current_rotation != 0:
-                # 创建临时画布用于旋转
-                temp_canvas = Image.new("RGBA", pil_img.size, (0, 0, 0, 0))
-                temp_canvas.paste(watermark, (0, 0))
-                rotated = temp_canvas.rotate(current_rotation, expand=True, resample=Image.BICUBIC)
-                
-                # 重新定位旋转后的水印
-                watermark = Image.new("RGBA", pil_img.size, (0, 0, 0, 0))
-                rot_x = int(x + text_width/2 - rotated.width/2)
-                rot_y = int(y + text_height/2 - rotated.height/2)
-                watermark.paste(rotated, (rot_x, rot_y))
+                with profile_stage("rotate", frame_bytes * 3):
+                    # 创建临时画布用于旋转
+                    temp_canvas = Image.new("RGBA", pil_img.size, (0, 0, 0, 0))
+                    temp_canvas.paste(watermark, (0, 0))
+                    rotated = temp_canvas.rotate(current_rotation, expand=True, resample=Image.BICUBIC)
+                    
+                    # 重新定位旋转后的水印
+                    watermark = Image.new("RGBA", pil_img.size, (0, 0, 0, 0))
+                    rot_x = int(x + text_width/2 - rotated.width/2)
+                    rot_y = int(y + text_height/2 - rotated.height/2)
+                    watermark.paste(rotated, (rot_x, rot_y))
             
             # 合并图层
-            result_img = Image.alpha_composite(pil_img, watermark).convert("RGB")
-            result[i] = torch.from_numpy(np.array(result_img).astype(np.float32) / 255.0)
+            with profile_stage("composite", frame_bytes):
+                result_img = Image.alpha_composite(pil_img, watermark).convert("RGB")
+            with profile_stage("tensor_convert", frame_bytes * 2):
+                result[i] = torch.from_numpy(np.array(result_img).astype(np.float32) / 255.0)
                         
-        return (result,)
+        return result
                 
+class StreamingMovingWatermark(MovingWatermark):
+    DESCRIPTION = """
+    🚬 动态水印生成器（磁盘流式）- 长视频不必把全部帧以float32载入内存
+    1. **输入**：`source_path`为内存映射读取的.npy文件（[帧数, 高, 宽, 通道]，uint8或float32）、原始RGB24文件（需填写`raw_width`/`raw_height`）或图片序列目录
+    2. **输出**：`output_path`为.npy（与输入相同的数据类型）、.raw/.rgb原始RGB24文件或图片序列目录，按块写回内存映射文件，常驻内存只与`memory_limit_mb`有关
+    3. **帧索引**：`frame_index`为第一帧在整个视频中的序号，分段处理时把上一段输出的`下一帧索引`连到下一段，轨迹保持连续；`total_frames`为0时取frame_index+源帧数
+    4. 水印参数与动态水印生成器相同
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = super().INPUT_TYPES()
+        required = {k: v for k, v in inputs["required"].items() if k not in ("image", "frame_index", "total_frames")}
+        optional = {k: v for k, v in inputs["optional"].items() if k not in ("engine", "memory_mode")}
+        return {
+            "required": {
+                "source_path": ("STRING", {"default": ""}),
+                "output_path": ("STRING", {"default": ""}),
+                **required,
+                "frame_index": ("INT", {"default": 0, "min": 0}),
+                "total_frames": ("INT", {"default": 0, "min": 0}),
+            },
+            "optional": {
+                "raw_width": ("INT", {"default": 0, "min": 0, "max": 16384}),
+                "raw_height": ("INT", {"default": 0, "min": 0, "max": 16384}),
+                **optional,
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "INT", "INT", "STRING")
+    RETURN_NAMES = ("输出路径", "帧数", "下一帧索引", "性能报告")
+    FUNCTION = "stream_watermark"
+    OUTPUT_NODE = True
+
+    # 读取源文件的修改时间和大小代替图像指纹，文件或参数变化时重新执行
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        source_path = kwargs.get("source_path", "")
+        try:
+            stat = os.stat(source_path)
+            kwargs["source_stat"] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return float("nan")
+        params = {k: v for k, v in kwargs.items() if k not in cls.EXECUTION_ONLY_INPUTS}
+        return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+    @profiled
+    def stream_watermark(self, source_path, output_path, text, font_size, font_color, opacity, speed, trajectory,
+                         frame_index, total_frames, raw_width=0, raw_height=0, font_path="",
+                         custom_trajectory="[]", rotation=0.0, dynamic_size=False, min_size=24, max_size=48,
+                         stroke_width=0, stroke_color="#000000", shadow=False, shadow_color="#000000",
+                         shadow_offset=2, blur_radius=0.0, size_step=1, seed=0, path_interpolation="最近点",
+                         memory_limit_mb=512, parallel_mode="串行", workers=0, watermark_mode="移动",
+                         tile_spacing_x=120, tile_spacing_y=80, tile_stagger=True, tile_scroll_x=0.0, tile_scroll_y=0.0):
+        source = FrameSource(source_path, raw_width, raw_height)
+        if not output_path:
+            output_path = os.path.splitext(source_path.rstrip("/\\"))[0] + "_watermarked.npy"
+        if os.path.abspath(output_path) == os.path.abspath(source_path):
+            raise ValueError("output_path不能与source_path相同")
+        if total_frames <= 0:
+            total_frames = frame_index + source.frames
+
+        custom_path = self._parse_custom_path(custom_trajectory)
+        params = self._render_params(text, font_color, opacity, rotation, font_path, stroke_width, stroke_color,
+                                     shadow, shadow_color, shadow_offset, blur_radius)
+
+        # 读下一块与合成当前块重叠进行，最多同时存在两块，每帧按两份计入上限（不把上限减半，避免整除成0变成不限制）
+        frame_bytes = source.height * source.width * 3 * np.dtype(source.dtype).itemsize
+        chunk = chunk_frames(frame_bytes * 2, memory_limit_mb, source.frames)
+        ranges = [(start, min(start + chunk, source.frames)) for start in range(0, source.frames, chunk)]
+
+        rss_meter = RssMeter(reset_peak=profiling_enabled())
+        start_time = time.perf_counter()
+        sink = FrameSink(output_path, source.frames, source.height, source.width, source.dtype)
+        try:
+            with ThreadPoolExecutor(max_workers=1) as reader:
+                pending = reader.submit(source.read, *ranges[0])
+                for index, (start, end) in enumerate(ranges):
+                    with profile_stage("read_wait"):
+                        frames = pending.result()
+                    if index + 1 < len(ranges):
+                        pending = reader.submit(source.read, *ranges[index + 1])
+
+                    # uint8帧直接合成，只有水印覆盖的区域会临时转换成float32
+                    images = torch.from_numpy(frames)
+                    if sink.dtype == np.uint8 and images.is_floating_point():
+                        images = images.mul_(255.0).round_().clamp_(0, 255).to(torch.uint8)
+                    if watermark_mode == "平铺":
+                        images = self._apply_watermark_tiled(images, frame_index + start, "原地", 0, font_size,
+                                                             tile_spacing_x, tile_spacing_y, tile_stagger,
+                                                             tile_scroll_x, tile_scroll_y, **params)
+                    else:
+                        table = self._trajectory_table(
+                            end - start, source.width, source.height, text, font_path, font_size, speed,
+                            trajectory, frame_index + start, total_frames, custom_path, rotation, dynamic_size,
+                            min_size, max_size, size_step, seed, path_interpolation,
+                        )
+                        images = self._apply_watermark_batched(images, table, "原地", 0, parallel_mode, workers,
+                                                               **params)
+
+                    with profile_stage("write", images.numel() * images.element_size()):
+                        sink.write(start, images.numpy())
+                    del frames, images
+        finally:
+            sink.close()
+
+        elapsed = time.perf_counter() - start_time
+        peak_rss, _, rss_text = rss_meter.summary()
+        profile_meta(frames=source.frames, width=source.width, height=source.height, chunks=len(ranges),
+                     dtype=str(source.dtype), peak_rss_mb=round(peak_rss / 1048576, 1))
+        print(f"[StreamingMovingWatermark] {source.frames}帧({len(ranges)}块), 用时{elapsed:.3f}s, "
+              f"{source.frames / max(elapsed, 1e-9):.1f} fps, {rss_text} → {output_path}")
+        return (output_path, source.frames, frame_index + source.frames)
+
+# 图层参数中只影响执行方式、由叠加节点统一设置的输入
+LAYER_EXCLUDED_INPUTS = ("image", "frame_index", "total_frames", "engine",
+                         "memory_mode", "memory_limit_mb", "parallel_mode", "workers", "profile")
+
+
+def layer_defaults():
+    """水印图层的全部参数及默认值，与动态水印生成器的输入保持一致"""
+    inputs = MovingWatermark.INPUT_TYPES()
+    defaults = {}
+    for group in ("required", "optional"):
+        for name, spec in inputs[group].items():
+            if name not in LAYER_EXCLUDED_INPUTS:
+                defaults[name] = spec[1].get("default")
+    defaults["fps"] = 24.0
+    return defaults
+
+
+def normalize_layer(layer):
+    """补齐图层默认参数，未知的参数名直接报错，避免拼写错误被静默忽略"""
+    if not isinstance(layer, dict):
+        raise ValueError(f"水印图层应为JSON对象: {layer!r}")
+    defaults = layer_defaults()
+    unknown = sorted(set(layer) - set(defaults))
+    if unknown:
+        raise ValueError(f"未知的水印图层参数: {', '.join(unknown)}，可用参数: {', '.join(defaults)}")
+    return {**defaults, **layer}
+
+
+class WatermarkLayer:
+    DESCRIPTION = """
+    🚬 水印图层 - 配置一个水印图层，可串联多个后连接到多层水印叠加节点
+    参数与动态水印生成器相同；文字中的`{frame}`替换为帧序号，`{time}`按`fps`替换为时间码(时:分:秒.毫秒)
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = MovingWatermark.INPUT_TYPES()
+        required = {k: v for k, v in inputs["required"].items() if k not in LAYER_EXCLUDED_INPUTS}
+        optional = {k: v for k, v in inputs["optional"].items() if k not in LAYER_EXCLUDED_INPUTS}
+        return {
+            "required": required,
+            "optional": {
+                "layers": ("WATERMARK_LAYERS",),
+                "fps": ("FLOAT", {"default": 24.0, "min": 1.0, "max": 240.0, "step": 0.01}),
+                **optional,
+            }
+        }
+
+    RETURN_TYPES = ("WATERMARK_LAYERS",)
+    RETURN_NAMES = ("图层",)
+    FUNCTION = "add_layer"
+    CATEGORY = "🚬香烟的工具箱✅/2️⃣水印处理🎬"
+
+    def add_layer(self, layers=None, **layer):
+        return (list(layers or []) + [normalize_layer(layer)],)
+
+
+class WatermarkStack(MovingWatermark):
+    DESCRIPTION = """
+    🚬 多层水印叠加 - 移动水印、固定角标、时间码等多个图层一次完成
+    1. **图层**：`layers`连接串联的水印图层节点，`layers_json`为图层参数组成的JSON数组（参数名与动态水印生成器相同，未填写的取默认值），两者都提供时先绘制串联的图层
+    2. **文字占位符**：`{frame}`替换为帧序号，`{time}`按图层的`fps`替换为时间码
+    3. **单次处理**：只分配一份输出，按块处理帧，每块依次绘制所有图层
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        inputs = MovingWatermark.INPUT_TYPES()
+        return {
+            "required": {
+                "image": inputs["required"]["image"],
+                "frame_index": inputs["required"]["frame_index"],
+                "total_frames": inputs["required"]["total_frames"],
+            },
+            "optional": {
+                "layers": ("WATERMARK_LAYERS",),
+                "layers_json": ("STRING", {"default": "[]", "multiline": True}),
+                **{k: inputs["optional"][k] for k in ("memory_mode", "memory_limit_mb", "parallel_mode", "workers",
+                                                      "profile")},
+            }
+        }
+
+    FUNCTION = "apply_layers"
+
+    @staticmethod
+    def _layer_text(text, frame, fps):
+        """替换文字中的帧序号和时间码占位符"""
+        if "{frame}" in text:
+            text = text.replace("{frame}", str(frame))
+        if "{time}" in text:
+            millis = int(round(frame * 1000 / fps))
+            text = text.replace("{time}", f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:"
+                                          f"{millis // 1000 % 60:02d}.{millis % 1000:03d}")
+        return text
+
+    def _layer_runs(self, layer, frame_index, start, end):
+        """把[start, end)拆成文字相同的连续帧段，返回[(段起点, 段终点, 文字), ...]"""
+        text = layer["text"]
+        if "{frame}" not in text and "{time}" not in text:
+            return [(start, end, text)]
+        runs = []
+        for i in range(start, end):
+            current = self._layer_text(text, frame_index + i, layer["fps"])
+            if runs and runs[-1][2] == current:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1, current])
+        return [tuple(run) for run in runs]
+
+    def _draw_layer(self, result, layer, frame_index, total_frames, start, end, parallel_mode, workers):
+        """把一个图层原地绘制到result[start:end]"""
+        height, width = result.shape[1], result.shape[2]
+        custom_path = self._parse_custom_path(layer["custom_trajectory"])
+        for run_start, run_end, text in self._layer_runs(layer, frame_index, start, end):
+            params = self._render_params(text, layer["font_color"], layer["opacity"], layer["rotation"],
+                                         layer["font_path"], layer["stroke_width"], layer["stroke_color"],
+                                         layer["shadow"], layer["shadow_color"], layer["shadow_offset"],
+                                         layer["blur_radius"])
+            frames = result[run_start:run_end]
+            if layer["watermark_mode"] == "平铺":
+                self._apply_watermark_tiled(frames, frame_index + run_start, "原地", 0, layer["font_size"],
+                                            layer["tile_spacing_x"], layer["tile_spacing_y"], layer["tile_stagger"],
+                                            layer["tile_scroll_x"], layer["tile_scroll_y"], **params)
+            else:
+                table = self._trajectory_table(
+                    run_end - run_start, width, height, text, layer["font_path"], layer["font_size"],
+                    layer["speed"], layer["trajectory"], frame_index + run_start, total_frames, custom_path,
+                    layer["rotation"], layer["dynamic_size"], layer["min_size"], layer["max_size"],
+                    layer["size_step"], layer["seed"], layer["path_interpolation"],
+                )
+                self._apply_watermark_batched(frames, table, "原地", 0, parallel_mode, workers, **params)
+
+    @profiled
+    def apply_layers(self, image, frame_index, total_frames, layers=None, layers_json="[]",
+                     memory_mode="标准", memory_limit_mb=512, parallel_mode="串行", workers=0):
+        inputs = {k: v for k, v in locals().items() if k not in ("self", "image")}
+        profile_meta(frames=image.shape[0], width=image.shape[2], height=image.shape[1],
+                     memory_mode=memory_mode, parallel_mode=parallel_mode)
+        cache_key = self._cached_output_key(image, inputs)
+        cached = output_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            print(f"[WatermarkStack] 命中结果缓存: {image.shape[0]}帧, {output_cache.stats()}")
+            profile_meta(cache_hit=True)
+            return (cached,)
+
+        try:
+            json_layers = json.loads(layers_json) if layers_json.strip() else []
+        except json.JSONDecodeError as e:
+            raise ValueError(f"layers_json不是有效的JSON: {e}")
+        if isinstance(json_layers, dict):
+            json_layers = [json_layers]
+        all_layers = list(layers or []) + [normalize_layer(layer) for layer in json_layers]
+        if total_frames <= 0:
+            total_frames = 1
+        if memory_mode == "原地":
+            image = self._inplace_output(image)
+
+        rss_meter = RssMeter(reset_peak=profiling_enabled())
+        start_time = time.perf_counter()
+        batch_size = image.shape[0]
+
+        # 只分配一份输出；每块帧依次绘制全部图层，块内数据在缓存中时完成所有混合
+        profile_meta(layers=len(all_layers))
+        result = self._allocate_result(image, memory_mode)
+        chunk = batch_size
+        if memory_mode == "分块":
+            chunk = chunk_frames(image[0].numel() * image.element_size(), memory_limit_mb, batch_size)
+        for start in range(0, batch_size, chunk):
+            end = min(start + chunk, batch_size)
+            if memory_mode == "分块":
+                with profile_stage("tensor_convert", result[start:end].numel() * result.element_size()):
+                    result[start:end].copy_(image[start:end])
+            for layer in all_layers:
+                self._draw_layer(result, layer, frame_index, total_frames, start, end, parallel_mode, workers)
+
+        elapsed = time.perf_counter() - start_time
+        print(f"[WatermarkStack] {len(all_layers)}个图层/{memory_mode}/{parallel_mode}: {batch_size}帧, "
+              f"用时{elapsed:.3f}s, {batch_size / max(elapsed, 1e-9):.1f} fps, {rss_meter.summary()[2]}")
+
+        if cache_key is not None:
+            output_cache.put(cache_key, result)
+        return (result,)
+
+class InvisibleWatermark:
+    DESCRIPTION = """
+    🚬 隐形水印 - 把一段短消息嵌入每帧的频域，画面上看不出来
+    1. **消息**：`message`最多8个字节（UTF-8，中文约2个字），附带8位校验，用`🚬隐形水印检测`读回
+    2. **密钥**：`key`决定嵌入位置，检测时必须使用相同的密钥
+    3. **强度**：`strength`为中频系数幅度的调制比例，默认0.15时PSNR约45dB，越大越可靠、越容易看出；512x512以下的单张图片建议提高强度
+    4. **鲁棒性**：能抵抗JPEG重新编码（质量50以上）和轻微的亮度调整，不能抵抗缩放和裁剪
+    5. 整批帧一次完成FFT，`memory_limit_mb`限制每块的工作内存
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "message": ("STRING", {"default": "水印", "multiline": False}),
+                "key": ("INT", {"default": 0, "min": 0, "max": 0xffffffff}),
+                "strength": ("FLOAT", {"default": 0.15, "min": 0.01, "max": 1.0, "step": 0.01}),
+            },
+            "optional": {
+                "memory_limit_mb": ("INT", {"default": 1024, "min": 16, "max": 65536}),
+                "profile": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("IMAGE", "性能报告")
+    FUNCTION = "embed_watermark"
+    CATEGORY = "🚬香烟的工具箱✅/2️⃣水印处理🎬"
+
+    @staticmethod
+    def _chunk(image, memory_limit_mb):
+        """每块帧数：亮度、频谱和增量的工作内存约为每像素24字节"""
+        batch_size, height, width = image.shape[:3]
+        return chunk_frames(height * width * 24, memory_limit_mb, batch_size)
+
+    @profiled
+    def embed_watermark(self, image, message, key, strength, memory_limit_mb=1024):
+        start_time = time.perf_counter()
+        batch_size, height, width = image.shape[:3]
+        profile_meta(frames=batch_size, width=width, height=height, dtype=str(image.dtype))
+        mask = invisible.gain_mask(height, width, key, invisible.encode_payload(message), strength, image.device)
+        # 增量直接与输入相加写入输出，不需要先复制一份输入
+        result = torch.empty_like(image)
+        chunk = self._chunk(image, memory_limit_mb)
+        for start in range(0, batch_size, chunk):
+            invisible.embed_chunk(image[start:start + chunk], mask, out=result[start:start + chunk])
+        elapsed = time.perf_counter() - start_time
+        print(f"[InvisibleWatermark] {batch_size}帧, 用时{elapsed:.3f}s, {batch_size / max(elapsed, 1e-9):.1f} fps")
+        return (result,)
+
+
+class InvisibleWatermarkDetector:
+    DESCRIPTION = """
+    🚬 隐形水印检测 - 读取`🚬隐形水印`嵌入的消息
+    1. **密钥**：`key`必须与嵌入时相同
+    2. **检测分数**：各比特z分数绝对值的平均，无水印的画面约为0.8，超过1.5且校验通过时判定为检测到
+    3. 多帧输入时按整段视频合并判定，帧数越多越可靠
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "key": ("INT", {"default": 0, "min": 0, "max": 0xffffffff}),
+            },
+            "optional": {
+                "memory_limit_mb": ("INT", {"default": 1024, "min": 16, "max": 65536}),
+                "profile": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "BOOLEAN", "FLOAT", "STRING")
+    RETURN_NAMES = ("消息", "检测到", "检测分数", "性能报告")
+    FUNCTION = "detect_watermark"
+    CATEGORY = "🚬香烟的工具箱✅/2️⃣水印处理🎬"
+
+    @profiled
+    def detect_watermark(self, image, key, memory_limit_mb=1024):
+        batch_size = image.shape[0]
+        chunk = InvisibleWatermark._chunk(image, memory_limit_mb)
+        scores = torch.cat([invisible.bit_scores(image[start:start + chunk], key)
+                            for start in range(0, batch_size, chunk)])
+        result = invisible.detect(scores)
+        profile_meta(**result)
+        print(f"[InvisibleWatermarkDetector] {batch_size}帧, 检测分数{result['score']:.2f}, "
+              f"{'检测到' if result['detected'] else '未检测到'}: {result['message']!r}")
+        message = result["message"] if result["detected"] else ""
+        return (message, result["detected"], round(result["score"], 3))
+
+def _render_chunk_in_process(result, table, start, end, params):
+    """进程池工作函数：result位于共享内存，渲染结果直接写回；启用剖析时返回子进程的阶段统计"""
+    torch.set_num_threads(1)
+    with worker_profile() as stages:
+        MovingWatermark()._render_chunk(result, table, start, end, **params)
+    return stages
+
 # 节点映射
 NODE_CLASS_MAPPINGS = {
     "MultilineTextMerger": MultilineTextMerger,
     "TextReplacer": TextReplacer,
     "RemoveSceneText": RemoveSceneText,
     "JsonKeyExtractor": JsonKeyExtractor,
-    "MovingWatermark": MovingWatermark
+    "MovingWatermark": MovingWatermark,
+    "StreamingMovingWatermark": StreamingMovingWatermark,
+    "WatermarkLayer": WatermarkLayer,
+    "WatermarkStack": WatermarkStack,
+    "InvisibleWatermark": InvisibleWatermark,
+    "InvisibleWatermarkDetector": InvisibleWatermarkDetector
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -609,5 +1127,10 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "TextReplacer": "🚬文本替换器✅",
     "RemoveSceneText": "🚬删除结尾场景语句V2.0✅",
     "JsonKeyExtractor": "🚬JSON键值提取器✅",
-    "MovingWatermark": "🚬动态水印生成器✅"
+    "MovingWatermark": "🚬动态水印生成器✅",
+    "StreamingMovingWatermark": "🚬动态水印生成器(磁盘流式)✅",
+    "WatermarkLayer": "🚬水印图层✅",
+    "WatermarkStack": "🚬多层水印叠加✅",
+    "InvisibleWatermark": "🚬隐形水印✅",
+    "InvisibleWatermarkDetector": "🚬隐形水印检测✅"
 }
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+性能剖析
+
+通过环境变量ALWAYSONLINE_PROFILE=1或节点的profile开关启用，按阶段记录耗时、次数和分配/写入的字节数。
+节点结束时以单行JSON输出到日志（设置ALWAYSONLINE_PROFILE_LOG时同时追加到该文件），
+并作为节点的“性能报告”输出返回。未启用时各个埋点只是一个空的上下文管理器。
+"""
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+
+ENV_ENABLED = os.environ.get("ALWAYSONLINE_PROFILE", "").lower() in ("1", "true", "yes", "on")
+LOG_FILE = os.environ.get("ALWAYSONLINE_PROFILE_LOG", "")
+
+_NULL_STAGE = nullcontext()
+# ComfyUI按顺序执行节点，节点内的线程池共享同一个剖析器，所以用进程级变量而不是线程局部变量
+_active = None
+# 与节点并发运行、不属于任何节点的后台线程（如模型预加载）在这里标记为不记录
+_background = threading.local()
+
+
+class Profiler:
+    """按阶段名累计的计时器（线程安全）"""
+
+    def __init__(self, node):
+        self.node = node
+        self.meta = {}
+        self.stages = {}
+        self.wall_seconds = 0.0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, nbytes=0, count=1):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0}
+            stage["count"] += count
+            stage["total_ms"] += seconds * 1000
+            stage["max_ms"] = max(stage["max_ms"], seconds * 1000 / max(count, 1))
+            stage["bytes"] += int(nbytes)
+
+    def merge(self, stages):
+        """合并其他剖析器（如进程池子进程）的阶段统计"""
+        with self._lock:
+            for name, other in stages.items():
+                stage = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0})
+                stage["count"] += other["count"]
+                stage["total_ms"] += other["total_ms"]
+                stage["max_ms"] = max(stage["max_ms"], other["max_ms"])
+                stage["bytes"] += other["bytes"]
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, nbytes)
+
+    def report(self):
+        with self._lock:
+            stages = {
+                name: {"count": s["count"], "total_ms": round(s["total_ms"], 3),
+                       "max_ms": round(s["max_ms"], 3), "bytes": s["bytes"]}
+                for name, s in sorted(self.stages.items(), key=lambda item: -item[1]["total_ms"])
+            }
+        return {
+            "node": self.node,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_ms": round(self.wall_seconds * 1000, 3),
+            "meta": self.meta,
+            "stages": stages,
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), ensure_ascii=False, default=str)
+
+
+def profile_stage(name, nbytes=0):
+    """剖析当前节点的一个阶段：with profile_stage("composite", nbytes): ..."""
+    profiler = _active
+    if profiler is None or getattr(_background, "active", False):
+        return _NULL_STAGE
+    return profiler.stage(name, nbytes)
+
+
+def profiling_enabled():
+    return _active is not None
+
+
+def active_profiler():
+    return _active
+
+
+@contextmanager
+def node_profile(node, enabled=False):
+    """节点执行期间启用剖析，yield Profiler（未启用时为None），结束时输出JSON日志"""
+    global _active
+    if not (enabled or ENV_ENABLED):
+        yield None
+        return
+    profiler = Profiler(node)
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        profiler.wall_seconds = time.perf_counter() - profiler._start
+        line = profiler.to_json()
+        print(f"[Profile] {line}")
+        if LOG_FILE:
+            try:
+                with open(LOG_FILE, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"[Profile] 写入日志失败: {e}")
+
+
+def profile_meta(**values):
+    """给当前节点的报告补充说明信息（帧数、分辨率、token数等）"""
+    profiler = _active
+    if profiler is not None and not getattr(_background, "active", False):
+        with profiler._lock:
+            profiler.meta.update(values)
+
+
+def profiled(func):
+    """节点函数装饰器：增加profile参数，并在返回值末尾追加性能报告（未启用时为空字符串）"""
+    @functools.wraps(func)
+    def wrapper(self, *args, profile=False, **kwargs):
+        with node_profile(type(self).__name__, profile) as profiler:
+            outputs = func(self, *args, **kwargs)
+        return tuple(outputs) + (profiler.to_json() if profiler is not None else "",)
+    return wrapper
+
+
+@contextmanager
+def background_task():
+    """在当前线程中不向节点的剖析器记录任何阶段和说明信息，用于与节点并发执行的后台任务"""
+    previous = getattr(_background, "active", False)
+    _background.active = True
+    try:
+        yield
+    finally:
+        _background.active = previous
+
+
+@contextmanager
+def worker_profile():
+    """进程池子进程中使用：fork继承了父进程的剖析器，这里换成新的剖析器，
+    yield其阶段统计字典（未启用时为None），由父进程merge"""
+    global _active
+    if _active is None:
+        yield None
+        return
+    profiler = Profiler(_active.node)
+    previous, _active = _active, profiler
+    try:
+        yield profiler.stages
+    finally:
+        _active = previous
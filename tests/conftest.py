@@ -0,0 +1,9 @@
+"""
+测试不依赖ComfyUI：comfy用空模块代替
+
+仓库根目录就是插件包，pytest收集tests时会先导入根目录的__init__（进而导入nodes.py中的import comfy）
+"""
+import sys
+import types
+
+sys.modules.setdefault("comfy", types.ModuleType("comfy"))
@@ -0,0 +1,95 @@
+"""
+GLM-4V 加载模式的测试
+
+用随机权重的微型Glm4v结构保存成safetensors后按各加载模式加载（不需要下载模型），
+检查加载前的占用估算，以及限额卸载（层卸载到磁盘）的输出与默认加载相同。
+
+    python -m pytest tests
+"""
+import os
+import sys
+import types
+import importlib
+
+import pytest
+import torch
+
+transformers = pytest.importorskip("transformers")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "alwaysonline_test"
+
+
+def load_glm_module(name):
+    """在不执行插件__init__的情况下导入glm4v下的模块（comfy用空模块代替）"""
+    sys.modules.setdefault("comfy", types.ModuleType("comfy"))
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.glm4v.{name}")
+
+
+@pytest.fixture(scope="module")
+def loading():
+    return load_glm_module("loading")
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    from transformers import Glm4vConfig, Glm4vForConditionalGeneration
+    config = Glm4vConfig(
+        text_config=dict(
+            vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=1024,
+            rope_parameters={"rope_type": "default", "rope_theta": 10000.0, "mrope_section": [1, 1, 2]},
+            eos_token_id=0, pad_token_id=0,
+        ),
+        vision_config=dict(
+            depth=1, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=32,
+            patch_size=14, spatial_merge_size=2, temporal_patch_size=2,
+        ),
+        image_token_id=14, image_start_token_id=10, image_end_token_id=11,
+        video_token_id=15, video_start_token_id=12, video_end_token_id=13,
+    )
+    torch.manual_seed(0)
+    path = tmp_path_factory.mktemp("tiny-glm4v")
+    Glm4vForConditionalGeneration(config).to(torch.bfloat16).save_pretrained(path)
+    return str(path)
+
+
+def logits(model):
+    input_ids = torch.arange(20, 36)[None]
+    with torch.no_grad():
+        return model(input_ids=input_ids, mm_token_type_ids=torch.zeros_like(input_ids, dtype=torch.int32)).logits
+
+
+def test_expected_bytes_per_mode(loading, model_path):
+    registry = load_glm_module("model_registry")
+    usage = {mode: registry.model_bytes(loading.load_model(model_path, "sdpa", mode))["cpu"]
+             for mode in ("默认", "低内存", "int8动态量化")}
+    expected = {mode: loading.expected_bytes(mode, model_path) for mode in usage}
+    # 估算不含rotary等缓冲区
+    assert expected["默认"] == pytest.approx(usage["默认"], rel=0.01)
+    assert expected["低内存"] == pytest.approx(usage["低内存"], rel=0.01)
+    # int8取加载峰值和量化后占用中的较大者；微型模型的词嵌入占比大，float32的其余参数让它比bf16更大
+    assert expected["int8动态量化"] >= usage["int8动态量化"] * 0.99
+    assert expected["int8动态量化"] > expected["默认"]
+
+
+def test_offload_matches_default(loading, model_path, tmp_path, monkeypatch):
+    """限额卸载：上限放不下的层卸载到磁盘，估算按上限封顶，输出与默认加载逐位一致"""
+    pytest.importorskip("accelerate")
+    monkeypatch.setattr(loading, "MAX_MEMORY", "cpu=100KiB")
+    monkeypatch.setattr(loading, "OFFLOAD_DIR", str(tmp_path))
+    assert loading.expected_bytes("限额卸载", model_path) == 100 * 1024
+
+    offloaded = loading.load_model(model_path, "sdpa", "限额卸载")
+    assert "disk" in set(offloaded.hf_device_map.values())
+    assert torch.equal(logits(offloaded), logits(loading.load_model(model_path, "sdpa", "默认")))
+
+
+def test_parse_max_memory(loading, monkeypatch):
+    monkeypatch.setattr(loading, "MAX_MEMORY", "0=20GiB, 1=4GB, cpu=512MiB")
+    assert loading.device_limit("cpu") == 512 * 1024 ** 2
+    assert loading.device_limit("cuda") == 20 * 1024 ** 3 + 4 * 10 ** 9
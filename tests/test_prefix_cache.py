@@ -0,0 +1,167 @@
+"""
+系统提示词前缀KV缓存的等价性测试
+
+用随机权重的微型Glm4v结构（不需要下载模型）比较贪心解码时使用/不使用PrefixCache的输出，
+覆盖纯文本、带图像和批大小>1（batch_repeat_interleave），以及前缀过短时绕过缓存。
+
+    python -m pytest tests
+"""
+import os
+import sys
+import types
+import importlib
+
+import pytest
+import torch
+
+transformers = pytest.importorskip("transformers")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "alwaysonline_test"
+
+IMAGE_TOKEN_ID = 14
+IMAGE_START_ID = 10
+IMAGE_END_ID = 11
+# 每张图像4×4个patch，2×2合并后为4个视觉token
+IMAGE_GRID = (1, 4, 4)
+MAX_NEW_TOKENS = 8
+
+
+def load_glm_nodes():
+    """在不执行插件__init__的情况下导入glm4v/nodes.py（comfy用空模块代替）"""
+    sys.modules.setdefault("comfy", types.ModuleType("comfy"))
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.glm4v.nodes")
+
+
+@pytest.fixture(scope="module")
+def glm():
+    return load_glm_nodes()
+
+
+@pytest.fixture(scope="module")
+def model():
+    from transformers import Glm4vConfig, Glm4vForConditionalGeneration
+    config = Glm4vConfig(
+        text_config=dict(
+            vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=1024,
+            # head_dim为8，三个维度(t, h, w)的旋转位置编码各占[1, 1, 2]
+            rope_parameters={"rope_type": "default", "rope_theta": 10000.0, "mrope_section": [1, 1, 2]},
+            eos_token_id=0, pad_token_id=0,
+        ),
+        vision_config=dict(
+            depth=1, hidden_size=32, intermediate_size=64, num_heads=2, out_hidden_size=32,
+            patch_size=14, spatial_merge_size=2, temporal_patch_size=2,
+        ),
+        image_token_id=IMAGE_TOKEN_ID, image_start_token_id=IMAGE_START_ID, image_end_token_id=IMAGE_END_ID,
+        video_token_id=15, video_start_token_id=12, video_end_token_id=13,
+    )
+    torch.manual_seed(0)
+    return Glm4vForConditionalGeneration(config).eval()
+
+
+class FakeProcessor:
+    """prefix_past_key_values只用apply_chat_template取前缀对话的token"""
+
+    def __init__(self, prefix_ids):
+        self.prefix_ids = prefix_ids
+
+    def apply_chat_template(self, conversations, **kwargs):
+        return {"input_ids": self.prefix_ids[None]}
+
+
+def random_tokens(generator, length):
+    # 避开0（结束符/pad）和图像相关的特殊token
+    return torch.randint(20, 128, (length,), generator=generator)
+
+
+def text_inputs(prefix, suffixes):
+    input_ids = torch.stack([torch.cat([prefix, suffix]) for suffix in suffixes])
+    return {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        "mm_token_type_ids": torch.zeros_like(input_ids, dtype=torch.int32),
+    }
+
+
+def image_inputs(prefix, suffixes, generator):
+    tokens = IMAGE_GRID[0] * IMAGE_GRID[1] * IMAGE_GRID[2] // 4
+    image = torch.tensor([IMAGE_START_ID] + [IMAGE_TOKEN_ID] * tokens + [IMAGE_END_ID])
+    input_ids = torch.stack([torch.cat([prefix, image, suffix]) for suffix in suffixes])
+    patches = len(suffixes) * IMAGE_GRID[0] * IMAGE_GRID[1] * IMAGE_GRID[2]
+    return {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        "mm_token_type_ids": (input_ids == IMAGE_TOKEN_ID).to(torch.int32),
+        "pixel_values": torch.randn(patches, 3 * 2 * 14 * 14, generator=generator),
+        "image_grid_thw": torch.tensor([IMAGE_GRID] * len(suffixes)),
+    }
+
+
+def greedy(model, inputs, past_key_values=None):
+    # 与generate_answers相同：从缓存继续生成前清掉上一次生成留下的多模态位置偏移
+    model.model.rope_deltas = None
+    with torch.no_grad():
+        return model.generate(**inputs, past_key_values=past_key_values, max_new_tokens=MAX_NEW_TOKENS,
+                              do_sample=False)
+
+
+def generate_with_prefix_cache(glm, model, inputs, prefix, monkeypatch):
+    """换上一个空的PrefixCache，按generate_answers的方式取前缀缓存后生成，返回(输出, 前缀长度, 缓存)"""
+    cache = importlib.import_module(f"{PACKAGE_NAME}.glm4v.prefix_cache").PrefixCache(4)
+    monkeypatch.setattr(glm, "prefix_cache", cache)
+    past_key_values, length = glm.prefix_past_key_values(model, FakeProcessor(prefix), inputs, [{"role": "system"}])
+    return greedy(model, inputs, past_key_values), length, cache
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_text_matches_without_cache(glm, model, monkeypatch, batch_size):
+    generator = torch.Generator().manual_seed(batch_size)
+    prefix = random_tokens(generator, glm.MIN_PREFIX_TOKENS + 8)
+    inputs = text_inputs(prefix, [random_tokens(generator, 6) for _ in range(batch_size)])
+
+    expected = greedy(model, inputs)
+    output, length, cache = generate_with_prefix_cache(glm, model, inputs, prefix, monkeypatch)
+    assert length == len(prefix)
+    assert cache.stats()["misses"] == 1
+    assert torch.equal(output, expected)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_image_matches_without_cache(glm, model, monkeypatch, batch_size):
+    generator = torch.Generator().manual_seed(10 + batch_size)
+    prefix = random_tokens(generator, glm.MIN_PREFIX_TOKENS + 4)
+    inputs = image_inputs(prefix, [random_tokens(generator, 5) for _ in range(batch_size)], generator)
+
+    expected = greedy(model, inputs)
+    output, length, _ = generate_with_prefix_cache(glm, model, inputs, prefix, monkeypatch)
+    assert length == len(prefix)
+    assert torch.equal(output, expected)
+
+
+def test_cache_hit_matches_without_cache(glm, model, monkeypatch):
+    """第二次使用同一前缀时复用缓存的副本，缓存本身不被generate修改"""
+    generator = torch.Generator().manual_seed(20)
+    prefix = random_tokens(generator, glm.MIN_PREFIX_TOKENS)
+    first = text_inputs(prefix, [random_tokens(generator, 4) for _ in range(2)])
+    second = text_inputs(prefix, [random_tokens(generator, 7)])
+
+    _, _, cache = generate_with_prefix_cache(glm, model, first, prefix, monkeypatch)
+    past_key_values, length = glm.prefix_past_key_values(model, FakeProcessor(prefix), second, [{"role": "system"}])
+    assert cache.stats()["hits"] == 1
+    assert torch.equal(greedy(model, second, past_key_values), greedy(model, second))
+
+
+def test_short_prefix_bypasses_cache(glm, model, monkeypatch):
+    generator = torch.Generator().manual_seed(30)
+    prefix = random_tokens(generator, glm.MIN_PREFIX_TOKENS - 1)
+    inputs = text_inputs(prefix, [random_tokens(generator, 6)])
+
+    output, length, cache = generate_with_prefix_cache(glm, model, inputs, prefix, monkeypatch)
+    assert length == 0
+    assert cache.stats() == {"entries": 0, "max_entries": 4, "hits": 0, "misses": 0}
+    assert torch.equal(output, greedy(model, inputs))
@@ -0,0 +1,51 @@
+"""
+GLM-4V 响应缓存键的测试
+
+    python -m pytest tests
+"""
+import os
+import sys
+import types
+import importlib
+
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "alwaysonline_test"
+
+
+def load_response_cache():
+    """在不执行插件__init__的情况下导入glm4v/response_cache.py"""
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.glm4v.response_cache")
+
+
+def key_for(cache, model_path, image):
+    return cache.response_key(image, {"model": "tiny", "model_files": cache.model_signature(str(model_path))})
+
+
+def test_key_changes_when_model_files_change(tmp_path):
+    """同一目录下替换或更新模型后缓存键改变，旧描述不会被返回"""
+    cache = load_response_cache()
+    (tmp_path / "config.json").write_text("{}")
+    (tmp_path / "model.safetensors").write_bytes(b"a" * 16)
+    image = torch.zeros(1, 8, 8, 3)
+    original = key_for(cache, tmp_path, image)
+    assert key_for(cache, tmp_path, image) == original
+
+    # 隐藏文件（如下载工具的.cache目录）不影响缓存键
+    (tmp_path / ".cache").mkdir()
+    (tmp_path / ".cache" / "download.lock").write_text("")
+    assert key_for(cache, tmp_path, image) == original
+
+    # 大小相同、内容不同的权重：修改时间改变
+    os.utime(tmp_path / "model.safetensors", ns=(0, 0))
+    touched = key_for(cache, tmp_path, image)
+    assert touched != original
+
+    (tmp_path / "model.safetensors").write_bytes(b"b" * 32)
+    os.utime(tmp_path / "model.safetensors", ns=(0, 0))
+    assert key_for(cache, tmp_path, image) not in (original, touched)
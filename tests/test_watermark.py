@@ -0,0 +1,140 @@
+"""
+移动水印节点的测试
+
+不需要ComfyUI，直接调用节点方法；字体使用系统中可用的后备字体。
+
+    python -m pytest tests
+"""
+import os
+import sys
+import types
+import importlib
+
+import pytest
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "alwaysonline_test"
+
+WIDTH, HEIGHT = 160, 120
+
+
+def load_nodes():
+    """在不执行插件__init__的情况下导入根目录的nodes.py（comfy用空模块代替）"""
+    sys.modules.setdefault("comfy", types.ModuleType("comfy"))
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.nodes")
+
+
+@pytest.fixture(scope="module")
+def nodes():
+    return load_nodes()
+
+
+def frames(batch_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(batch_size, HEIGHT, WIDTH, 3, generator=generator)
+
+
+def watermark(node, image, **kwargs):
+    params = dict(text="Watermark", font_size=24, font_color="#FFFFFF", opacity=0.8, speed=1.0,
+                  trajectory="对角线", frame_index=0, total_frames=image.shape[0])
+    params.update(kwargs)
+    return node.apply_watermark(image, **params)[0]
+
+
+def test_inplace_keeps_earlier_outputs(nodes):
+    """原地模式不修改上游输入，同一节点实例再次执行（如列表映射）也不覆盖之前返回的结果"""
+    node = nodes.MovingWatermark()
+    first_input, second_input = frames(3, seed=1), frames(3, seed=2)
+    first_copy = first_input.clone()
+
+    first = watermark(node, first_input, memory_mode="原地")
+    first_result = first.clone()
+    second = watermark(node, second_input, memory_mode="原地", text="Other")
+
+    assert first is not second
+    assert torch.equal(first, first_result)
+    assert torch.equal(first_input, first_copy)
+    assert torch.equal(first, watermark(nodes.MovingWatermark(), first_copy))
+
+
+# 逐帧PIL路径把帧转换为uint8后用alpha_composite合成，两条路径只差取整误差（最多几个uint8单位）
+ENGINE_ATOL = 3 / 255
+
+
+@pytest.mark.parametrize("options", [
+    *[{"trajectory": trajectory} for trajectory in ("水平", "垂直", "圆形", "对角线", "随机", "螺旋", "波浪", "弹跳", "心形")],
+    {"trajectory": "波浪", "stroke_width": 3},
+    {"trajectory": "波浪", "dynamic_size": True},
+    {"trajectory": "对角线", "shadow": True, "shadow_offset": 3},
+    {"trajectory": "圆形", "rotation": 30.0},
+    {"trajectory": "随机", "rotation": -15.0, "stroke_width": 2},
+    {"trajectory": "弹跳", "rotation": 90.0},
+    {"trajectory": "螺旋", "dynamic_size": True, "stroke_width": 1, "shadow": True},
+])
+def test_batched_matches_legacy(nodes, options):
+    node = nodes.MovingWatermark()
+    image = frames(12)
+    batched = watermark(node, image, engine="批量合成", **options)
+    legacy = watermark(node, image, engine="逐帧PIL", **options)
+    assert torch.allclose(batched, legacy, rtol=0, atol=ENGINE_ATOL)
+
+
+def test_batched_blur_matches_legacy(nodes):
+    """逐帧PIL对整帧图层做模糊，画面边缘按边缘像素延伸，只比较离边缘超过模糊范围的区域"""
+    node = nodes.MovingWatermark()
+    image = frames(12)
+    batched = watermark(node, image, engine="批量合成", trajectory="波浪", blur_radius=2.0)
+    legacy = watermark(node, image, engine="逐帧PIL", trajectory="波浪", blur_radius=2.0)
+    margin = 8
+    inner = (slice(None), slice(margin, -margin), slice(margin, -margin))
+    assert torch.allclose(batched[inner], legacy[inner], rtol=0, atol=ENGINE_ATOL)
+
+
+@pytest.mark.parametrize("watermark_mode", ["移动", "平铺"])
+@pytest.mark.parametrize("memory_mode", ["标准", "分块", "原地"])
+@pytest.mark.parametrize("parallel_mode", ["串行", "线程池", "进程池"])
+def test_parallel_and_memory_modes_bit_identical(nodes, capsys, parallel_mode, memory_mode, watermark_mode):
+    """各帧互不依赖，并行方式和内存模式只影响执行方式，结果与串行、标准模式逐位一致"""
+    image = frames(12)
+    options = dict(trajectory="随机", rotation=20.0, stroke_width=2, dynamic_size=True,
+                   watermark_mode=watermark_mode, tile_scroll_x=1.5)
+    expected = watermark(nodes.MovingWatermark(), image, **options)
+    # memory_limit_mb=1时每块4帧，分块和并行都会拆成多块
+    result = watermark(nodes.MovingWatermark(), image.clone(), memory_mode=memory_mode, memory_limit_mb=1,
+                       parallel_mode=parallel_mode, workers=3, **options)
+    assert "进程池不可用" not in capsys.readouterr().out
+    assert torch.equal(result, expected)
+
+
+@pytest.mark.parametrize("profile", [False, True])
+def test_peak_rss_reset_only_when_profiling(nodes, monkeypatch, profile):
+    """重置峰值内存统计作用于整个ComfyUI进程，只有开启剖析时才重置"""
+    memory = importlib.import_module(f"{PACKAGE_NAME}.watermark.memory")
+    resets = []
+    monkeypatch.setattr(memory, "reset_peak_rss", lambda: resets.append(True) or True)
+    watermark(nodes.MovingWatermark(), frames(2), profile=profile)
+    assert len(resets) == int(profile)
+
+
+
+def test_stream_small_memory_limit_stays_chunked(nodes, tmp_path, monkeypatch):
+    """流式节点读写两块重叠，上限放不下两帧时仍逐帧处理，不会变成一次读入全部帧"""
+    np = pytest.importorskip("numpy")
+    frame_store = importlib.import_module(f"{PACKAGE_NAME}.watermark.frame_store")
+    source_path = tmp_path / "frames.npy"
+    # 640x480的uint8帧约0.9MB，每帧按两份计超过1MB上限
+    np.save(source_path, np.zeros((3, 480, 640, 3), dtype=np.uint8))
+
+    reads = []
+    read = frame_store.FrameSource.read
+    monkeypatch.setattr(frame_store.FrameSource, "read",
+                        lambda self, start, end: reads.append(end - start) or read(self, start, end))
+    nodes.StreamingMovingWatermark().stream_watermark(
+        str(source_path), str(tmp_path / "out.npy"), "Watermark", 24, "#FFFFFF", 0.8, 1.0, "对角线", 0, 0,
+        memory_limit_mb=1)
+    assert reads == [1, 1, 1]
@@ -0,0 +1,363 @@
+"""
+批量水印合成引擎
+
+水印文字先渲染成一次性的RGBA贴图（含阴影/描边/模糊），
+再按每帧的偏移量和透明度直接混合进[B,H,W,C]图像张量，
+不再为每一帧创建整帧PIL图像。
+"""
+import math
+import hashlib
+import functools
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFilter
+from ..profiling import profile_stage
+
+# 子像素定位的量化步数：PIL把坐标的小数部分按FreeType的26.6定点数（1/64像素）四舍五入后交给字形栅格化，
+# 相位按同样的精度量化，贴图与逐帧路径画出的文字逐像素一致
+SUBPIXEL_STEPS = 64
+
+
+class WatermarkSprite:
+    """预渲染的水印贴图
+
+    rgba:      np.uint8数组 [h, w, 4]
+    offset:    贴图左上角相对文字绘制原点的偏移 (dx, dy)
+    text_size: 文字本身的宽高，用于轨迹计算
+    """
+
+    def __init__(self, rgba, offset, text_size):
+        self.rgba = rgba
+        self.offset = offset
+        self.text_size = text_size
+        self._tensors = {}
+
+    @property
+    def width(self):
+        return self.rgba.shape[1]
+
+    @property
+    def height(self):
+        return self.rgba.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.rgba.nbytes
+
+    def tensors(self, device, dtype):
+        """返回(颜色, alpha)张量，按设备和精度缓存"""
+        key = (str(device), dtype)
+        if key not in self._tensors:
+            rgba = torch.from_numpy(self.rgba).to(device=device, dtype=dtype) / 255.0
+            self._tensors[key] = (rgba[..., :3].contiguous(), rgba[..., 3:4].contiguous())
+        return self._tensors[key]
+
+    def blend_tensors(self, device, dtype):
+        """返回(预乘颜色, 1 - alpha)张量，均为[h, w, 3]，按设备和精度缓存
+
+        混合时只需一次融合的 c + img * (1 - a)；alpha展开成3通道，避免最后一维广播拖慢逐元素运算
+        """
+        key = ("blend", str(device), dtype)
+        if key not in self._tensors:
+            # 两个3通道张量
+            nbytes = self.width * self.height * 6 * (torch.finfo(dtype).bits // 8)
+            with profile_stage("tensor_convert", nbytes):
+                rgba = torch.from_numpy(self.rgba).to(device=device, dtype=dtype) / 255.0
+                color, alpha = rgba[..., :3], rgba[..., 3:4]
+                self._tensors[key] = ((color * alpha).contiguous(), (1.0 - alpha).expand_as(color).contiguous())
+        return self._tensors[key]
+
+
+def split_position(value):
+    """把浮点坐标拆成整数像素和量化后的子像素相位（与PIL相同，半数向上取整）"""
+    base = math.floor(value)
+    phase = math.floor((value - base) * SUBPIXEL_STEPS + 0.5)
+    if phase >= SUBPIXEL_STEPS:
+        base += 1
+        phase = 0
+    return int(base), phase / SUBPIXEL_STEPS
+
+
+@functools.lru_cache(maxsize=4096)
+def glyph_signature(text, font, phase):
+    """文字在子像素相位phase处栅格化结果的摘要
+
+    栅格化时字形按整像素对齐，64×64个相位通常只画出十几种不同的字形，
+    贴图缓存按摘要去重，画出相同字形的相位共用一张贴图；非FreeType的默认位图字体直接按相位区分
+    """
+    if not hasattr(font, "getmask2"):
+        return phase
+    digest = hashlib.blake2b(digest_size=16)
+    for line in text.split("\n"):
+        mask, offset = font.getmask2(line, "L", start=phase)
+        digest.update(repr((offset, mask.size)).encode())
+        digest.update(bytes(mask))
+    return digest.digest()
+
+
+def measure_text(text, font, font_size):
+    """计算文字边界框，返回(bbox, 宽, 高)"""
+    try:
+        draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        bbox = draw.textbbox((0, 0), text, font=font)
+        return bbox, bbox[2] - bbox[0], bbox[3] - bbox[1]
+    except:
+        # 回退估算
+        text_width = len(text) * font_size * 0.6
+        text_height = font_size
+        return (0, 0, int(text_width), int(text_height)), text_width, text_height
+
+
+def stroke_coverage(mask, radius):
+    """计算描边蒙版，等价于把文字蒙版向各方向平移radius像素后依次叠加绘制
+
+    叠加绘制的覆盖率为 1 - Π(1 - m)，在对数域里就是可分离的方框求和，
+    所以整个描边只需要绘制一次文字蒙版。
+    """
+    size = 2 * radius + 1
+    # 完全覆盖的像素取一个接近1的值，避免log(0)
+    log_rest = np.log1p(-np.minimum(mask.astype(np.float32) / 255.0, 254.5 / 255.0))
+
+    padded = np.pad(log_rest, ((0, 0), (radius, radius)))
+    total = np.lib.stride_tricks.sliding_window_view(padded, size, axis=1).sum(axis=-1)
+    padded = np.pad(total, ((radius, radius), (0, 0)))
+    total = np.lib.stride_tricks.sliding_window_view(padded, size, axis=0).sum(axis=-1)
+
+    # 原实现不绘制(0, 0)偏移，这里扣除中心像素自身
+    coverage = 1.0 - np.exp(total - log_rest)
+    return np.clip(np.rint(coverage * 255.0), 0, 255).astype(np.uint8)
+
+
+def render_text_sprite(text, font, font_size, fill, stroke_width=0, stroke_fill=None,
+                       shadow=False, shadow_fill=None, shadow_offset=0, blur_radius=0.0,
+                       phase=(0.0, 0.0)):
+    """把文字及其阴影、描边、模糊效果渲染到一张紧凑的RGBA贴图上
+
+    绘制顺序与逐帧路径一致：阴影 → 描边 → 主文字 → 模糊
+    phase为文字绘制原点的子像素偏移
+    """
+    bbox, text_width, text_height = measure_text(text, font, font_size)
+
+    # 贴图需要容纳描边、阴影偏移和模糊扩散的范围
+    blur_pad = int(math.ceil(blur_radius * 3)) + 1 if blur_radius > 0 else 0
+    extra = max(stroke_width, shadow_offset if shadow else 0)
+    # 绘制原点不能落在贴图外：PIL对负坐标按截断拆出负的小数部分，取整结果与逐帧路径的正坐标不同
+    left = min(0, int(math.floor(bbox[0])) - stroke_width - blur_pad - 1)
+    top = min(0, int(math.floor(bbox[1])) - stroke_width - blur_pad - 1)
+    right = int(math.ceil(bbox[2])) + extra + blur_pad + 1
+    bottom = int(math.ceil(bbox[3])) + extra + blur_pad + 1
+
+    canvas = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(canvas)
+    x, y = -left + phase[0], -top + phase[1]
+
+    sprite_bytes = canvas.size[0] * canvas.size[1] * 4
+
+    # 绘制阴影
+    if shadow:
+        with profile_stage("text_draw"):
+            draw.text((x + shadow_offset, y + shadow_offset), text, font=font, fill=shadow_fill)
+
+    # 绘制描边：文字蒙版只绘制一次，
+    # 代替逐个偏移重复绘制的(2*stroke_width+1)^2次draw.text
+    if stroke_width > 0:
+        with profile_stage("stroke", sprite_bytes // 4 * 9):
+            mask = Image.new("L", canvas.size, 0)
+            ImageDraw.Draw(mask).text((x, y), text, font=font, fill=255)
+            mask = Image.fromarray(stroke_coverage(np.array(mask), stroke_width))
+            canvas.paste(tuple(stroke_fill), (0, 0), mask)
+
+    # 绘制主文字
+    with profile_stage("text_draw", sprite_bytes):
+        draw.text((x, y), text, font=font, fill=fill)
+
+    # 应用模糊效果
+    if blur_radius > 0:
+        with profile_stage("blur", sprite_bytes):
+            canvas = canvas.filter(ImageFilter.GaussianBlur(blur_radius))
+
+    return WatermarkSprite(np.array(canvas), (left, top), (text_width, text_height))
+
+
+def rotate_sprite(sprite, angle):
+    """只在贴图范围内旋转（expand=True，双三次插值）"""
+    with profile_stage("rotate"):
+        rotated = np.array(Image.fromarray(sprite.rgba).rotate(angle, expand=True, resample=Image.BICUBIC))
+    return WatermarkSprite(rotated, sprite.offset, sprite.text_size)
+
+
+def rotation_matrix(width, height, angle):
+    """按PIL Image.rotate(expand=True)的算法计算整帧旋转的逆仿射矩阵（旋转画布坐标 → 原画面坐标）和旋转后画布的大小"""
+    rad = -math.radians(angle % 360.0)
+    a, b = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    d, e = round(-math.sin(rad), 15), round(math.cos(rad), 15)
+    cx, cy = width / 2, height / 2
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+    xs, ys = [], []
+    for px, py in ((0, 0), (width, 0), (width, height), (0, height)):
+        xs.append(a * px + b * py + c)
+        ys.append(d * px + e * py + f)
+    rotated_width = math.ceil(max(xs)) - math.floor(min(xs))
+    rotated_height = math.ceil(max(ys)) - math.floor(min(ys))
+    shift_x, shift_y = -(rotated_width - width) / 2.0, -(rotated_height - height) / 2.0
+    c, f = a * shift_x + b * shift_y + c, d * shift_x + e * shift_y + f
+    return (a, b, c, d, e, f), rotated_width, rotated_height
+
+
+# 双三次插值在采样点两侧各取2个像素，旋转前给贴图补足透明边，边缘的采样与整帧图层相同
+ROTATE_PAD = 2
+
+
+def rotate_in_frame(sprite, x, y, angle, width, height):
+    """按原实现的整帧旋转只重采样贴图覆盖的区域，返回(旋转后的贴图, 左上角x, 左上角y)，完全落在画面外时返回None
+
+    原实现把文字画在整帧大小的图层上，绕画面中心旋转（expand=True，双三次插值），
+    再按文字中心用int()取整粘贴回画面。这里用同一个仿射矩阵只对贴图所在的区域采样，
+    采样位置与整帧旋转完全相同，结果逐像素一致。x, y为文字绘制原点。
+    """
+    text_width, text_height = sprite.text_size
+    (a, b, c, d, e, f), rotated_width, rotated_height = rotation_matrix(width, height, angle)
+    # 旋转画布粘贴回画面的位置
+    paste_x = int(x + text_width / 2 - rotated_width / 2)
+    paste_y = int(y + text_height / 2 - rotated_height / 2)
+
+    # 补边后的贴图在整帧图层中的位置（与render_text_sprite的整数部分一致），
+    # 超出画面的部分裁掉：整帧图层在画面边缘截止，PIL在图层边缘的采样按边缘像素延伸
+    sprite_left = split_position(x)[0] + sprite.offset[0] - ROTATE_PAD
+    sprite_top = split_position(y)[0] + sprite.offset[1] - ROTATE_PAD
+    left, top = max(sprite_left, 0), max(sprite_top, 0)
+    right = min(sprite_left + sprite.width + 2 * ROTATE_PAD, width)
+    bottom = min(sprite_top + sprite.height + 2 * ROTATE_PAD, height)
+    if left >= right or top >= bottom:
+        return None
+
+    # 贴图四角在旋转画布中的位置（矩阵正交，逆变换即转置），取外接矩形并裁剪到旋转画布和画面范围内
+    us, vs = [], []
+    for px, py in ((left, top), (right, top), (right, bottom), (left, bottom)):
+        us.append(a * (px - c) + d * (py - f))
+        vs.append(b * (px - c) + e * (py - f))
+    u0 = max(math.floor(min(us)) - 1, 0, -paste_x)
+    v0 = max(math.floor(min(vs)) - 1, 0, -paste_y)
+    u1 = min(math.ceil(max(us)) + 1, rotated_width, width - paste_x)
+    v1 = min(math.ceil(max(vs)) + 1, rotated_height, height - paste_y)
+    if u0 >= u1 or v0 >= v1:
+        return None
+
+    with profile_stage("rotate"):
+        padded = np.pad(sprite.rgba, ((ROTATE_PAD, ROTATE_PAD), (ROTATE_PAD, ROTATE_PAD), (0, 0)))
+        padded = np.ascontiguousarray(padded[top - sprite_top:bottom - sprite_top, left - sprite_left:right - sprite_left])
+        data = (a, b, a * u0 + b * v0 + c - left, d, e, d * u0 + e * v0 + f - top)
+        rotated = np.array(Image.fromarray(padded).transform((u1 - u0, v1 - v0), Image.AFFINE, data,
+                                                             resample=Image.BICUBIC))
+    return WatermarkSprite(rotated, sprite.offset, sprite.text_size), paste_x + u0, paste_y + v0
+
+
+def work_dtype(images):
+    """混合运算使用的精度：浮点图像保持原精度，uint8图像在float32中运算"""
+    return images.dtype if images.dtype.is_floating_point else torch.float32
+
+
+def blend_into(roi, premultiplied, inverse):
+    """roi = premultiplied + roi * inverse（原地）
+
+    uint8图像只把roi这一块转换成float32运算后再取整写回，
+    结果与整帧先转float32、混合、再转回uint8完全一致，但不需要整帧转换。
+    """
+    if roi.dtype.is_floating_point:
+        torch.addcmul(premultiplied, roi, inverse, out=roi)
+        return
+    work = roi.to(torch.float32).div_(255.0)
+    torch.addcmul(premultiplied, work, inverse, out=work)
+    roi.copy_(work.mul_(255.0).round_().clamp_(0, 255))
+
+
+def composite_sprites(images, placements):
+    """把贴图批量混合进图像张量（原地修改）
+
+    images:     [B, H, W, C] 张量，float或uint8
+    placements: [(帧索引, 贴图, 贴图左上角x, 贴图左上角y, 透明度系数), ...]，按绘制顺序排列
+
+    连续帧如果使用同一贴图、同一位置和透明度，会合并成一次跨帧的向量化混合。
+    """
+    height, width = images.shape[1], images.shape[2]
+
+    runs = []
+    for frame, sprite, px, py, alpha in placements:
+        if runs:
+            last = runs[-1]
+            if last[1] == frame and last[2] is sprite and last[3] == px and last[4] == py and last[5] == alpha:
+                last[1] = frame + 1
+                continue
+        runs.append([frame, frame + 1, sprite, px, py, alpha])
+
+    for start, end, sprite, px, py, alpha in runs:
+        # 裁剪到画面范围内的区域
+        x0, y0 = max(px, 0), max(py, 0)
+        x1, y1 = min(px + sprite.width, width), min(py + sprite.height, height)
+        if x0 >= x1 or y0 >= y1 or alpha <= 0:
+            continue
+
+        premultiplied, inverse = sprite.blend_tensors(images.device, work_dtype(images))
+        premultiplied = premultiplied[y0 - py:y1 - py, x0 - px:x1 - px]
+        inverse = inverse[y0 - py:y1 - py, x0 - px:x1 - px]
+        if alpha != 1.0:
+            premultiplied = premultiplied * alpha
+            inverse = 1.0 - (1.0 - inverse) * alpha
+
+        roi = images[start:end, y0:y1, x0:x1, :3]
+        with profile_stage("composite", roi.numel() * roi.element_size()):
+            blend_into(roi, premultiplied, inverse)
+
+    return images
+
+
+def build_tile(sprite, spacing_x, spacing_y, stagger=True):
+    """把贴图排进一个可无缝重复的平铺单元
+
+    单元宽高为贴图大小加间距，贴图位于单元中央；stagger为True时第二行错开半个单元（砖块排列），
+    单元高度为两行。各贴图的边界框互不重叠，所以直接拷贝像素即可。
+    """
+    cell_width = sprite.width + spacing_x
+    cell_height = sprite.height + spacing_y
+    cell = np.zeros((cell_height, cell_width, 4), dtype=np.uint8)
+    left, top = spacing_x // 2, spacing_y // 2
+    cell[top:top + sprite.height, left:left + sprite.width] = sprite.rgba
+    if stagger:
+        cell = np.concatenate([cell, np.roll(cell, cell_width // 2, axis=1)], axis=0)
+    return WatermarkSprite(cell, (0, 0), sprite.text_size)
+
+
+def composite_tiled(images, tile, offsets):
+    """把平铺单元铺满每一帧并混合（原地修改）
+
+    offsets: 每帧平铺图案的整数偏移 [(ox, oy), ...]，用于滚动效果
+    先把单元重复成比画面大一个单元的图层，每帧只取其中一个视图做一次向量化混合，
+    耗时与单元数量无关；偏移相同的连续帧合并成一次跨帧混合。
+    """
+    height, width = images.shape[1], images.shape[2]
+    premultiplied, inverse = tile.blend_tensors(images.device, work_dtype(images))
+    reps_y = -(-height // tile.height) + 1
+    reps_x = -(-width // tile.width) + 1
+    premultiplied = premultiplied.repeat(reps_y, reps_x, 1)
+    inverse = inverse.repeat(reps_y, reps_x, 1)
+
+    start = 0
+    for i in range(1, len(offsets) + 1):
+        if i < len(offsets) and offsets[i] == offsets[start]:
+            continue
+        ox, oy = offsets[start]
+        # 图案向右下移动(ox, oy)，等价于从图层的(-ox, -oy)处取视图
+        x0, y0 = -ox % tile.width, -oy % tile.height
+        premultiplied_view = premultiplied[y0:y0 + height, x0:x0 + width]
+        inverse_view = inverse[y0:y0 + height, x0:x0 + width]
+        roi = images[start:i, :, :, :3]
+        with profile_stage("composite", roi.numel() * roi.element_size()):
+            if images.dtype.is_floating_point:
+                blend_into(roi, premultiplied_view, inverse_view)
+            else:
+                # uint8逐帧转换，临时float32缓冲只有一帧大小
+                for frame in range(start, i):
+                    blend_into(images[frame, :, :, :3], premultiplied_view, inverse_view)
+        start = i
+    return images
@@ -0,0 +1,239 @@
+"""
+进程级字体索引与字体缓存
+
+启动时在后台扫描一次系统和用户字体目录，建立 文件名/名称 → 字体路径 的索引
+（可选写入磁盘，目录未变化时直接复用），之后按名称查找字体不再逐个尝试加载。
+FreeTypeFont对象按(路径, 字号)缓存，所有MovingWatermark实例共享，超出数量上限时按LRU淘汰。
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+from ..profiling import profile_stage
+
+# 未指定字体或指定的字体不可用时依次尝试的系统字体
+FALLBACK_FONTS = ["Arial", "Helvetica", "DejaVuSans", "FreeSans"]
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc", ".pfb", ".pfa")
+
+DEFAULT_CACHE_SIZE = int(os.environ.get("ALWAYSONLINE_FONT_CACHE_SIZE", "256"))
+DEFAULT_INDEX_FILE = os.environ.get("ALWAYSONLINE_FONT_INDEX_FILE", "")
+
+
+def font_directories():
+    """字体搜索目录，顺序与PIL的ImageFont.truetype一致，另外加入用户级字体目录"""
+    dirs = []
+    if sys.platform == "win32":
+        windir = os.environ.get("WINDIR")
+        if windir:
+            dirs.append(os.path.join(windir, "fonts"))
+        local_appdata = os.environ.get("LOCALAPPDATA")
+        if local_appdata:
+            dirs.append(os.path.join(local_appdata, "Microsoft", "Windows", "Fonts"))
+    elif sys.platform == "darwin":
+        dirs += ["/Library/Fonts", "/System/Library/Fonts", os.path.expanduser("~/Library/Fonts")]
+    else:
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+        data_dirs = os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share"
+        dirs += [os.path.join(d, "fonts") for d in [data_home] + data_dirs.split(":")]
+        dirs.append(os.path.expanduser("~/.fonts"))
+    return dirs
+
+
+class FontIndex:
+    """字体文件索引：完整文件名和不带扩展名的名称都能查到路径（线程安全）
+
+    同名字体按目录扫描顺序取第一个，不带扩展名时优先.ttf，与PIL按名称查找的结果一致。
+    """
+
+    def __init__(self, directories, index_file=""):
+        self.directories = directories
+        self.index_file = index_file
+        self.build_seconds = 0.0
+        self._files = {}
+        self._names = {}
+        self._lowered = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def _directory_mtimes(self):
+        mtimes = {}
+        for directory in self.directories:
+            for root, _, _ in os.walk(directory):
+                try:
+                    mtimes[root] = os.stat(root).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def _scan(self):
+        files, names = {}, {}
+        for directory in self.directories:
+            for root, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    stem, ext = os.path.splitext(filename)
+                    if ext.lower() not in FONT_EXTENSIONS:
+                        continue
+                    path = os.path.join(root, filename)
+                    files.setdefault(filename, path)
+                    # 同名时.ttf优先，其余扩展名取第一个
+                    if stem not in names or (ext == ".ttf" and not names[stem].endswith(".ttf")):
+                        names[stem] = path
+        return files, names
+
+    def _load(self, mtimes):
+        if not self.index_file or not os.path.exists(self.index_file):
+            return None
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("directories") != self.directories or data.get("mtimes") != mtimes:
+                return None
+            return data["files"], data["names"]
+        except Exception as e:
+            print(f"[MovingWatermark] 读取字体索引失败: {e}")
+            return None
+
+    def _save(self, mtimes, files, names):
+        if not self.index_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+            temp_path = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"directories": self.directories, "mtimes": mtimes,
+                           "files": files, "names": names}, f, ensure_ascii=False)
+            os.replace(temp_path, self.index_file)
+        except Exception as e:
+            print(f"[MovingWatermark] 写入字体索引失败: {e}")
+
+    def build(self):
+        """扫描字体目录（磁盘索引有效时直接读取），只执行一次"""
+        with self._lock:
+            if self._ready.is_set():
+                return
+            start = time.perf_counter()
+            # 索引文件只在目录结构未变化时复用，因此仍需要遍历目录取修改时间
+            mtimes = self._directory_mtimes() if self.index_file else {}
+            loaded = self._load(mtimes)
+            if loaded is None:
+                files, names = self._scan()
+                self._save(mtimes, files, names)
+            else:
+                files, names = loaded
+            self._files, self._names = files, names
+            self._lowered = {}
+            for name, path in list(names.items()) + list(files.items()):
+                self._lowered.setdefault(name.lower(), path)
+            self.build_seconds = time.perf_counter() - start
+            self._ready.set()
+            print(f"[MovingWatermark] 字体索引: {len(files)}个字体文件, 用时{self.build_seconds * 1000:.1f}ms"
+                  f"{'(磁盘索引)' if loaded is not None else ''}")
+
+    def build_in_background(self):
+        threading.Thread(target=self.build, name="font-index", daemon=True).start()
+
+    def resolve(self, name):
+        """按文件名或名称查找字体路径，先精确匹配再忽略大小写，找不到返回None"""
+        if not name:
+            return None
+        if os.path.isfile(name):
+            return name
+        if not self._ready.is_set():
+            self.build()
+        basename = os.path.basename(name)
+        stem, ext = os.path.splitext(basename)
+        exact = self._files.get(basename) if ext else self._names.get(basename)
+        return exact or self._lowered.get(basename.lower())
+
+    def __len__(self):
+        return len(self._files)
+
+
+class FontCache:
+    """按(字体路径, 字号)缓存FreeTypeFont对象的LRU缓存（线程安全）"""
+
+    def __init__(self, index, max_entries):
+        self.index = index
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, font_path):
+        """字体路径/名称 → 实际文件路径，None表示使用PIL默认字体；结果按名称缓存"""
+        if font_path in self._resolved:
+            return self._resolved[font_path]
+        path = self.index.resolve(font_path) if font_path else None
+        if path is None:
+            for name in FALLBACK_FONTS:
+                path = self.index.resolve(name)
+                if path is not None:
+                    break
+        self._resolved[font_path] = path
+        return path
+
+    def get(self, font_path, font_size):
+        """获取字体对象：指定的路径/名称 → 常见系统字体 → PIL默认字体"""
+        with self._lock:
+            path = self._resolve(font_path)
+            key = (path, font_size)
+            font = self._entries.get(key)
+            if font is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        with profile_stage("font_load"):
+            font = load_font(path, font_size)
+
+        with self._lock:
+            font = self._entries.setdefault(key, font)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return font
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._resolved.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "indexed_fonts": len(self.index),
+                "index_ms": round(self.index.build_seconds * 1000, 2),
+            }
+
+
+def load_font(path, font_size):
+    """加载字体文件，失败时回退到PIL默认字体"""
+    if path is not None:
+        try:
+            return ImageFont.truetype(path, font_size)
+        except Exception as e:
+            print(f"字体加载错误: {e}")
+    try:
+        # Pillow 10.1+ 的默认字体支持指定字号
+        return ImageFont.load_default(font_size)
+    except TypeError:
+        font = ImageFont.load_default()
+        font.size = font_size
+        return font
+
+
+font_index = FontIndex(font_directories(), DEFAULT_INDEX_FILE)
+font_cache = FontCache(font_index, DEFAULT_CACHE_SIZE)
+
+# 插件加载时在后台建立索引，第一次执行节点时通常已经完成
+font_index.build_in_background()
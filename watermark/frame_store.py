@@ -0,0 +1,124 @@
+"""
+磁盘帧存储
+
+按需从内存映射的.npy/原始uint8文件或图片序列目录读取帧，处理结果写回内存映射的输出文件，
+处理完的范围会通知系统释放对应的页面，长视频的常驻内存只与每块的帧数有关。
+"""
+import os
+import mmap
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def release_pages(array, start, end):
+    """通知系统释放内存映射数组[start, end)帧对应的页面（尽力而为，不支持时忽略）
+
+    只读映射的页面随时可以从文件重新读取；输出映射在flush之后已写回文件，释放也不会丢数据。
+    """
+    mapped = getattr(array, "_mmap", None)
+    if mapped is None or not hasattr(mapped, "madvise") or not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    frame_bytes = array[0].nbytes
+    # np.memmap按分配粒度对齐映射起点，数组数据在映射中的偏移为offset % 粒度
+    base = array.offset % mmap.ALLOCATIONGRANULARITY
+    first = (base + start * frame_bytes) // mmap.PAGESIZE * mmap.PAGESIZE
+    last = min(base + end * frame_bytes, len(mapped))
+    if last > first:
+        try:
+            mapped.madvise(mmap.MADV_DONTNEED, first, last - first)
+        except (OSError, ValueError):
+            pass
+
+
+class FrameSource:
+    """帧来源：frames、height、width、dtype，read(start, end)返回[n, H, W, 3]的数组副本"""
+
+    def __init__(self, path, width=0, height=0):
+        self.path = path
+        self.files = None
+        self.array = None
+        if os.path.isdir(path):
+            self.files = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self.files:
+                raise ValueError(f"目录中没有图片: {path}")
+            with Image.open(self.files[0]) as first:
+                self.width, self.height = first.size
+            self.frames = len(self.files)
+            self.dtype = np.dtype(np.uint8)
+        elif path.lower().endswith(".npy"):
+            self.array = np.load(path, mmap_mode="r")
+            if self.array.ndim == 3:
+                self.array = self.array[..., None]
+            if self.array.ndim != 4 or self.array.shape[-1] not in (1, 3, 4):
+                raise ValueError(f"npy文件的形状应为[帧数, 高, 宽, 通道]: {self.array.shape}")
+            self.frames, self.height, self.width = self.array.shape[:3]
+            self.dtype = self.array.dtype
+        else:
+            # 原始RGB24文件（如ffmpeg -pix_fmt rgb24 -f rawvideo的输出），需要指定宽高
+            if width <= 0 or height <= 0:
+                raise ValueError("读取原始帧文件需要指定width和height")
+            frame_bytes = width * height * 3
+            frames = os.path.getsize(path) // frame_bytes
+            if frames == 0:
+                raise ValueError(f"文件小于一帧: {path}")
+            self.array = np.memmap(path, dtype=np.uint8, mode="r", shape=(frames, height, width, 3))
+            self.frames, self.height, self.width = frames, height, width
+            self.dtype = self.array.dtype
+
+    def read(self, start, end):
+        if self.files is not None:
+            frames = np.empty((end - start, self.height, self.width, 3), dtype=np.uint8)
+            for i, file in enumerate(self.files[start:end]):
+                with Image.open(file) as img:
+                    img = img.convert("RGB")
+                    if img.size != (self.width, self.height):
+                        img = img.resize((self.width, self.height), Image.BICUBIC)
+                    frames[i] = np.asarray(img)
+            return frames
+        frames = self.array[start:end]
+        if frames.shape[-1] == 1:
+            frames = np.repeat(frames, 3, axis=-1)
+        frames = np.array(frames[..., :3])
+        release_pages(self.array, start, end)
+        return frames
+
+
+class FrameSink:
+    """帧输出：.npy（与输入相同的数据类型）、原始RGB24文件或图片序列目录"""
+
+    def __init__(self, path, frames, height, width, dtype):
+        self.path = path
+        self.array = None
+        self.directory = None
+        lower = path.lower()
+        if lower.endswith(".npy"):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(frames, height, width, 3))
+        elif lower.endswith((".raw", ".rgb")):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.array = np.memmap(path, dtype=np.uint8, mode="w+", shape=(frames, height, width, 3))
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.directory = path
+        self.dtype = self.array.dtype if self.array is not None else np.dtype(np.uint8)
+
+    def write(self, start, frames):
+        end = start + len(frames)
+        if self.directory is not None:
+            for i, frame in enumerate(frames):
+                Image.fromarray(frame).save(os.path.join(self.directory, f"{start + i:06d}.png"), compress_level=1)
+            return
+        self.array[start:end] = frames
+        self.array.flush()
+        release_pages(self.array, start, end)
+
+    def close(self):
+        if self.array is not None:
+            self.array.flush()
+            # 释放映射引用，文件随后可以被其他程序读取或删除
+            self.array = None
@@ -0,0 +1,174 @@
+"""
+频域隐形水印
+
+把一段短消息嵌入每帧亮度通道的二维傅里叶频谱：频谱中频环带里按密钥随机选出的系数被分配给各个比特，
+每个系数的幅度乘以exp(±strength)（符号由比特值和系数自身的伪随机符号决定），相位不变。
+中频既不像低频那样影响观感，也不像高频那样会被JPEG量化掉。
+
+检测不需要原图：对数幅度去掉径向趋势后与伪随机符号做相关，得到每个比特的z分数，
+整段视频的z分数按帧累加，帧数越多越可靠。整批帧一次完成FFT（按内存上限分块），环带只占水平频率的前1/8，
+沿高度方向的FFT只对这些列计算。不能抵抗缩放和裁剪（系数位置随分辨率变化）。
+"""
+import zlib
+import functools
+import numpy as np
+import torch
+from ..profiling import profile_stage
+
+# 消息容量（UTF-8字节），另加8位校验
+PAYLOAD_BYTES = 8
+PAYLOAD_BITS = PAYLOAD_BYTES * 8 + 8
+# 嵌入使用的频率环带，单位为奈奎斯特频率的比例
+BAND_LOW = 0.04
+BAND_HIGH = 0.25
+# 去除对数幅度径向趋势时的分箱数
+RADIAL_BINS = 32
+# 判定存在水印的最低平均|z|：无水印图像约为0.8±0.07，单帧有水印的图像在2以上
+DETECT_THRESHOLD = 1.5
+# 亮度权重（ITU-R BT.601），三个通道加同样的增量时亮度正好变化该增量
+LUMA = (0.299, 0.587, 0.114)
+
+
+def encode_payload(message):
+    """消息 → PAYLOAD_BITS个比特（超出容量的部分按完整字符截断，不足补0），末尾8位为CRC32的低8位"""
+    data = message.encode("utf-8")[:PAYLOAD_BYTES]
+    # 截断不能落在多字节字符中间
+    while data:
+        try:
+            data.decode("utf-8")
+            break
+        except UnicodeDecodeError:
+            data = data[:-1]
+    data = data.ljust(PAYLOAD_BYTES, b"\0")
+    data += bytes([zlib.crc32(data) & 0xFF])
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def decode_payload(bits):
+    """比特 → (消息, 校验是否通过)"""
+    data = np.packbits(np.asarray(bits, dtype=np.uint8)).tobytes()
+    payload, checksum = data[:PAYLOAD_BYTES], data[PAYLOAD_BYTES]
+    valid = zlib.crc32(payload) & 0xFF == checksum
+    return payload.rstrip(b"\0").decode("utf-8", errors="replace"), valid
+
+
+def band_columns(width):
+    """环带涉及的水平频率列数（rfft输出的前若干列）"""
+    return min(width // 2 + 1, int(np.ceil(BAND_HIGH * width / 2)) + 1)
+
+
+@functools.lru_cache(maxsize=16)
+def _pattern(height, width, key):
+    """按(分辨率, 密钥)生成嵌入位置：环带内系数在[H, band_columns]频谱中的展平索引、伪随机符号、所属比特和径向分箱"""
+    fy = np.fft.fftfreq(height) * 2
+    fx = np.fft.rfftfreq(width)[:band_columns(width)] * 2
+    radius = np.sqrt(fy[:, None] ** 2 + fx[None, :] ** 2)
+    band = (radius >= BAND_LOW) & (radius < BAND_HIGH)
+    # 第0列与自身共轭对称，修改后逆变换的结果不一致，不使用（奈奎斯特列不在环带内）
+    band[:, 0] = False
+    index = np.flatnonzero(band)
+    if len(index) < PAYLOAD_BITS * 16:
+        raise ValueError(f"图像太小，无法嵌入隐形水印: {width}x{height}")
+    rng = np.random.default_rng(key)
+    index = rng.permutation(index)
+    # 每个比特分到数量相同的系数，符号正负各半
+    per_bit = len(index) // PAYLOAD_BITS
+    index = index[:per_bit * PAYLOAD_BITS]
+    bit = np.repeat(np.arange(PAYLOAD_BITS), per_bit)
+    sign = np.where(rng.permutation(len(index)) % 2 == 0, 1.0, -1.0).astype(np.float32)
+    position = radius.ravel()[index]
+    radial_bin = np.minimum(((position - BAND_LOW) / (BAND_HIGH - BAND_LOW) * RADIAL_BINS).astype(np.int64),
+                            RADIAL_BINS - 1)
+    return index, sign, bit, radial_bin
+
+
+@functools.lru_cache(maxsize=16)
+def _pattern_tensors(height, width, key, device):
+    index, sign, bit, radial_bin = _pattern(height, width, key)
+    return (torch.from_numpy(index).to(device), torch.from_numpy(sign).to(device),
+            torch.from_numpy(bit).to(device), torch.from_numpy(radial_bin).to(device))
+
+
+def _luminance(frames):
+    """[n, H, W, 3]（浮点或uint8）→ [n, H, W] float32 亮度，数值范围与输入相同"""
+    weights = torch.tensor(LUMA, dtype=torch.float32, device=frames.device)
+    # 对最后一维做矩阵乘法，比逐通道切片相加快约3倍
+    return frames.float() @ weights
+
+
+def band_spectrum(luma):
+    """[n, H, W]亮度 → 环带所在列的二维频谱[n, H, band_columns]，等于rfft2结果的前band_columns列"""
+    columns = band_columns(luma.shape[-1])
+    return torch.fft.fft(torch.fft.rfft(luma, dim=-1)[..., :columns], dim=-2)
+
+
+def gain_mask(height, width, key, bits, strength, device):
+    """频谱幅度的增益减1：[H, band_columns]，环带外为0"""
+    index, sign, bit, _ = _pattern_tensors(height, width, key, str(device))
+    symbols = torch.from_numpy(np.where(bits, 1.0, -1.0).astype(np.float32)).to(device)
+    columns = band_columns(width)
+    mask = torch.zeros(height * columns, device=device)
+    mask[index] = torch.expm1(strength * symbols[bit] * sign)
+    return mask.view(height, columns)
+
+
+def embed_chunk(frames, mask, out=None):
+    """把水印嵌入一块帧，结果写入out（默认原地写回frames）
+
+    亮度增量 = irfft2(rfft2(亮度) * (增益 - 1))，三个通道加相同的增量
+    """
+    out = frames if out is None else out
+    count, height, width = frames.shape[:3]
+    with profile_stage("fft", count * height * width * 4):
+        spectrum = torch.fft.ifft(band_spectrum(_luminance(frames)).mul_(mask), dim=-2)
+        padded = torch.zeros(count, height, width // 2 + 1, dtype=spectrum.dtype, device=spectrum.device)
+        padded[..., :spectrum.shape[-1]] = spectrum
+        del spectrum
+        delta = torch.fft.irfft(padded, n=width, dim=-1)
+    del padded
+    with profile_stage("composite", frames.numel() * frames.element_size()):
+        delta = delta.unsqueeze(-1)
+        if frames.dtype == torch.uint8:
+            out.copy_(frames.float().add_(delta).round_().clamp_(0, 255))
+        else:
+            torch.add(frames, delta.to(frames.dtype), out=out).clamp_(0, 1)
+    return out
+
+
+def bit_scores(frames, key):
+    """逐帧计算每个比特的z分数：[n, PAYLOAD_BITS]，正值表示1"""
+    height, width = frames.shape[1], frames.shape[2]
+    index, sign, bit, radial_bin = _pattern_tensors(height, width, key, str(frames.device))
+    with profile_stage("fft", frames.shape[0] * height * width * 4):
+        spectrum = band_spectrum(_luminance(frames))
+    with profile_stage("correlate"):
+        magnitude = spectrum.flatten(1)[:, index].abs().add_(1e-6).log_()
+        del spectrum
+        # 去掉每帧对数幅度随频率变化的趋势，再按径向分箱估计残差的标准差
+        count = torch.bincount(radial_bin, minlength=RADIAL_BINS).clamp_(min=1).float()
+        trend = torch.zeros(magnitude.shape[0], RADIAL_BINS, device=magnitude.device)
+        trend.index_add_(1, radial_bin, magnitude)
+        residual = magnitude - (trend / count)[:, radial_bin]
+        std = residual.std(dim=1, keepdim=True).clamp_(min=1e-6)
+        correlation = torch.zeros(magnitude.shape[0], PAYLOAD_BITS, device=magnitude.device)
+        correlation.index_add_(1, bit, residual * sign)
+        per_bit = len(index) // PAYLOAD_BITS
+    return correlation / (std * per_bit ** 0.5)
+
+
+def detect(scores):
+    """把逐帧z分数[n, PAYLOAD_BITS]合成整段的判定结果"""
+    combined = scores.sum(dim=0) / scores.shape[0] ** 0.5
+    bits = (combined > 0).cpu().numpy()
+    message, valid = decode_payload(bits)
+    score = float(combined.abs().mean())
+    frame_scores = scores.abs().mean(dim=1)
+    return {
+        "message": message,
+        "valid": valid,
+        "score": score,
+        "detected": valid and score >= DETECT_THRESHOLD,
+        "frames": scores.shape[0],
+        "frame_score_min": round(float(frame_scores.min()), 3),
+        "frame_score_mean": round(float(frame_scores.mean()), 3),
+    }
@@ -0,0 +1,79 @@
+"""
+内存统计工具
+
+读取进程的峰值常驻内存（Linux下为/proc/self/status中的VmHWM），
+并按内存上限计算分块处理时每块的帧数。
+
+重置峰值统计作用于整个ComfyUI进程，会打乱宿主中其他的峰值测量，节点只在开启剖析时才重置。
+"""
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def reset_peak_rss():
+    """重置峰值常驻内存统计，成功返回True（仅Linux支持）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_bytes():
+    """当前常驻内存，无法获取时返回0"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_bytes():
+    """峰值常驻内存；不支持重置时为进程启动以来的峰值"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS单位为字节，Linux为KB
+        return peak if sys.platform == "darwin" else peak * 1024
+    return 0
+
+
+class RssMeter:
+    """一次节点执行的内存统计
+
+    reset_peak为True（开启剖析）时先重置进程的峰值常驻内存，报告本次执行的峰值；
+    否则不改动进程级的峰值统计，只报告执行前后常驻内存的变化
+    """
+
+    def __init__(self, reset_peak=False):
+        self.peak = reset_peak and reset_peak_rss()
+        self.start_rss = current_rss_bytes()
+
+    def summary(self):
+        """返回(常驻内存, 本次增加, 日志文字)，统计峰值时前两项为峰值"""
+        rss = peak_rss_bytes() if self.peak else current_rss_bytes()
+        increase = max(rss - self.start_rss, 0)
+        label = "峰值内存" if self.peak else "常驻内存"
+        return rss, increase, f"{label}{rss / 1048576:.0f}MB(本次增加{increase / 1048576:.0f}MB)"
+
+
+def chunk_frames(frame_bytes, memory_limit_mb, batch_size):
+    """按内存上限计算每块处理的帧数（至少1帧）"""
+    if memory_limit_mb <= 0:
+        return batch_size
+    frames = int(memory_limit_mb * 1024 * 1024 // max(frame_bytes, 1))
+    return max(1, min(batch_size, frames))
@@ -0,0 +1,189 @@
+"""
+水印结果缓存
+
+对输入图像做抽样哈希和逐帧校验和，再与全部参数一起生成确定性的指纹，
+用于进程内（可选落盘）的结果缓存，相同的输入和参数重复执行时直接返回结果。
+ComfyUI本身已缓存节点输出，这里默认关闭：ALWAYSONLINE_WATERMARK_CACHE_MB或ALWAYSONLINE_WATERMARK_CACHE_DIR
+设置后才启用，未启用时不计算指纹。
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+
+# 抽样哈希时最多读取的元素数
+FINGERPRINT_SAMPLES = 1 << 20
+
+DEFAULT_MEMORY_MB = int(os.environ.get("ALWAYSONLINE_WATERMARK_CACHE_MB", "0"))
+DEFAULT_DISK_DIR = os.environ.get("ALWAYSONLINE_WATERMARK_CACHE_DIR", "")
+DEFAULT_DISK_MB = int(os.environ.get("ALWAYSONLINE_WATERMARK_CACHE_DISK_MB", "4096"))
+
+
+def frame_checksums(tensor):
+    """每帧原始字节按int64回绕求和，任意单个像素变化都会改变结果
+
+    整数回绕加法与求和顺序无关，多线程归约也总是得到相同的值；
+    只读一遍内存，比逐字节哈希快得多。无法按8字节对齐时返回None。
+    """
+    if tensor.dim() == 0 or tensor.numel() == 0:
+        return None
+    frames = tensor.detach().reshape(tensor.shape[0], -1)
+    if (frames.shape[1] * frames.element_size()) % 8 != 0 or not frames.is_contiguous():
+        return None
+    try:
+        return frames.view(torch.int64).sum(dim=1)
+    except RuntimeError:
+        return None
+
+
+def fingerprint_tensor(tensor, max_samples=FINGERPRINT_SAMPLES):
+    """张量指纹：形状、类型、每帧校验和，加上跨整个张量等间隔抽取的最多max_samples个元素
+
+    步长取奇数且不是3的倍数，避免总是落在同一个颜色通道上。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((tuple(tensor.shape), str(tensor.dtype))).encode())
+    flat = tensor.detach().reshape(-1)
+    stride = max(1, flat.numel() // max_samples)
+    if stride > 1:
+        stride |= 1
+        if stride % 3 == 0:
+            stride += 2
+    sample = flat[::stride].cpu().contiguous()
+    digest.update(sample.numpy().tobytes())
+    # 最后一个元素单独计入，覆盖末尾未被抽到的帧
+    if flat.numel() > 0:
+        digest.update(flat[-1:].cpu().numpy().tobytes())
+    checksums = frame_checksums(tensor)
+    if checksums is not None:
+        digest.update(checksums.cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint(image, params):
+    """图像 + 参数的指纹"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(fingerprint_tensor(image).encode())
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode())
+    return digest.hexdigest()
+
+
+class OutputCache:
+    """按字节预算做LRU淘汰的结果缓存，可选把结果写入磁盘目录
+
+    缓存中保存结果的副本，命中时也返回副本：下游节点原地修改输出不会影响缓存中的内容
+    """
+
+    def __init__(self, memory_bytes, disk_dir="", disk_bytes=0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.memory_bytes > 0 or (bool(self.disk_dir) and self.disk_bytes > 0)
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if result is not None:
+            return result.clone()
+
+        result = self._load_from_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, result)
+        return result
+
+    def put(self, key, result):
+        self._put_memory(key, result)
+        self._save_to_disk(key, result)
+
+    def _put_memory(self, key, result):
+        size = result.numel() * result.element_size()
+        with self._lock:
+            if size > self.memory_bytes or key in self._entries:
+                return
+        result = result.clone()
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = result
+            self.used_bytes += size
+            while self.used_bytes > self.memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= evicted.numel() * evicted.element_size()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            result = torch.load(path, map_location="cpu")
+            os.utime(path)
+            return result
+        except Exception as e:
+            print(f"[MovingWatermark] 读取缓存失败: {e}")
+            return None
+
+    def _save_to_disk(self, key, result):
+        if not self.disk_dir or self.disk_bytes <= 0:
+            return
+        size = result.numel() * result.element_size()
+        if size > self.disk_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # 先写临时文件再改名，避免并发读到写了一半的文件
+            path = self._disk_path(key)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(result.cpu(), temp_path)
+            os.replace(temp_path, path)
+            self._evict_disk()
+        except Exception as e:
+            print(f"[MovingWatermark] 写入缓存失败: {e}")
+
+    def _evict_disk(self):
+        """按最近访问时间淘汰，直到磁盘占用回到预算以内"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".pt"):
+                path = os.path.join(self.disk_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_mb": round(self.used_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+output_cache = OutputCache(DEFAULT_MEMORY_MB * 1024 * 1024, DEFAULT_DISK_DIR, DEFAULT_DISK_MB * 1024 * 1024)
@@ -0,0 +1,73 @@
+"""
+进程级水印贴图缓存
+
+按(文字, 字体, 字号, 颜色, 描边, 阴影, 模糊, 字形摘要)缓存已渲染好的RGBA贴图，
+所有MovingWatermark实例共享，超出内存预算时按LRU淘汰。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# 缓存内存预算，可通过环境变量调整（单位MB）
+DEFAULT_BUDGET_MB = int(os.environ.get("ALWAYSONLINE_SPRITE_CACHE_MB", "256"))
+
+
+def sprite_cost(sprite):
+    """估算一张贴图占用的内存：uint8原图 + float32的预乘颜色和(1 - alpha)各3通道"""
+    return sprite.rgba.nbytes * 7
+
+
+class SpriteCache:
+    """带内存预算的LRU贴图缓存（线程安全）"""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """命中则返回缓存贴图，否则调用render()渲染并写入缓存"""
+        with self._lock:
+            sprite = self._entries.get(key)
+            if sprite is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = render()
+        cost = sprite_cost(sprite)
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            # 单张贴图超过预算时不缓存
+            if cost > self.budget_bytes:
+                return sprite
+            self._entries[key] = sprite
+            self.used_bytes += cost
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= sprite_cost(evicted)
+        return sprite
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_mb": round(self.used_bytes / (1024 * 1024), 2),
+                "budget_mb": round(self.budget_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+sprite_cache = SpriteCache(DEFAULT_BUDGET_MB * 1024 * 1024)
@@ -0,0 +1,228 @@
+"""
+向量化轨迹引擎
+
+一次性为一批帧计算水印的字号、旋转角度和位置（NumPy数组），
+随机轨迹由种子决定，相同参数总能得到相同的结果，因此整张轨迹表可以缓存。
+"""
+from functools import lru_cache
+import numpy as np
+
+TRAJECTORIES = ["水平", "垂直", "圆形", "对角线", "随机", "螺旋", "波浪", "弹跳", "心形", "自定义路径"]
+AUTO_ROTATE_TRAJECTORIES = ("圆形", "螺旋", "心形")
+INTERPOLATIONS = ["最近点", "线性", "样条"]
+
+# 心形轨迹的采样点数
+HEART_POINTS = 100
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+class TrajectoryTable:
+    """一批帧的轨迹参数，每个属性都是长度为batch_size的只读数组
+
+    x, y为文字绘制原点（左上角），已完成居中和边界约束
+    """
+
+    def __init__(self, frames, size, angle, text_width, text_height, x, y):
+        self.frames = frames
+        self.size = size
+        self.angle = angle
+        self.text_width = text_width
+        self.text_height = text_height
+        self.x = x
+        self.y = y
+        for values in (frames, size, angle, text_width, text_height, x, y):
+            values.setflags(write=False)
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def _splitmix64(values):
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def hash_uniform(seed, keys, stream=0):
+    """由(种子, 键, 流编号)确定的[0, 1)均匀分布随机数，与调用顺序无关"""
+    keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+    mixed = _splitmix64(np.full(keys.shape, seed & _MASK64, dtype=np.uint64))
+    mixed = _splitmix64(mixed ^ (keys * np.uint64(2) + np.uint64(stream & 1)))
+    return (mixed >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def heart_points(num_points=HEART_POINTS):
+    """生成心形轨迹的归一化坐标点 [num_points, 2]"""
+    t = 2 * np.pi * np.arange(num_points) / num_points
+    # 心形参数方程
+    x = 16 * np.sin(t) ** 3
+    y = 13 * np.cos(t) - 5 * np.cos(2 * t) - 2 * np.cos(3 * t) - np.cos(4 * t)
+    # 归一化到0-1范围
+    x_norm = (x + 16) / 32 * 0.5 + 0.25  # 水平居中
+    y_norm = (y + 18) / 31 * 0.5 + 0.25  # 垂直居中
+    return np.stack([x_norm, y_norm], axis=1)
+
+
+def parse_custom_path(custom_path):
+    """把JSON解析出的路径转换成[N, 2]数组，无效的点按画面中心处理"""
+    points = []
+    for point in custom_path or []:
+        if isinstance(point, (list, tuple)) and len(point) >= 2:
+            try:
+                points.append((float(point[0]), float(point[1])))
+                continue
+            except (TypeError, ValueError):
+                pass
+        points.append((0.5, 0.5))
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
+def sample_path(points, progress, interpolation="最近点"):
+    """按进度在关键帧之间取点
+
+    最近点：与原实现一致，按进度落在的区间直接取关键帧
+    线性：相邻关键帧之间线性插值
+    样条：Catmull-Rom样条插值，曲线经过每个关键帧
+    """
+    count = len(points)
+    if interpolation == "最近点" or count == 1:
+        idx = np.minimum((progress * count).astype(np.int64), count - 1)
+        return points[idx]
+
+    position = progress * (count - 1)
+    idx = np.minimum(np.floor(position).astype(np.int64), count - 2)
+    t = (position - idx)[:, None]
+    p1 = points[idx]
+    p2 = points[idx + 1]
+    if interpolation == "线性":
+        return p1 + (p2 - p1) * t
+
+    p0 = points[np.maximum(idx - 1, 0)]
+    p3 = points[np.minimum(idx + 2, count - 1)]
+    t2 = t * t
+    t3 = t2 * t
+    return 0.5 * ((2 * p1) + (-p0 + p2) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2 + (-p0 + 3 * p1 - 3 * p2 + p3) * t3)
+
+
+def frame_sizes(frames, font_size, speed, total_frames, dynamic_size, min_size, max_size, size_step=1):
+    """计算每帧的字体大小，size_step>1时把动态字号量化到对应的档位以提高贴图缓存命中率"""
+    if not dynamic_size:
+        return np.full(len(frames), font_size, dtype=np.int64)
+    size_progress = frames * speed / total_frames
+    size_factor = (np.sin(size_progress * 2 * np.pi) + 1) / 2
+    sizes = (min_size + size_factor * (max_size - min_size)).astype(np.int64)
+    if size_step > 1:
+        sizes = (np.round(sizes / size_step) * size_step).astype(np.int64)
+        sizes = np.clip(sizes, min(min_size, max_size), max(min_size, max_size))
+    return sizes
+
+
+def frame_angles(frames, rotation, speed, total_frames, trajectory):
+    """计算每帧的旋转角度，圆形/螺旋/心形轨迹在未指定角度时自动旋转"""
+    if rotation == 0 and trajectory in AUTO_ROTATE_TRAJECTORIES:
+        return frames * speed / total_frames * 360
+    return np.full(len(frames), float(rotation))
+
+
+def trajectory_centers(frames, width, height, text_width, text_height, total_frames, trajectory, speed,
+                       custom_points, seed=0, interpolation="最近点"):
+    """计算每帧水印中心的位置，支持多种轨迹模式"""
+    # 计算基于速度和帧索引的进度
+    progress = np.mod(frames * speed, total_frames) / total_frames
+    normalized_progress = progress * 2 * np.pi  # 用于周期性运动
+    sweep_x = progress * (width + text_width) - text_width * 0.5
+    sweep_y = progress * (height + text_height) - text_height * 0.5
+    center_x = np.full(len(frames), width * 0.5)
+    center_y = np.full(len(frames), height * 0.5)
+
+    # 优先处理自定义路径
+    if trajectory == "自定义路径" and len(custom_points) > 0:
+        points = sample_path(custom_points, progress, interpolation)
+        return points[:, 0] * width, points[:, 1] * height
+
+    if trajectory == "水平":
+        # 从左侧开始，移动到右侧
+        return sweep_x, center_y
+    elif trajectory == "垂直":
+        # 从顶部开始，移动到底部
+        return center_x, sweep_y
+    elif trajectory == "圆形":
+        radius = min(width, height) * 0.3
+        return width * 0.5 + radius * np.cos(normalized_progress), height * 0.5 + radius * np.sin(normalized_progress)
+    elif trajectory == "对角线":
+        # 从左上角移动到右下角
+        return sweep_x, sweep_y
+    elif trajectory == "随机":
+        # 每隔一段帧跳到新的随机位置，位置只由种子和所在的段决定
+        segment = frames // max(1, int(10 / speed))
+        x = text_width * 0.5 + hash_uniform(seed, segment, 0) * (width - text_width)
+        y = text_height * 0.5 + hash_uniform(seed, segment, 1) * (height - text_height)
+        return x, y
+    elif trajectory == "螺旋":
+        # 螺旋轨迹：半径随时间增加
+        radius = min(width, height) * (0.1 + 0.4 * progress)
+        return width * 0.5 + radius * np.cos(normalized_progress * 4), height * 0.5 + radius * np.sin(normalized_progress * 4)
+    elif trajectory == "波浪":
+        # 波浪轨迹：水平移动+垂直波动
+        return sweep_x, height * 0.5 + height * 0.1 * np.sin(normalized_progress * 4)
+    elif trajectory == "弹跳":
+        # 弹跳轨迹：模拟弹跳球
+        bounce_progress = progress * 2
+        bounce_progress = np.where(bounce_progress > 1, 2 - bounce_progress, bounce_progress)
+        height_factor = 1 - (bounce_progress - 1) ** 2  # 抛物线运动
+        return sweep_x, height * (0.1 + 0.8 * height_factor)
+    elif trajectory == "心形":
+        points = heart_points()
+        idx = np.minimum((progress * len(points)).astype(np.int64), len(points) - 1)
+        return points[idx, 0] * width, points[idx, 1] * height
+
+    # 默认居中
+    return center_x, center_y
+
+
+@lru_cache(maxsize=64)
+def _cached_table(frame_index, batch_size, width, height, total_frames, trajectory, speed, custom_path,
+                  font_size, dynamic_size, min_size, max_size, size_step, rotation, metrics, seed, interpolation):
+    frames = np.arange(frame_index, frame_index + batch_size, dtype=np.int64)
+    sizes = frame_sizes(frames, font_size, speed, total_frames, dynamic_size, min_size, max_size, size_step)
+    angles = frame_angles(frames, rotation, speed, total_frames, trajectory)
+
+    metrics = dict(metrics)
+    text_width = np.array([metrics[s][0] for s in sizes], dtype=np.float64)
+    text_height = np.array([metrics[s][1] for s in sizes], dtype=np.float64)
+
+    custom_points = np.array(custom_path, dtype=np.float64).reshape(-1, 2)
+    x, y = trajectory_centers(frames, width, height, text_width, text_height, total_frames,
+                              trajectory, speed, custom_points, seed, interpolation)
+
+    # 调整位置为中心点，并确保位置在图像范围内
+    x = np.maximum(0, np.minimum(width - text_width, x - text_width / 2))
+    y = np.maximum(0, np.minimum(height - text_height, y - text_height / 2))
+
+    # 如果是单张图片且使用水平轨迹，调整到右下角
+    if total_frames == 1 and trajectory == "水平" and len(custom_points) == 0:
+        x = width - text_width - 20  # 右边距20像素
+        y = height - text_height - 20  # 下边距20像素
+
+    return TrajectoryTable(frames, sizes, angles, text_width, text_height, x, y)
+
+
+def build_trajectory_table(frame_index, batch_size, width, height, total_frames, trajectory, speed, custom_path,
+                           font_size, dynamic_size, min_size, max_size, size_step, rotation, measure,
+                           seed=0, interpolation="最近点"):
+    """计算一批帧的轨迹表
+
+    measure(字号) -> (文字宽, 文字高)，每种字号只会调用一次；
+    结果按全部参数缓存，重复执行同样的批次不会重新计算。
+    """
+    if total_frames <= 0:
+        total_frames = 1
+    frames = np.arange(frame_index, frame_index + batch_size, dtype=np.int64)
+    sizes = frame_sizes(frames, font_size, speed, total_frames, dynamic_size, min_size, max_size, size_step)
+    metrics = tuple((int(s), tuple(measure(int(s)))) for s in np.unique(sizes))
+    custom_points = tuple(map(tuple, parse_custom_path(custom_path).tolist()))
+    return _cached_table(frame_index, batch_size, width, height, total_frames, trajectory, float(speed),
+                         custom_points, font_size, bool(dynamic_size), min_size, max_size, size_step,
+                         float(rotation), metrics, int(seed), interpolation)